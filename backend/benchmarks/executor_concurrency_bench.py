@@ -0,0 +1,171 @@
+"""
+Concurrent throughput of the matching request path, with and without the executors.
+
+Simulates the work of a /get_results request on one event loop: the color
+match over a synthetic store catalog (ProductMatchIndex, CPU), the hex
+conversions (color_tools, CPU) and the two ERP calls for availability and
+product data (blocking I/O, simulated with a fixed latency). Each mode serves
+the same number of requests at a fixed concurrency:
+- inline: the blocking calls run on the event loop (before lib.executors)
+- executors: CPU work on cpu_executor, the ERP calls on io_executor
+
+Reports throughput, request latency and the longest event loop stall, i.e.
+how long the loop could not serve any other request.
+
+Usage (from backend/):
+    python -m benchmarks.executor_concurrency_bench --requests 400 --concurrency 1 8 32 --erp-latency-ms 40
+    CPU_EXECUTOR_WORKERS=4 IO_EXECUTOR_WORKERS=64 python -m benchmarks.executor_concurrency_bench --json bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from lib import color_tools
+from lib.executors import CPU_EXECUTOR_WORKERS, IO_EXECUTOR_WORKERS, run_cpu, run_io
+from lib.product_catalog import ProductCatalog
+from lib.product_match_index import ProductMatchIndex
+
+
+def synthetic_catalog(rng: random.Random, size: int) -> ProductCatalog:
+    return ProductCatalog('dm', ({
+        'product_id': f'p{i}',
+        'gtin': str(4000000000000 + i),
+        'dan': str(100000 + i),
+        'brand': rng.choice(['Catrice', 'essence', 'Maybelline', 'alverde']),
+        'type': 'foundation',
+        'title': f'Foundation {i}',
+        'color_lab': [rng.uniform(30, 80), rng.uniform(0, 25), rng.uniform(5, 35)],
+        'color_hex': '#c4a995',
+        'rescanned': True,
+    } for i in range(size)))
+
+
+class SimulatedRequest:
+    """The CPU and I/O stages of one matching request."""
+
+    def __init__(self, index: ProductMatchIndex, erp_latency: float, length: int):
+        self.index = index
+        self.erp_latency = erp_latency
+        self.length = length
+
+    def match(self, target_color: List[float]) -> List[Dict[str, Any]]:
+        products = []
+        for product, distance, corrected_color in self.index.query('dm', target_color, limit=self.length):
+            product = product.copy()
+            product['color_distance'] = distance
+            products.append(product)
+        return products
+
+    def color_math(self, colors: List[List[float]]) -> List[str]:
+        return [color_tools.lab_to_hex(*color) for color in colors]
+
+    def erp_calls(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Availability and product data: two blocking round trips
+        time.sleep(self.erp_latency)
+        time.sleep(self.erp_latency)
+        return products
+
+    async def inline(self, target_color: List[float], colors: List[List[float]]):
+        self.color_math(colors)
+        return self.erp_calls(self.match(target_color))
+
+    async def with_executors(self, target_color: List[float], colors: List[List[float]]):
+        await run_cpu(self.color_math, colors)
+        products = await run_cpu(self.match, target_color)
+        return await run_io(self.erp_calls, products)
+
+
+async def run_mode(handler: Callable, rng: random.Random, total: int, concurrency: int) -> Dict[str, Any]:
+    latencies = []
+    max_stall = 0.0
+    done = asyncio.Event()
+
+    async def watch_loop():
+        # A 1 ms ticker; any extra delay is time the loop was blocked
+        nonlocal max_stall
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_stall = max(max_stall, time.perf_counter() - start - 0.001)
+
+    requests = [([rng.uniform(40, 70), rng.uniform(8, 18), rng.uniform(12, 24)],
+                 [[rng.uniform(40, 70), rng.uniform(8, 18), rng.uniform(12, 24)] for _ in range(4)])
+                for _ in range(total)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(target_color, colors):
+        async with semaphore:
+            start = time.perf_counter()
+            await handler(target_color, colors)
+            latencies.append(time.perf_counter() - start)
+
+    watcher = asyncio.create_task(watch_loop())
+    start = time.perf_counter()
+    await asyncio.gather(*(one(target_color, colors) for target_color, colors in requests))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await watcher
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'throughput_rps': total / elapsed,
+        'latency_ms_p50': statistics.median(latencies) * 1000,
+        'latency_ms_p95': latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+        'max_loop_stall_ms': max_stall * 1000,
+    }
+
+
+def print_report(results: List[Dict[str, Any]]):
+    header = f"{'mode':<12}{'concurrency':>12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'loop stall ms':>15}"
+    print("\n" + header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['mode']:<12}{r['concurrency']:>12}{r['throughput_rps']:>10.1f}{r['latency_ms_p50']:>10.1f}"
+              f"{r['latency_ms_p95']:>10.1f}{r['max_loop_stall_ms']:>15.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400, help='requests per mode and concurrency')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--catalog-size', type=int, default=5000)
+    parser.add_argument('--length', type=int, default=100, help='matches per request')
+    parser.add_argument('--erp-latency-ms', type=float, default=40.0, help='latency of each simulated ERP call')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    index = ProductMatchIndex()
+    index.build('dm', synthetic_catalog(rng, args.catalog_size))
+    request = SimulatedRequest(index, args.erp_latency_ms / 1000, args.length)
+    print(f"Catalog of {args.catalog_size} products, ERP latency {args.erp_latency_ms:.0f} ms per call, "
+          f"executors: {CPU_EXECUTOR_WORKERS} CPU / {IO_EXECUTOR_WORKERS} I/O workers")
+
+    results = []
+    for concurrency in args.concurrency:
+        for mode, handler in (('inline', request.inline), ('executors', request.with_executors)):
+            result = asyncio.run(run_mode(handler, random.Random(args.seed), args.requests, concurrency))
+            result['mode'] = mode
+            results.append(result)
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
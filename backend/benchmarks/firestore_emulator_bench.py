@@ -0,0 +1,381 @@
+"""
+Firestore emulator benchmark for the product and clients services.
+
+Seeds a synthetic product catalog and client population into the local
+Firestore emulator at several scales and measures the Firestore-bound code
+paths: latency, document reads/writes and bytes per operation.
+
+Usage (from backend/):
+    gcloud emulators firestore start --host-port=localhost:8085
+    export FIRESTORE_EMULATOR_HOST=localhost:8085
+    python -m benchmarks.firestore_emulator_bench --scales 1000 10000 100000 --json bench.json
+
+Every scale runs in its own emulator project (bench-<scale>) that is wiped
+before seeding, so runs are reproducible. Reads and writes are counted the way
+Firestore bills them (one read per returned document, at least one per query;
+one write per document write) and bytes use Firestore's storage size rules.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_document import DocumentSnapshot
+
+from lib.clients_db import ClientsDBFirestore
+from lib.firestore_product_service import FirestoreProductService
+
+
+BRANDS = ['Catrice', 'essence', 'Maybelline', "L'Oréal Paris", 'Manhattan', 'alverde', 'Nyx', 'Rimmel']
+TYPES = ['foundation', 'concealer', 'powder', 'highlighter', 'BB-cream and CC-cream']
+
+
+def document_size(value: Any) -> int:
+    """Storage size of a Firestore value (https://firebase.google.com/docs/firestore/storage-size)."""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, datetime):
+        return 8
+    if isinstance(value, dict):
+        return sum(len(str(k).encode('utf-8')) + 1 + document_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(document_size(v) for v in value)
+    return len(str(value)) + 1
+
+
+class OpCounter:
+    """Accumulates billed reads/writes and bytes of the Firestore calls made through a CountingProxy."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.reads = 0
+        self.writes = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            'reads': self.reads,
+            'writes': self.writes,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+        }
+
+    def read(self, snapshot: DocumentSnapshot):
+        self.reads += 1
+        if snapshot.exists:
+            self.bytes_read += document_size(snapshot.to_dict() or {})
+
+    def write(self, data: Any = None):
+        self.writes += 1
+        if isinstance(data, dict):
+            self.bytes_written += document_size(data)
+
+
+WRITE_METHODS = {'set', 'update', 'create', 'delete'}
+CHAINED_METHODS = {'collection', 'document', 'where', 'select', 'limit', 'order_by',
+                   'start_after', 'start_at', 'batch', 'bulk_writer', 'collection_group', 'count'}
+
+
+def _unwrap(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    return value._target if isinstance(value, CountingProxy) else value
+
+
+class CountingProxy:
+    """
+    Wraps a Firestore client (and the references/queries derived from it) and
+    records billed operations in an OpCounter.
+    """
+
+    def __init__(self, target: Any, counter: OpCounter):
+        self._target = target
+        self._counter = counter
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            args = [_unwrap(a) for a in args]
+            kwargs = {k: _unwrap(v) for k, v in kwargs.items()}
+            result = attr(*args, **kwargs)
+            return self._observe(name, args, result)
+
+        return call
+
+    def _observe(self, name: str, args: List[Any], result: Any) -> Any:
+        counter = self._counter
+        if name in WRITE_METHODS:
+            # DocumentReference.set(data) or WriteBatch/BulkWriter.set(ref, data)
+            data = next((a for a in args if isinstance(a, dict)), None)
+            counter.write(data)
+            return result
+        if name == 'get' and isinstance(result, DocumentSnapshot):
+            counter.read(result)
+            return result
+        if name == 'get' and isinstance(result, list) and result and isinstance(result[0], list):
+            # Aggregation query (count()): billed as one read per 1000 index entries, at least one
+            counter.reads += 1
+            return result
+        if name == 'get' and isinstance(result, list):
+            for snapshot in result:
+                counter.read(snapshot)
+            if not result:
+                counter.reads += 1
+            return result
+        if name in ('stream', 'get_all'):
+            return self._count_stream(result)
+        if name in CHAINED_METHODS:
+            return CountingProxy(result, counter)
+        return result
+
+    def _count_stream(self, iterator):
+        seen = 0
+        for snapshot in iterator:
+            seen += 1
+            self._counter.read(snapshot)
+            yield snapshot
+        if seen == 0:
+            # An empty query is billed as one read
+            self._counter.reads += 1
+
+
+def reset_emulator(project_id: str):
+    host = os.environ['FIRESTORE_EMULATOR_HOST']
+    url = f"http://{host}/emulator/v1/projects/{project_id}/databases/(default)/documents"
+    request = urllib.request.Request(url, method='DELETE')
+    urllib.request.urlopen(request).close()
+
+
+def synthetic_product(i: int, rng: random.Random) -> Dict[str, Any]:
+    L, a, b = rng.uniform(35, 75), rng.uniform(5, 20), rng.uniform(8, 28)
+    dan = str(1000000 + i)
+    return {
+        'id': f"bench-{i:07d}",
+        'data': {
+            'gtin': str(4000000000000 + i),
+            'dan': dan,
+            'brand': rng.choice(BRANDS),
+            'type': rng.choice(TYPES),
+            'title': f"Synthetic shade {i % 60:03d}",
+            'product_line': f"Line {i % 200}",
+            'color_lab': [L, a, b],
+            'color_hex': '#%02x%02x%02x' % (rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+            'features': {'Deckkraft': rng.choice(['leicht', 'mittel', 'hoch']), 'Finish': 'matt'},
+            'ingredients': 'AQUA, CYCLOPENTASILOXANE, GLYCERIN, ' * 8,
+            'retailers': {
+                'dm': {
+                    'dan': dan,
+                    'price': round(rng.uniform(2.95, 24.95), 2),
+                    'product_link': f"https://www.dm.de/p{dan}.html",
+                    'image_path': f"https://media.dm-static.com/images/{dan}",
+                }
+            },
+        },
+    }
+
+
+def synthetic_client(rng: random.Random, timestamp: datetime, recommendations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    colors = [[rng.uniform(40, 70), rng.uniform(8, 18), rng.uniform(12, 24)] for _ in range(3)]
+    avg = [sum(c[k] for c in colors) / 3 for k in range(3)]
+    return {
+        'client_id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'face_landmarks': {'type': 'camera', 'image': '', 'landmarks': [[rng.random(), rng.random()] for _ in range(68)]},
+        'colors_lab': colors,
+        'colors_hex': ['#c4a995', '#c1a18c', '#caa08e'],
+        'color_avg_lab': avg,
+        'color_avg_hex': '#c4a995',
+        'option_data': {'hair_color': rng.choice(['brown', 'blond', 'black']), 'skin_type': rng.choice(['oily', 'dry'])},
+        'retailer': 'dm',
+        'store_location': rng.choice(['D522', 'D2KK']),
+        'browser_name': 'Chrome',
+        'clarity_id': '',
+        'result_page_timestamp': timestamp.isoformat(),
+        # Stored as references, the way get_results saves sessions
+        'recommendation_refs': [{'product_id': product['product_id'], 'dan': '', 'color_distance': product['color_distance'],
+                                 'rank': rank, 'catalog_version': '2025-01-01T00:00:00.000+00:00'}
+                                for rank, product in enumerate(recommendations, start=1)],
+    }
+
+
+def synthetic_recommendations(rng: random.Random, catalog: List[Dict[str, Any]], n: int = 100) -> List[Dict[str, Any]]:
+    results = []
+    for product in rng.sample(catalog, min(n, len(catalog))):
+        data = product['data']
+        results.append({
+            'product_id': product['id'],
+            'product_brand_name': data['brand'],
+            'product_description': f"{data['title']} {data['product_line']}",
+            'product_color_swatch': data['color_hex'],
+            'product_image': data['retailers']['dm']['image_path'],
+            'product_link': data['retailers']['dm']['product_link'],
+            'price': f"{data['retailers']['dm']['price']} €",
+            'type': data['type'],
+            'match_percentage': f"{rng.randint(50, 99)}%",
+            'color_distance': rng.uniform(1, 25),
+            'erp_connection': True,
+            'instore_status': True,
+            'online_status': True,
+            'stock_level': rng.randint(0, 9),
+            'store_brand': 'dm',
+            'features': data['features'],
+            'ingredients': data['ingredients'],
+        })
+    return results
+
+
+def measure(name: str, counter: OpCounter, fn: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    latencies = []
+    totals = {'reads': 0, 'writes': 0, 'bytes_read': 0, 'bytes_written': 0}
+    for _ in range(repeat):
+        counter.reset()
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+        for key, value in counter.snapshot().items():
+            totals[key] += value
+    latencies.sort()
+    return {
+        'operation': name,
+        'runs': repeat,
+        'latency_ms_mean': statistics.fmean(latencies),
+        'latency_ms_p50': latencies[len(latencies) // 2],
+        'latency_ms_p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        **{f"{key}_per_op": value / repeat for key, value in totals.items()},
+    }
+
+
+def run_scale(scale: int, repeat: int, seed: int) -> List[Dict[str, Any]]:
+    project_id = f"bench-{scale}"
+    print(f"\n=== Scale {scale}: seeding emulator project {project_id} ===")
+    reset_emulator(project_id)
+    rng = random.Random(seed)
+    counter = OpCounter()
+
+    products_service = FirestoreProductService(project_id=project_id, database_id='(default)')
+    products_service.db = CountingProxy(products_service.db, counter)
+    products_service.collection = CountingProxy(products_service.collection, counter)
+    products_service.facets_doc = CountingProxy(products_service.facets_doc, counter)
+
+    catalog = [synthetic_product(i, rng) for i in range(scale)]
+    start = time.perf_counter()
+    successful, failed = products_service.batch_create_products(catalog)
+    print(f"Seeded {successful} products ({failed} failed) in {time.perf_counter() - start:.1f}s")
+
+    client = CountingProxy(firestore.Client(project=project_id, database='(default)'), counter)
+    clients_db = ClientsDBFirestore(client, lazy_load=False)
+    recommendations = synthetic_recommendations(rng, catalog)
+    base_time = datetime(2025, 1, 1)
+    start = time.perf_counter()
+    for i in range(scale):
+        fields = synthetic_client(rng, base_time + timedelta(minutes=i), recommendations)
+        clients_db.save_new_client(**fields)
+        if (i + 1) % 5000 == 0:
+            print(f"  seeded {i + 1}/{scale} clients")
+    print(f"Seeded {scale} clients in {time.perf_counter() - start:.1f}s")
+
+    results = []
+
+    def products_by_store_cold():
+        products_service.clear_cache()
+        products_service.get_products_by_store('dm')
+
+    results.append(measure('get_products_by_store (cold)', counter, products_by_store_cold, repeat))
+    results.append(measure('get_products_by_store (cached)', counter,
+                           lambda: products_service.get_products_by_store('dm'), repeat))
+
+    new_clients = []
+
+    def save_new_client():
+        fields = synthetic_client(rng, datetime.now(), recommendations)
+        new_clients.append(fields['client_id'])
+        clients_db.save_new_client(**fields)
+
+    results.append(measure('save_new_client', counter, save_new_client, repeat))
+
+    exit_ids = iter(list(new_clients))
+
+    def exit_update():
+        clients_db.exit_update(next(exit_ids), datetime.now().isoformat(), {'others': ['Available']},
+                               recommendations[:3])
+
+    results.append(measure('exit_update', counter, exit_update, repeat))
+    results.append(measure('generate_summary_table', counter, clients_db.generate_summary_table, repeat))
+    startup_repeat = max(1, repeat // 5)
+    results.append(measure('ClientsDBFirestore startup (sync)', counter,
+                           lambda: ClientsDBFirestore(client, lazy_load=False), startup_repeat))
+    # Lazy startup: time until writes are accepted, then until the summary is loaded
+    results.append(measure('ClientsDBFirestore startup (lazy)', counter,
+                           lambda: ClientsDBFirestore(client), startup_repeat))
+    results.append(measure('ClientsDBFirestore lazy load', counter,
+                           lambda: ClientsDBFirestore(client).wait_until_loaded(), startup_repeat))
+    snapshot_path = os.path.join(tempfile.gettempdir(), f'bench-{scale}-summary.json.gz')
+    ClientsDBFirestore(client, lazy_load=False, snapshot_path=snapshot_path)
+    results.append(measure('ClientsDBFirestore lazy load (snapshot)', counter,
+                           lambda: ClientsDBFirestore(client, snapshot_path=snapshot_path).wait_until_loaded(),
+                           startup_repeat))
+    os.remove(snapshot_path)
+
+    for result in results:
+        result['scale'] = scale
+    return results
+
+
+def print_report(results: List[Dict[str, Any]]):
+    header = f"{'scale':>7}  {'operation':<40}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}" \
+             f"{'reads':>10}{'writes':>9}{'KB read':>10}{'KB written':>12}"
+    print("\n" + header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['scale']:>7}  {r['operation']:<40}{r['latency_ms_mean']:>10.1f}{r['latency_ms_p50']:>10.1f}"
+              f"{r['latency_ms_p95']:>10.1f}{r['reads_per_op']:>10.1f}{r['writes_per_op']:>9.1f}"
+              f"{r['bytes_read_per_op'] / 1024:>10.1f}{r['bytes_written_per_op'] / 1024:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='catalog size and client population per run')
+    parser.add_argument('--repeat', type=int, default=20, help='measured runs per operation')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        parser.error('FIRESTORE_EMULATOR_HOST is not set; start the Firestore emulator first')
+
+    results = []
+    for scale in args.scales:
+        results.extend(run_scale(scale, args.repeat, args.seed))
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
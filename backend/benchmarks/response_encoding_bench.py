@@ -0,0 +1,161 @@
+"""
+Payload size and encode time of the product list responses.
+
+Builds a synthetic /get_results payload (products formatted like
+FoundationMatchingService._format_results, with features, ingredients and
+optionally the scanning history) and encodes it:
+- fastapi: the default path for a returned dict (jsonable_encoder, then
+  json.dumps as Starlette's JSONResponse does), uncompressed
+- json / orjson / msgpack bodies (lib.responses), each uncompressed, with
+  gzip and with brotli
+
+Reports the median encode time (serialization plus compression), the body
+size and the transfer time at a given bandwidth. Encoders whose optional
+package is not installed are skipped.
+
+Usage (from backend/):
+    python -m benchmarks.response_encoding_bench --products 100 --history --bandwidth-mbit 2
+    python -m benchmarks.response_encoding_bench --products 100 300 --json bench.json
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder
+
+from lib import responses
+
+INGREDIENTS = ["Aqua", "Cyclopentasiloxane", "Glycerin", "Titanium Dioxide", "Dimethicone", "Isododecane",
+               "Butylene Glycol", "Iron Oxides", "Tocopherol", "Sodium Chloride", "Phenoxyethanol", "Parfum"]
+
+
+def synthetic_product(rng: random.Random, i: int, history: bool) -> Dict[str, Any]:
+    lab = [rng.uniform(30, 80), rng.uniform(0, 25), rng.uniform(5, 35)]
+    product = {
+        'product_id': f'p{i}',
+        'product_brand_name': rng.choice(['Catrice', 'essence', 'Maybelline', 'alverde', "L'Oréal Paris"]),
+        'product_description': f'Foundation {i} Skin Perfect Matte',
+        'product_color_swatch': '#%02x%02x%02x' % tuple(rng.randrange(256) for _ in range(3)),
+        'product_image': f'https://media.example.com/products/{i}.jpg',
+        'product_link': f'https://www.example.com/p/{i}.html',
+        'price': f'{rng.uniform(3, 25):.2f} €',
+        'type': 'foundation',
+        'match_percentage': f'{rng.randrange(100)}%',
+        'color_distance': rng.uniform(0, 50),
+        'erp_connection': True,
+        'instore_status': rng.random() < 0.8,
+        'online_status': rng.random() < 0.9,
+        'stock_level': rng.randrange(20),
+        'store_brand': 'dm',
+        'features': {
+            'coverage': rng.choice(['light', 'medium', 'full']),
+            'finish': rng.choice(['matte', 'natural', 'dewy']),
+            'skin_type': rng.sample(['dry', 'oily', 'combination', 'normal', 'sensitive'], 2),
+            'spf': rng.choice([0, 15, 30]),
+            'vegan': rng.random() < 0.5,
+            'volume_ml': 30,
+        },
+        'ingredients': ', '.join(rng.sample(INGREDIENTS, len(INGREDIENTS)) * 3),
+    }
+    if history:
+        product['color_lab'] = lab
+        product['color_hex'] = product['product_color_swatch']
+        product['corrected_color_lab'] = [c + rng.uniform(-1, 1) for c in lab]
+        start = datetime(2025, 1, 1)
+        product['history'] = {
+            (start + timedelta(days=30 * k)).isoformat(): {
+                'color_hex': product['product_color_swatch'],
+                'color_lab': [c + rng.uniform(-2, 2) for c in lab],
+            } for k in range(rng.randrange(4))
+        }
+    return product
+
+
+def synthetic_payload(rng: random.Random, count: int, history: bool) -> Dict[str, Any]:
+    return {
+        'user_id': 'a6f3c3a2-4c0e-4a55-9d43-5b0c1b3a7e11',
+        'timestamp': datetime(2025, 6, 1, 12).isoformat(),
+        'client': {'color': '#c4a995'},
+        'products': [synthetic_product(rng, i, history) for i in range(count)],
+        'product_types': ['foundation', 'concealer', 'powder'],
+    }
+
+
+def fastapi_default(content: Any) -> bytes:
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def encoders() -> Dict[str, Callable[[Any], bytes]]:
+    available = {'json': lambda content: responses.encode_json(content, fast=False)}
+    if responses.orjson is not None:
+        available['orjson'] = lambda content: responses.encode_json(content, fast=True)
+    if responses.msgpack is not None:
+        available['msgpack'] = responses.encode_msgpack
+    return available
+
+
+def codings() -> List[Any]:
+    return [None, 'gzip'] + (['br'] if responses.brotli is not None else [])
+
+
+def measure(encode: Callable[[], bytes], repeat: int) -> Dict[str, Any]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode()
+        times.append(time.perf_counter() - start)
+    return {'encode_ms': statistics.median(times) * 1000, 'bytes': len(body)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, nargs='+', default=[100], help='products per response')
+    parser.add_argument('--history', action='store_true', help='include the scanning history fields')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--bandwidth-mbit', type=float, default=2.0, help='for the estimated transfer time')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for count in args.products:
+        content = synthetic_payload(random.Random(args.seed), count, args.history)
+        rows = [{'encoder': 'fastapi', 'coding': 'identity',
+                 **measure(lambda: fastapi_default(content), args.repeat)}]
+        for name, encode in encoders().items():
+            for coding in codings():
+                rows.append({'encoder': name, 'coding': coding or 'identity',
+                             **measure(lambda: responses.compress(encode(content), coding), args.repeat)})
+
+        baseline = rows[0]
+        print(f"\n{count} products{' with history' if args.history else ''}, "
+              f"transfer at {args.bandwidth_mbit:g} Mbit/s")
+        header = f"{'encoder':<10}{'coding':<10}{'encode ms':>11}{'bytes':>11}{'size':>8}{'transfer ms':>13}"
+        print(header)
+        print('-' * len(header))
+        for row in rows:
+            row['products'] = count
+            row['size_ratio'] = row['bytes'] / baseline['bytes']
+            row['transfer_ms'] = row['bytes'] * 8 / (args.bandwidth_mbit * 1e6) * 1000
+            print(f"{row['encoder']:<10}{row['coding']:<10}{row['encode_ms']:>11.2f}{row['bytes']:>11}"
+                  f"{row['size_ratio']:>8.0%}{row['transfer_ms']:>13.0f}")
+        results.extend(rows)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
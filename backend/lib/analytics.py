@@ -0,0 +1,227 @@
+"""
+Incrementally maintained session analytics for the admin dashboard.
+
+Counters are kept per (retailer, store_location, day) bucket and updated as
+sessions are saved, exited and rated, so dashboard queries cost O(buckets)
+instead of a pass over every client. Each client's current contribution is
+remembered, so an event that is applied twice (repeated exits, replayed
+writes) replaces the earlier contribution instead of counting it again.
+"""
+
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+GROUP_BY_OPTIONS = ("day", "store", "retailer", "all")
+
+BucketKey = Tuple[str, str, str]
+
+
+class _Bucket:
+    __slots__ = ("sessions", "completed", "rated", "rating_sum", "recommendations", "skin_tones")
+
+    def __init__(self):
+        self.sessions = 0
+        self.completed = 0
+        self.rated = 0
+        self.rating_sum = 0.0
+        self.recommendations: Counter = Counter()
+        self.skin_tones: Counter = Counter()
+
+
+class _Contribution:
+    """What one client adds to its bucket."""
+
+    __slots__ = ("key", "completed", "rating", "gtins", "skin_tone")
+
+    def __init__(self, key: BucketKey, completed: bool, rating: Optional[float], gtins: Tuple[str, ...],
+                 skin_tone: str):
+        self.key = key
+        self.completed = completed
+        self.rating = rating
+        self.gtins = gtins
+        self.skin_tone = skin_tone
+
+
+class SessionAggregates:
+    """
+    Session counters per retailer, store location and day.
+
+    Usage:
+        aggregates = SessionAggregates(classify_skin_tone=fm_service.classify_skin_tone)
+        aggregates.observe(client_id, summary_entry)
+        aggregates.query(retailer="dm", date_from="2025-06-01", group_by="store")
+    """
+
+    def __init__(self, classify_skin_tone: Optional[Callable[[List[float]], str]] = None):
+        self._lock = threading.Lock()
+        self._buckets: Dict[BucketKey, _Bucket] = {}
+        self._clients: Dict[str, _Contribution] = {}
+        self._product_names: Dict[str, str] = {}
+        if classify_skin_tone is not None:
+            # Sessions share a limited set of rounded skin colors; classify each once
+            self._classify = lru_cache(maxsize=8192)(lambda lab: classify_skin_tone(list(lab)))
+        else:
+            self._classify = None
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _skin_tone(self, entry: Dict[str, Any]) -> str:
+        lab = (entry.get("features") or {}).get("color_avg_lab") or {}
+        if self._classify is None or not all(channel in lab for channel in ("L", "a", "b")):
+            return "unknown"
+        try:
+            return self._classify((round(float(lab["L"]), 1), round(float(lab["a"]), 1), round(float(lab["b"]), 1)))
+        except (TypeError, ValueError):
+            return "unknown"
+
+    def _contribution(self, entry: Dict[str, Any]) -> _Contribution:
+        user_flow = entry.get("user_flow") or {}
+        day = str(user_flow.get("result_page_timestamp") or "")[:10]
+        key = (str(user_flow.get("retailer") or ""), str(user_flow.get("store_location") or ""), day)
+
+        rating = (entry.get("feedback") or {}).get("rating")
+        try:
+            rating = float(rating) if rating not in (None, "") else None
+        except (TypeError, ValueError):
+            rating = None
+
+        gtins = []
+        final_recommendations = (entry.get("recommendation_focus") or {}).get("final_recommendations") or []
+        for product in final_recommendations if isinstance(final_recommendations, list) else []:
+            if not isinstance(product, dict) or not product.get("gtin"):
+                continue
+            gtin = str(product["gtin"])
+            if gtin not in gtins:
+                gtins.append(gtin)
+            name = f"{product.get('brand', '')} {product.get('description', '')}".strip()
+            if name:
+                self._product_names[gtin] = name
+
+        return _Contribution(key, bool(user_flow.get("exit_timestamp")), rating, tuple(gtins), self._skin_tone(entry))
+
+    def _apply(self, contribution: _Contribution, sign: int):
+        bucket = self._buckets.get(contribution.key)
+        if bucket is None:
+            bucket = self._buckets[contribution.key] = _Bucket()
+        bucket.sessions += sign
+        bucket.completed += sign * contribution.completed
+        if contribution.rating is not None:
+            bucket.rated += sign
+            bucket.rating_sum += sign * contribution.rating
+        for gtin in contribution.gtins:
+            bucket.recommendations[gtin] += sign
+        bucket.skin_tones[contribution.skin_tone] += sign
+        if sign < 0:
+            bucket.recommendations += Counter()  # drops counts that reached zero
+            bucket.skin_tones += Counter()
+            if bucket.sessions == 0:
+                del self._buckets[contribution.key]
+
+    def observe(self, client_id: str, entry: Dict[str, Any]) -> None:
+        """Adds a client's session, or replaces its previous contribution with the current entry."""
+        contribution = self._contribution(entry)
+        with self._lock:
+            previous = self._clients.get(client_id)
+            if previous is not None:
+                self._apply(previous, -1)
+            self._apply(contribution, 1)
+            self._clients[client_id] = contribution
+
+    def forget(self, client_id: str) -> None:
+        with self._lock:
+            previous = self._clients.pop(client_id, None)
+            if previous is not None:
+                self._apply(previous, -1)
+
+    def rebuild(self, entries: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Recomputes all counters from (client_id, summary entry) pairs."""
+        contributions = {client_id: self._contribution(entry) for client_id, entry in entries
+                         if isinstance(entry, dict)}
+        with self._lock:
+            self._buckets = {}
+            self._clients = contributions
+            for contribution in contributions.values():
+                self._apply(contribution, 1)
+
+    @staticmethod
+    def _group_key(key: BucketKey, group_by: str) -> Dict[str, str]:
+        retailer, store_location, day = key
+        if group_by == "day":
+            return {"retailer": retailer, "store_location": store_location, "day": day}
+        if group_by == "store":
+            return {"retailer": retailer, "store_location": store_location}
+        if group_by == "retailer":
+            return {"retailer": retailer}
+        return {}
+
+    def query(self,
+              retailer: Optional[str] = None,
+              store_location: Optional[str] = None,
+              date_from: Optional[str] = None,
+              date_to: Optional[str] = None,
+              group_by: str = "day",
+              top: int = 10) -> Dict[str, Any]:
+        """
+        Aggregates of the matching buckets.
+
+        Args:
+            retailer: Only sessions of this retailer
+            store_location: Only sessions of this store location
+            date_from: First day (YYYY-MM-DD, inclusive)
+            date_to: Last day (YYYY-MM-DD, inclusive)
+            group_by: "day" (per retailer, store and day), "store", "retailer" or "all"
+            top: Number of most chosen final recommendations per group
+
+        Returns:
+            Dict with the groups (sorted by their keys) and the number of buckets scanned
+        """
+        if group_by not in GROUP_BY_OPTIONS:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_BY_OPTIONS)}")
+
+        groups: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        with self._lock:
+            scanned = 0
+            for key, bucket in self._buckets.items():
+                bucket_retailer, bucket_store, day = key
+                if retailer is not None and bucket_retailer != retailer:
+                    continue
+                if store_location is not None and bucket_store != store_location:
+                    continue
+                if (date_from and day < date_from[:10]) or (date_to and day > date_to[:10]):
+                    continue
+                scanned += 1
+                group_fields = self._group_key(key, group_by)
+                group = groups.get(tuple(group_fields.values()))
+                if group is None:
+                    group = groups[tuple(group_fields.values())] = {
+                        "fields": group_fields, "sessions": 0, "completed": 0, "rated": 0, "rating_sum": 0.0,
+                        "recommendations": Counter(), "skin_tones": Counter(),
+                    }
+                group["sessions"] += bucket.sessions
+                group["completed"] += bucket.completed
+                group["rated"] += bucket.rated
+                group["rating_sum"] += bucket.rating_sum
+                group["recommendations"].update(bucket.recommendations)
+                group["skin_tones"].update(bucket.skin_tones)
+            product_names = dict(self._product_names)
+
+        results = []
+        for group_key in sorted(groups):
+            group = groups[group_key]
+            results.append({
+                **group["fields"],
+                "sessions": group["sessions"],
+                "completed_sessions": group["completed"],
+                "completion_rate": round(group["completed"] / group["sessions"], 4) if group["sessions"] else 0.0,
+                "rated_sessions": group["rated"],
+                "average_rating": round(group["rating_sum"] / group["rated"], 2) if group["rated"] else None,
+                "top_final_recommendations": [
+                    {"gtin": gtin, "name": product_names.get(gtin, ""), "count": count}
+                    for gtin, count in group["recommendations"].most_common(top)
+                ],
+                "skin_tone_mix": dict(group["skin_tones"]),
+            })
+        return {"group_by": group_by, "buckets_scanned": scanned, "groups": results}
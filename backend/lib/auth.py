@@ -0,0 +1,222 @@
+"""
+Shared verification of Firebase ID tokens for the protected endpoints.
+
+Every protected request (device heartbeats every few seconds included) used
+to run firebase_auth.verify_id_token, i.e. a signature verification and the
+key handling, in require_auth and in routers/monitoring. TokenVerifier pays
+that once per token: decoded tokens are cached by token hash until shortly
+before their expiry (bounded, least recently used entries are evicted), and
+concurrent requests with the same new token share one verification.
+
+Revocation is not checked per request. A background task periodically loads
+the users of the cached tokens (firebase_auth.get_user) and records the
+users whose tokens were revoked or who were disabled; their tokens issued
+before the revocation are evicted and rejected from then on, so a revoked
+token is accepted for at most one check interval.
+
+Settings: AUTH_TOKEN_CACHE_SIZE (default 10000), AUTH_TOKEN_EXPIRY_MARGIN_SECONDS
+(default 60), AUTH_REVOCATION_CHECK_SECONDS (default 300).
+"""
+
+import asyncio
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Any, Dict, Optional, Tuple
+
+import firebase_admin
+from firebase_admin import auth as firebase_auth
+
+from .executors import run_io
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_EXPIRY_MARGIN_SECONDS = float(os.getenv("AUTH_TOKEN_EXPIRY_MARGIN_SECONDS", "60"))
+AUTH_REVOCATION_CHECK_SECONDS = float(os.getenv("AUTH_REVOCATION_CHECK_SECONDS", "300"))
+ID_TOKEN_LIFETIME_SECONDS = 3600
+
+
+class TokenVerifier:
+    """
+    Verifies Firebase ID tokens with a bounded cache of decoded tokens and a
+    scheduled revocation check.
+
+    Usage:
+        verifier = TokenVerifier(max_entries=10000)
+        verifier.start()  # on startup, schedules the revocation checks
+        decoded_token = await verifier.verify(token)
+        await verifier.stop()
+    """
+
+    def __init__(self, max_entries: int = AUTH_TOKEN_CACHE_SIZE,
+                 expiry_margin_seconds: float = AUTH_TOKEN_EXPIRY_MARGIN_SECONDS,
+                 revocation_check_seconds: float = AUTH_REVOCATION_CHECK_SECONDS):
+        self.max_entries = max_entries
+        self.expiry_margin_seconds = expiry_margin_seconds
+        self.revocation_check_seconds = revocation_check_seconds
+        # token hash -> (cache expiry as epoch seconds, decoded token)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # uid -> (tokens issued before this epoch second are revoked, user disabled)
+        self._revoked: Dict[str, Tuple[float, bool]] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revocation_checks = 0
+        self.last_revocation_check: Optional[float] = None
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def _check_revoked(self, decoded_token: Dict[str, Any]):
+        revoked = self._revoked.get(decoded_token.get("uid"))
+        if revoked is None:
+            return
+        valid_after, disabled = revoked
+        if disabled:
+            raise firebase_auth.UserDisabledError("The user record is disabled.")
+        if decoded_token.get("iat", 0) < valid_after:
+            raise firebase_auth.RevokedIdTokenError("The Firebase ID token has been revoked.")
+
+    def _cached(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, decoded_token = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return decoded_token
+
+    def _store(self, key: str, decoded_token: Dict[str, Any]):
+        expires_at = decoded_token.get("exp", 0) - self.expiry_margin_seconds
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._entries[key] = (expires_at, decoded_token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        """
+        Decoded claims of a valid token (a copy, callers may change it).
+        Raises the firebase_auth errors of verify_id_token (InvalidIdTokenError,
+        ExpiredIdTokenError, RevokedIdTokenError, UserDisabledError, ...).
+        """
+        key = self._key(token)
+        decoded_token = self._cached(key)
+        if decoded_token is None:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = asyncio.ensure_future(run_io(firebase_auth.verify_id_token, token))
+                self._pending[key] = pending
+                pending.add_done_callback(partial(self._verified, key))
+            # Shielded for every caller: a cancelled request must not cancel the shared verification
+            decoded_token = await asyncio.shield(pending)
+        self._check_revoked(decoded_token)
+        return dict(decoded_token)
+
+    def _verified(self, key: str, pending: asyncio.Future):
+        # Done callback of a shared verification, runs whether or not its callers are still waiting
+        if self._pending.get(key) is pending:
+            del self._pending[key]
+        if not pending.cancelled() and pending.exception() is None:
+            self._store(key, pending.result())
+
+    # Revocation checks
+
+    @staticmethod
+    def _user_state(uid: str) -> Tuple[float, bool]:
+        # Same rule as verify_id_token(check_revoked=True): revoked if issued before tokens_valid_after
+        try:
+            user = firebase_auth.get_user(uid)
+        except firebase_auth.UserNotFoundError:
+            return math.inf, True
+        return (user.tokens_valid_after_timestamp or 0) / 1000, user.disabled
+
+    async def check_revocations(self):
+        """Loads the users of the cached tokens and evicts the revoked tokens."""
+        now = time.time()
+        with self._lock:
+            uids = {decoded_token.get("uid") for _, decoded_token in self._entries.values()}
+            # Keep checking users disabled or revoked within an ID token lifetime, their tokens may come back
+            uids.update(uid for uid, (valid_after, disabled) in self._revoked.items()
+                        if disabled or now - valid_after < ID_TOKEN_LIFETIME_SECONDS)
+        uids.discard(None)
+        revoked = {}
+        for uid in uids:
+            valid_after, disabled = await run_io(self._user_state, uid)
+            with self._lock:
+                stale = [key for key, (_, decoded_token) in self._entries.items()
+                         if decoded_token.get("uid") == uid and (disabled or decoded_token.get("iat", 0) < valid_after)]
+                for key in stale:
+                    del self._entries[key]
+            if disabled or stale or uid in self._revoked:
+                revoked[uid] = (valid_after, disabled)
+        self._revoked = revoked
+        self.revocation_checks += 1
+        self.last_revocation_check = time.time()
+
+    async def _revocation_loop(self):
+        while True:
+            await asyncio.sleep(self.revocation_check_seconds)
+            if not firebase_admin._apps:
+                continue
+            try:
+                await self.check_revocations()
+            except Exception as e:
+                print(f"Token revocation check failed: {type(e).__name__}: {str(e)}")
+
+    def start(self):
+        """Schedules the revocation checks on the running loop."""
+        if self._task is None and self.revocation_check_seconds > 0:
+            self._task = asyncio.get_running_loop().create_task(self._revocation_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "revoked_users": len(self._revoked),
+                "revocation_checks": self.revocation_checks,
+                "last_revocation_check": self.last_revocation_check,
+            }
+
+
+token_verifier = TokenVerifier()
+
+
+async def verify_token(token: str) -> Dict[str, Any]:
+    """Verifies a Firebase ID token with the shared token_verifier."""
+    return await token_verifier.verify(token)
@@ -0,0 +1,136 @@
+"""
+Startup pipeline of the server.
+
+The boot steps (Firestore and Firebase Admin clients, questions, matching
+service, catalog warm-up) used to run one after the other at import time.
+BootPipeline runs each step on its own thread as soon as the steps it
+requires have finished, so independent steps overlap:
+- critical steps are needed to serve requests; importing the server waits
+  for them (BootPipeline.wait)
+- the other steps (warm-ups) keep running in the background; requests that
+  arrive first load what they need on demand
+
+Steps handle their own fallbacks (e.g. local files without Firestore); an
+exception is recorded as a failed step and the steps requiring it still run.
+A failed critical step keeps the server not ready and fails the import
+(raise_for_failures); a failed warm-up counts as finished, since requests load
+what it would have warmed on demand, and is listed by failed().
+The report (report()) has the import time of the server module and the
+start offset and duration of every step.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class BootStep:
+    def __init__(self, name: str, func: Callable[[], Any], requires: Iterable[str], critical: bool):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.critical = critical
+        self.status = "pending"  # pending, running, done, failed
+        self.started: Optional[float] = None
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.finished = threading.Event()
+
+
+class BootPipeline:
+    """
+    Steps with dependencies, run concurrently on threads.
+
+    Usage:
+        boot = BootPipeline(imports_seconds=1.2)
+        boot.add("firestore", init_firestore)
+        boot.add("matching", init_matching, requires=["firestore"])
+        boot.add("warm_catalogs", warm_catalogs, requires=["matching"], critical=False)
+        boot.start()
+        boot.wait()  # critical steps only
+        boot.raise_for_failures()
+        boot.report()
+    """
+
+    def __init__(self, imports_seconds: Optional[float] = None):
+        self.imports_seconds = imports_seconds
+        self.steps: Dict[str, BootStep] = {}
+        self.started: Optional[float] = None
+
+    def add(self, name: str, func: Callable[[], Any], requires: Iterable[str] = (), critical: bool = True):
+        for required in requires:
+            if required not in self.steps:
+                raise ValueError(f"Boot step {name} requires unknown step {required}")
+        self.steps[name] = BootStep(name, func, requires, critical)
+
+    def _run(self, step: BootStep):
+        for required in step.requires:
+            self.steps[required].finished.wait()
+        step.started = time.perf_counter()
+        step.status = "running"
+        try:
+            step.func()
+            step.status = "done"
+        except Exception as e:
+            step.status = "failed"
+            step.error = f"{type(e).__name__}: {str(e)}"
+            print(f"Boot step {step.name} failed: {step.error}")
+        finally:
+            step.seconds = time.perf_counter() - step.started
+            step.finished.set()
+            print(f"Boot step {step.name} {step.status} in {step.seconds:.2f}s")
+
+    def start(self):
+        self.started = time.perf_counter()
+        for step in self.steps.values():
+            threading.Thread(target=self._run, args=(step,), name=f"boot-{step.name}", daemon=True).start()
+
+    def _selected(self, critical_only: bool) -> List[BootStep]:
+        return [step for step in self.steps.values() if step.critical or not critical_only]
+
+    def wait(self, critical_only: bool = True, timeout: Optional[float] = None) -> bool:
+        """Waits for the critical (or all) steps; False if the timeout expired first."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for step in self._selected(critical_only):
+            remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            if not step.finished.wait(remaining):
+                return False
+        return True
+
+    def finished(self, critical_only: bool = True) -> bool:
+        """Whether the critical steps completed without an error (and the others ran, unless critical_only)."""
+        return all(step.status == "done" or (not step.critical and step.status == "failed")
+                   for step in self._selected(critical_only))
+
+    def pending(self) -> List[str]:
+        return [step.name for step in self.steps.values() if not step.finished.is_set()]
+
+    def failed(self, critical_only: bool = False) -> Dict[str, str]:
+        """Error of every failed step, by step name."""
+        return {step.name: step.error for step in self._selected(critical_only) if step.status == "failed"}
+
+    def raise_for_failures(self, critical_only: bool = True):
+        """Raises a RuntimeError naming the first failed critical (or any) step and its error."""
+        for name, error in self.failed(critical_only).items():
+            raise RuntimeError(f"Boot step {name} failed: {error}")
+
+    def report(self) -> Dict[str, Any]:
+        boot_end = max((step.started + step.seconds for step in self.steps.values() if step.seconds is not None),
+                       default=None)
+        return {
+            "imports_seconds": self.imports_seconds,
+            "boot_seconds": boot_end - self.started if self.started is not None and boot_end is not None else None,
+            "critical_finished": self.finished(critical_only=True),
+            "all_finished": self.finished(critical_only=False),
+            "failed": self.failed(),
+            "steps": {
+                step.name: {
+                    "status": step.status,
+                    "critical": step.critical,
+                    "requires": list(step.requires),
+                    "started_after_seconds": step.started - self.started if step.started is not None else None,
+                    "seconds": step.seconds,
+                    "error": step.error,
+                } for step in self.steps.values()
+            },
+        }
@@ -1,25 +1,323 @@
 from http import client
 import os
+import re
 import json
 import io
 import csv
+import asyncio
+import gzip
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from google.cloud import firestore
+
+from .analytics import SessionAggregates
+from .clients_summary_index import ClientsSummaryIndex, decode_cursor, encode_cursor
+
+
+def _safe_get(data, *keys, default=""):
+    # Safely get nested values
+    current = data
+    try:
+        for key in keys:
+            current = current[key]
+        return current
+    except (KeyError, IndexError, TypeError):
+        return default
+
+
+def _final_recommendation_gtin(user_data, index=0, default=""):
+    f_r = _safe_get(user_data, "recommendation_focus", "final_recommendations", default={})
+    if not f_r:
+        return default
+    try:
+        return f_r[index].get("gtin", default)
+    except (IndexError, AttributeError, KeyError):
+        return default
+
+
+def _final_recommendation_name(user_data, index=0, default=""):
+    f_r = _safe_get(user_data, "recommendation_focus", "final_recommendations", default={})
+    if not f_r:
+        return default
+    try:
+        brand = f_r[index].get("brand", "")
+        description = f_r[index].get("description", "")
+        return f"{brand} {description}".strip()
+    except (IndexError, AttributeError, KeyError):
+        return default
+
+
+def _summary_row(user_id: str, user_data: Dict[str, Any]) -> Dict[str, Any]:
+    # One flat row of the clients summary table
+    return {
+        "client_id": _safe_get(user_data, "client_id", default=user_id),
+        "features.colors_lab.1.L": _safe_get(user_data, "features", "colors_lab", "1", "L"),
+        "features.colors_lab.1.a": _safe_get(user_data, "features", "colors_lab", "1", "a"),
+        "features.colors_lab.1.b": _safe_get(user_data, "features", "colors_lab", "1", "b"),
+        "features.colors_lab.2.L": _safe_get(user_data, "features", "colors_lab", "2", "L"),
+        "features.colors_lab.2.a": _safe_get(user_data, "features", "colors_lab", "2", "a"),
+        "features.colors_lab.2.b": _safe_get(user_data, "features", "colors_lab", "2", "b"),
+        "features.colors_lab.3.L": _safe_get(user_data, "features", "colors_lab", "3", "L"),
+        "features.colors_lab.3.a": _safe_get(user_data, "features", "colors_lab", "3", "a"),
+        "features.colors_lab.3.b": _safe_get(user_data, "features", "colors_lab", "3", "b"),
+        "features.colors_hex.1": _safe_get(user_data, "features", "colors_hex", "1"),
+        "features.colors_hex.2": _safe_get(user_data, "features", "colors_hex", "2"),
+        "features.colors_hex.3": _safe_get(user_data, "features", "colors_hex", "3"),
+        "features.color_avg_lab.L": _safe_get(user_data, "features", "color_avg_lab", "L"),
+        "features.color_avg_lab.a": _safe_get(user_data, "features", "color_avg_lab", "a"),
+        "features.color_avg_lab.b": _safe_get(user_data, "features", "color_avg_lab", "b"),
+        "features.color_avg_hex": _safe_get(user_data, "features", "color_avg_hex"),
+        "user_flow.browser_name": _safe_get(user_data, "user_flow", "browser_name"),
+        "user_flow.retailer": _safe_get(user_data, "user_flow", "retailer"),
+        "user_flow.store_location": _safe_get(user_data, "user_flow", "store_location"),
+        "user_flow.clarity_id": _safe_get(user_data, "user_flow", "clarity_id"),
+        "user_flow.result_page_timestamp": _safe_get(user_data, "user_flow", "result_page_timestamp"),
+        "user_flow.phone_page_results_timestamp": _safe_get(user_data, "user_flow", "phone_page_results_timestamp"),
+        "user_flow.exit_timestamp": _safe_get(user_data, "user_flow", "exit_timestamp"),
+        "recommendation_focus.filters": _safe_get(user_data, "recommendation_focus", "filters", default={}),
+        "recommendation_focus.final_recommendations.1.gtin": _final_recommendation_gtin(user_data, index=0),
+        "recommendation_focus.final_recommendations.1.name": _final_recommendation_name(user_data, index=0),
+        "recommendation_focus.final_recommendations.2.gtin": _final_recommendation_gtin(user_data, index=1),
+        "recommendation_focus.final_recommendations.2.name": _final_recommendation_name(user_data, index=1),
+        "recommendation_focus.final_recommendations.3.gtin": _final_recommendation_gtin(user_data, index=2),
+        "recommendation_focus.final_recommendations.3.name": _final_recommendation_name(user_data, index=2),
+        "recommendation_focus.final_recommendations": _safe_get(user_data, "recommendation_focus", "final_recommendations", default={}),
+        "feedback.feedback_timestamp": _safe_get(user_data, "feedback", "feedback_timestamp"),
+        "feedback.rating": _safe_get(user_data, "feedback", "rating"),
+        "feedback.improvements": _safe_get(user_data, "feedback", "improvements", default=[]),
+        "feedback.opinions": _safe_get(user_data, "feedback", "opinions", default=""),
+    }
+
+
+def _checked_summary_row(user_id: str, user_data: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return _summary_row(user_id, user_data)
+    except Exception as e:
+        print(f"Error processing client {user_id}: {type(e).__name__}: {str(e)}")
+        # Add a minimal row with just the client_id to avoid losing the record completely
+        return {"client_id": user_id, "error": f"Error processing data: {str(e)}"}
+
+
+def _client_documents(client_id,
+                      face_landmarks,
+                      colors_lab,
+                      colors_hex,
+                      color_avg_lab,
+                      color_avg_hex,
+                      option_data,
+                      retailer,
+                      store_location,
+                      browser_name,
+                      clarity_id,
+                      result_page_timestamp,
+                      recommendation_results=None,
+                      recommendation_refs=None,
+                      ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    # Build the client document and its summary entry; the face landmarks are
+    # stored in their own document (see _landmarks_document). Sessions keep
+    # references to their recommendations, older ones the formatted products.
+    data = {
+        "client_id": client_id,
+        "features": {
+             "colors_lab": {"1": {"L": colors_lab[0][0], "a": colors_lab[0][1], "b": colors_lab[0][2]},
+                           "2": {"L": colors_lab[1][0], "a": colors_lab[1][1], "b": colors_lab[1][2]},
+                           "3": {"L": colors_lab[2][0], "a": colors_lab[2][1], "b": colors_lab[2][2]}},
+            "colors_hex": {"1": colors_hex[0], "2": colors_hex[1], "3": colors_hex[2]},
+            "color_avg_lab": {"L": color_avg_lab[0], "a": color_avg_lab[1], "b": color_avg_lab[2]},
+            "color_avg_hex": color_avg_hex,
+            "option_data": option_data,
+        },
+        "user_flow":{
+            "browser_name": browser_name,
+            "retailer": retailer,
+            "store_location": store_location,
+            "clarity_id": clarity_id,
+            "result_page_timestamp": result_page_timestamp,
+        },
+        "recommendation_focus": {}
+    }
+    if recommendation_refs is not None:
+        data["recommendation_refs"] = recommendation_refs
+    else:
+        data["recommendations"] = recommendation_results
+    summary_data = {
+        "client_id": client_id,
+        "features": {
+            "colors_lab": {"1": {"L": colors_lab[0][0], "a": colors_lab[0][1], "b": colors_lab[0][2]},
+                           "2": {"L": colors_lab[1][0], "a": colors_lab[1][1], "b": colors_lab[1][2]},
+                           "3": {"L": colors_lab[2][0], "a": colors_lab[2][1], "b": colors_lab[2][2]}},
+            "colors_hex": {"1": colors_hex[0], "2": colors_hex[1], "3": colors_hex[2]},
+            "color_avg_lab": {"L": color_avg_lab[0], "a": color_avg_lab[1], "b": color_avg_lab[2]},
+            "color_avg_hex": color_avg_hex,
+        },
+        "user_flow":{
+            "browser_name": browser_name,
+            "retailer": retailer,
+            "store_location": store_location,
+            "clarity_id": clarity_id,
+            "result_page_timestamp": result_page_timestamp,
+        },
+        "recommendation_focus": {},
+    }
+    return data, summary_data
+
+
+def _feedback_data(rating: int, improvements: list, opinions: str) -> Dict[str, Any]:
+    return {
+        "feedback_timestamp":  datetime.now().isoformat(),
+        "rating": rating,
+        "improvements": improvements,
+        "opinions": opinions,
+    }
+
+
+def _landmarks_document(client_id: str, face_landmarks: Any) -> Dict[str, Any]:
+    # zlib-compressed JSON; landmark coordinates compress to a fraction of their size
+    return {
+        "client_id": client_id,
+        "encoding": LANDMARKS_ENCODING,
+        "data": zlib.compress(json.dumps(face_landmarks, separators=(",", ":")).encode("utf-8")),
+    }
+
+
+def decode_landmarks(document: Dict[str, Any]) -> Any:
+    """Face landmarks stored in a landmarks document."""
+    if document.get("encoding") != LANDMARKS_ENCODING:
+        raise ValueError(f"Unsupported landmarks encoding: {document.get('encoding')}")
+    return json.loads(zlib.decompress(document["data"]).decode("utf-8"))
+
+
+def rehydrate_client(client_data: Dict[str, Any], products_db: Any) -> Dict[str, Any]:
+    """
+    Replaces the stored recommendation references of a client document with the
+    formatted products, resolved from the current catalog of products_db
+    (FoundationMatchingService). Documents without references are returned as they are.
+    """
+    refs = client_data.pop("recommendation_refs", None)
+    if refs is not None:
+        user_flow = client_data.get("user_flow") or {}
+        client_data["recommendations"] = products_db.rehydrate_recommendations(
+            _session_store_brand(client_data), refs, store_location=user_flow.get("store_location"))
+    return client_data
+
+
+def _session_store_brand(client_data: Dict[str, Any]) -> str:
+    # Store brand the session's recommendations were matched in
+    return (client_data.get("user_flow") or {}).get("retailer") or "dm"
+
+
+def _with_product_details(client_data: Dict[str, Any], products_db: Any) -> Dict[str, Any]:
+    client_data = rehydrate_client(client_data, products_db)
+    recommended_products = client_data.get("recommendations", [])
+    # Catalog fields only, looked up in the session's store catalog: rehydrate_client
+    # already made the availability and product data calls for these products
+    product_details_by_gtin = products_db.get_products_by_gtins(
+        _session_store_brand(client_data), [product.get("product_id") for product in recommended_products],
+        enrich=False)
+    for product in recommended_products:
+        product_details = product_details_by_gtin.get(str(product.get("product_id")))
+        if product_details:
+            product["color_lab"] = product_details.get("color_lab", {})
+            product["color_hex"] = product_details.get("color_hex", "")
+            product["rescanned"] = product_details.get("rescanned", False)
+            product["last_rescan"] = product_details.get("last_rescan")
+    return client_data
+
+
+def _csv_chunks(rows: Iterator[Dict[str, Any]], chunk_rows: int, compress: bool) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    def flush() -> bytes:
+        data = output.getvalue().encode("utf-8")
+        output.seek(0)
+        output.truncate(0)
+        return compressor.compress(data) if compressor else data
+
+    # Write header row
+    writer.writerow(SUMMARY_COLUMNS)
+    count = 0
+    for row_data in rows:
+        writer.writerow([row_data.get(col, "") for col in SUMMARY_COLUMNS])
+        count += 1
+        if count % chunk_rows == 0:
+            chunk = flush()
+            if chunk:
+                yield chunk
+    chunk = flush()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+    print(f"CSV generated with {count} clients and {len(SUMMARY_COLUMNS)} columns")
+
+
+def _update_time_iso(update_time) -> Optional[str]:
+    return update_time.isoformat() if update_time is not None else None
+
+
+# Column order of the summary table and its CSV export
+SUMMARY_COLUMNS = list(_summary_row("", {}).keys())
+
+LANDMARKS_ENCODING = "zlib-json"
+
+# Summary shards fetched per page by the background loader
+SUMMARY_PAGE_SIZE = 20
+SUMMARY_SNAPSHOT_VERSION = 2
+
+# Summary shards are partitioned by day and store ("<day>_<retailer>-<store>_<n>")
+# and split before they grow past these limits (Firestore allows 1 MiB per document)
+SUMMARY_SHARD_MAX_BYTES = 256 * 1024
+SUMMARY_SHARD_MAX_CLIENTS = 100
+# Reserved per client for the exit, focus and feedback updates written later
+SUMMARY_ENTRY_HEADROOM = 8 * 1024
+# Legacy numbered shards and partitioned shards
+_SHARD_ID = re.compile(r"^(\d+|\d{4}-\d{2}-\d{2}_[A-Za-z0-9-]*_\d+)$")
+_DAY = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+def summary_partition(summary_data: Dict[str, Any]) -> str:
+    """Day and store partition of a summary entry, e.g. "2025-06-01_dm-D522"."""
+    user_flow = summary_data.get("user_flow") or {}
+    timestamp = str(user_flow.get("result_page_timestamp") or "")
+    day = timestamp[:10] if _DAY.match(timestamp) else datetime.now().date().isoformat()
+    store = re.sub(r"[^A-Za-z0-9-]", "-", f"{user_flow.get('retailer') or ''}-{user_flow.get('store_location') or ''}")
+    return f"{day}_{store}"
+
+
+def _summary_entry_size(client_id: str, summary_data: Dict[str, Any]) -> int:
+    # Estimated stored size of a summary entry, with room for its later updates
+    return len(client_id) + 1 + len(json.dumps(summary_data, default=str).encode("utf-8")) + SUMMARY_ENTRY_HEADROOM
+
+
 class ClientsDB:
     """
-    Factory class to return the appropriate client DB handler (local or dummy).
+    Factory class to return the appropriate client DB handler (local, dummy, sqlite or firestore).
     Usage: db = ClientsDB.create(type="local")
     """
     @staticmethod
-    def create(type: str = "local", clients_dir: str = "clients", results_dir: str = "results", client=None):
+    def create(type: str = "local", clients_dir: str = "clients", results_dir: str = "results", client=None,
+               async_client=None, snapshot_path=None, skin_tone_classifier=None, db_path=None):
         if type == "local":
             return ClientsDBLocal(clients_dir, results_dir)
         elif type == "dummy":
             return ClientsDBDummy()
         elif type == "firestore":
-            return ClientsDBFirestore(client)
+            return ClientsDBFirestore(client, async_client, snapshot_path=snapshot_path,
+                                      skin_tone_classifier=skin_tone_classifier)
+        elif type == "sqlite":
+            return ClientsDBSQLite(db_path or os.path.join(clients_dir, "clients.db"),
+                                   skin_tone_classifier=skin_tone_classifier)
         else:
-            raise ValueError("Unsupported database type. Use 'local' or 'dummy'.")
+            raise ValueError("Unsupported database type. Use 'local', 'dummy', 'sqlite' or 'firestore'.")
 
 class ClientsDBDummy:
     def __init__(self):
@@ -98,123 +396,364 @@ class ClientsDBLocal:
 
 
 class ClientsDBFirestore:
-    # Firestore client should be passed during initialization
-    def __init__(self, client):
+    # Firestore client should be passed during initialization; the optional
+    # AsyncClient serves the *_async methods used by the request handlers.
+    # With lazy_load the summary shards are loaded in pages on a background
+    # thread, resuming from the local snapshot at snapshot_path if there is one;
+    # load_state reports the progress. New clients get their summary shard from
+    # a transactional counter per day and store, so no shard pointer is kept here.
+    # skin_tone_classifier (LAB -> class name) feeds the skin tone mix of the analytics.
+    def __init__(self, client, async_client=None, lazy_load=True, snapshot_path=None, skin_tone_classifier=None):
         self.client = client
+        self.async_client = async_client
         self.clients_collection = self.client.collection("clients")
         self.clients_summary_collection = self.client.collection("clients_summary")
-        docs = self.clients_summary_collection.stream()
-        self.summary = {}
-        for doc in docs:
-            try:
-                # Convert string document IDs to integers for indexing
-                doc_index = int(doc.id)
-                self.summary[doc_index] = doc.to_dict()
-            except ValueError:
-                # Skip documents with non-integer IDs
-                print(f"Skipping document with non-integer ID: {doc.id}")
-                continue
-        
-        if not self.summary:
-            # No existing summary documents, start with index 0
-            self.current_summary_index = 0
-            self.create_summary_doc(0)
+        self.summary_counters_collection = self.client.collection("clients_summary_counters")
+        self.clients_landmarks_collection = self.client.collection("clients_landmarks")
+        if async_client is not None:
+            self.async_clients_collection = async_client.collection("clients")
+            self.async_clients_summary_collection = async_client.collection("clients_summary")
+            self.async_clients_landmarks_collection = async_client.collection("clients_landmarks")
+        # shard id -> {client_id: summary entry}
+        self.summary: Dict[str, Dict[str, Any]] = {}
+        # client_id -> summary shard id, so updates find a client's shard in O(1)
+        self.shard_of: Dict[str, str] = {}
+        self.snapshot_path = snapshot_path
+        self._shard_update_times: Dict[str, Optional[str]] = {}
+        # Shards written while the load is running; re-read once it finishes
+        self._dirty_shards = set()
+        # (client_id, write) summary updates of clients whose shard is only known once
+        # the load finishes; write(shard_id) runs when the load is marked done
+        self._deferred_summary_updates: List[Tuple[str, Callable[[str], None]]] = []
+        self._deferred_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self.load_state = {
+            "status": "loading",
+            "from_snapshot": False,
+            "shards_loaded": 0,
+            "clients_loaded": 0,
+            "started_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "error": None,
+        }
+        # Sorted views over the summary for the filtered, paginated summary API
+        self.summary_index = ClientsSummaryIndex()
+        # Dashboard counters per retailer, store and day, updated with every session event
+        self.analytics = SessionAggregates(skin_tone_classifier)
+
+        if lazy_load:
+            threading.Thread(target=self._background_load, name="clients-summary-load", daemon=True).start()
         else:
-            # Use the highest existing index
-            self.current_summary_index = max(self.summary.keys())
+            self.load_summary()
+            self._finish_load()
             
-        print(f"Initialized ClientsDBFirestore with summary index: {self.current_summary_index}")
-        print(f"Existing summary keys: {list(self.summary.keys())}")
-
-    def create_summary_doc(self, index: int):
-        self.clients_summary_collection.document(str(index)).set({})
-        self.summary[index] = {}
-
-    def summary_pointer(self) -> int:
-        # Check if current index exists and has space
-        current_summary = self.summary.get(self.current_summary_index, {})
-        if len(current_summary) >= 50:
-            self.current_summary_index += 1
-            # Don't create the document here, it will be created when needed
-        return self.current_summary_index
-
-    def find_summary_index(self, client_id: str) -> Optional[int]:
-        for index, ids in self.summary.items():
-            if client_id in ids.keys():
-                return index
-        return self.summary_pointer()
-
-    def save_new_client(self, 
-                        client_id,
-                        face_landmarks,
-                        colors_lab,
-                        colors_hex,
-                        color_avg_lab,
-                        color_avg_hex,
-                        option_data,
-                        retailer,
-                        store_location,
-                        browser_name,
-                        clarity_id,
-                        result_page_timestamp,
-                        recommendation_results,
-                        ):
-        
-        # Save new client
-        # 2 firestore writes
+        print(f"Initialized ClientsDBFirestore ({'loading summary in background' if lazy_load else 'summary loaded'})")
 
-        data = {
-            "client_id": client_id,
-            "features": {
-                 "colors_lab": {"1": {"L": colors_lab[0][0], "a": colors_lab[0][1], "b": colors_lab[0][2]},
-                               "2": {"L": colors_lab[1][0], "a": colors_lab[1][1], "b": colors_lab[1][2]},
-                               "3": {"L": colors_lab[2][0], "a": colors_lab[2][1], "b": colors_lab[2][2]}},
-                "colors_hex": {"1": colors_hex[0], "2": colors_hex[1], "3": colors_hex[2]},
-                "color_avg_lab": {"L": color_avg_lab[0], "a": color_avg_lab[1], "b": color_avg_lab[2]},
-                "color_avg_hex": color_avg_hex,
-                "face_landmarks": face_landmarks,
-                "option_data": option_data,
-            },
-            "user_flow":{
-                "browser_name": browser_name,
-                "retailer": retailer,
-                "store_location": store_location,
-                "clarity_id": clarity_id,
-                "result_page_timestamp": result_page_timestamp,
-            },
-            "recommendations": recommendation_results,
-            "recommendation_focus": {}
-        }
-        summary_data = {
-            "client_id": client_id,
-            "features": {
-                "colors_lab": {"1": {"L": colors_lab[0][0], "a": colors_lab[0][1], "b": colors_lab[0][2]},
-                               "2": {"L": colors_lab[1][0], "a": colors_lab[1][1], "b": colors_lab[1][2]},
-                               "3": {"L": colors_lab[2][0], "a": colors_lab[2][1], "b": colors_lab[2][2]}},
-                "colors_hex": {"1": colors_hex[0], "2": colors_hex[1], "3": colors_hex[2]},
-                "color_avg_lab": {"L": color_avg_lab[0], "a": color_avg_lab[1], "b": color_avg_lab[2]},
-                "color_avg_hex": color_avg_hex,
-            },
-            "user_flow":{
-                "browser_name": browser_name,
-                "retailer": retailer,
-                "store_location": store_location,
-                "clarity_id": clarity_id,
-                "result_page_timestamp": result_page_timestamp,
-            },
-            "recommendation_focus": {},
-        }
-        print(f"Saving new client {client_id} to summary index {self.summary_pointer()}")
-        print(f"Summary: {summary_data}")
-        
-        # Ensure the summary index exists
-        summary_index = self.summary_pointer()
-        if summary_index not in self.summary:
-            self.create_summary_doc(summary_index)
+    @property
+    def ready(self) -> bool:
+        return self._loaded.is_set()
+
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> bool:
+        return self._loaded.wait(timeout)
+
+    def _background_load(self):
+        try:
+            self.load_summary()
+            self._finish_load()
+        except Exception as e:
+            print(f"Error loading clients summary: {type(e).__name__}: {str(e)}")
+            self.load_state["status"] = "failed"
+            self.load_state["error"] = f"{type(e).__name__}: {str(e)}"
+            # Clients without a known shard skip their deferred summary update
+            self._mark_loaded()
+
+    def load_summary(self, page_size: int = SUMMARY_PAGE_SIZE):
+        # Paged bulk load of all summary shards, building the client_id -> shard index.
+        # With a snapshot only the shard names and update times are listed and
+        # just the shards changed since the snapshot are read in full.
+        snapshot = self._read_snapshot()
+        if snapshot:
+            for shard_id, shard in snapshot["shards"].items():
+                self._register_shard(shard_id, shard)
+                self._shard_update_times[shard_id] = snapshot["update_times"].get(shard_id)
+            self.summary_index.rebuild(list(self.summary.values()))
+            self.load_state["from_snapshot"] = True
+            print(f"Clients summary resumed from snapshot with {len(snapshot['shards'])} shards")
+
+        last_doc = None
+        while True:
+            query = self.clients_summary_collection.order_by("__name__")
+            if snapshot:
+                query = query.select([])
+            if last_doc is not None:
+                query = query.start_after(last_doc)
+            docs = list(query.limit(page_size).stream())
+            if not docs:
+                break
+
+            if snapshot:
+                stale = [doc.reference for doc in docs if self._shard_id(doc.id) is not None and
+                         self._shard_update_times.get(doc.id) != _update_time_iso(doc.update_time)]
+                fetched = list(self.client.get_all(stale)) if stale else []
+            else:
+                fetched = docs
+            for doc in fetched:
+                shard_id = self._shard_id(doc.id)
+                if shard_id is not None:
+                    self._register_shard(shard_id, doc.to_dict() or {}, doc.update_time, overwrite=bool(snapshot))
+
+            self.load_state["shards_loaded"] += len(docs)
+            self.load_state["clients_loaded"] = len(self.shard_of)
+            last_doc = docs[-1]
+            if len(docs) < page_size:
+                break
+
+    @staticmethod
+    def _shard_id(doc_id: str) -> Optional[str]:
+        if _SHARD_ID.match(doc_id):
+            return doc_id
+        # Skip documents that are not summary shards
+        print(f"Skipping document with non-shard ID: {doc_id}")
+        return None
+
+    def _register_shard(self, shard_id: str, shard: Dict[str, Any], update_time=None, overwrite: bool = False):
+        existing = self.summary.get(shard_id)
+        if existing is None:
+            self.summary[shard_id] = shard
+        else:
+            # The shard was created or written locally before it was loaded
+            for client_id, entry in shard.items():
+                if overwrite:
+                    existing[client_id] = entry
+                else:
+                    existing.setdefault(client_id, entry)
+        for client_id in shard:
+            self.shard_of[client_id] = shard_id
+        if update_time is not None:
+            self._shard_update_times[shard_id] = _update_time_iso(update_time)
+
+    def _finish_load(self):
+        # Re-read shards written during the load: their page may have been read before the write
+        while self._dirty_shards:
+            dirty = list(self._dirty_shards)
+            self._dirty_shards.clear()
+            refs = [self.clients_summary_collection.document(shard_id) for shard_id in dirty]
+            for doc in self.client.get_all(refs):
+                if doc.exists:
+                    self._register_shard(doc.id, doc.to_dict() or {}, doc.update_time, overwrite=True)
+        self.summary_index.rebuild(list(self.summary.values()))
+        self.analytics.rebuild(self._joined_summary())
+        self.load_state.update({
+            "status": "ready",
+            "clients_loaded": len(self.shard_of),
+            "finished_at": datetime.now().isoformat(),
+        })
+        self._mark_loaded()
+        print(f"Clients summary loaded: {len(self.summary)} shards, {len(self.shard_of)} clients")
+        self.save_snapshot()
+
+    def _mark_loaded(self):
+        # Set under the lock so no update is deferred after the queue is drained
+        with self._deferred_lock:
+            self._loaded.set()
+            deferred, self._deferred_summary_updates = self._deferred_summary_updates, []
+        for client_id, write in deferred:
+            shard_id = self.shard_of.get(client_id)
+            if shard_id is None:
+                print(f"No summary shard found for client {client_id}, skipping its summary update")
+                continue
+            try:
+                write(shard_id)
+            except Exception as e:
+                print(f"Error applying deferred summary update of client {client_id}: {type(e).__name__}: {e}")
+
+    def _mark_shard_written(self, shard_id: str):
+        if not self._loaded.is_set():
+            self._dirty_shards.add(shard_id)
+
+    def _read_snapshot(self) -> Optional[Dict[str, Any]]:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with gzip.open(self.snapshot_path, "rt", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if snapshot.get("version") != SUMMARY_SNAPSHOT_VERSION:
+                return None
+            return snapshot
+        except Exception as e:
+            print(f"Ignoring unreadable clients summary snapshot {self.snapshot_path}: {e}")
+            return None
+
+    def save_snapshot(self) -> bool:
+        # Persist the loaded summary locally so the next start only re-reads changed shards
+        if not self.snapshot_path or self.load_state["status"] != "ready":
+            return False
+        try:
+            snapshot = {
+                "version": SUMMARY_SNAPSHOT_VERSION,
+                "saved_at": datetime.now().isoformat(),
+                "shards": {shard_id: dict(shard) for shard_id, shard in list(self.summary.items())},
+                "update_times": dict(self._shard_update_times),
+            }
+            temp_path = f"{self.snapshot_path}.tmp"
+            with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+                json.dump(snapshot, f, default=str)
+            os.replace(temp_path, self.snapshot_path)
+            return True
+        except Exception as e:
+            print(f"Error saving clients summary snapshot: {e}")
+            return False
+
+    def _allocate_shards(self, partition: str, sizes: List[int]) -> List[str]:
+        """
+        Reserves room for new summary entries of the given sizes in the partition's
+        shards. The partition counter (current shard number, its bytes and clients)
+        is updated in a transaction, so concurrent instances never overfill a shard.
+        1 firestore read and 1 write per call.
+        """
+        counter_ref = self.summary_counters_collection.document(partition)
+
+        @firestore.transactional
+        def allocate(transaction):
+            snapshot = counter_ref.get(transaction=transaction)
+            counter = snapshot.to_dict() if snapshot.exists else {}
+            shard = counter.get("shard", 0)
+            used_bytes = counter.get("bytes", 0)
+            clients = counter.get("clients", 0)
+            shard_ids = []
+            for size in sizes:
+                if clients and (used_bytes + size > SUMMARY_SHARD_MAX_BYTES or clients >= SUMMARY_SHARD_MAX_CLIENTS):
+                    shard, used_bytes, clients = shard + 1, 0, 0
+                used_bytes += size
+                clients += 1
+                shard_ids.append(f"{partition}_{shard:03d}")
+            transaction.set(counter_ref, {
+                "shard": shard,
+                "bytes": used_bytes,
+                "clients": clients,
+                "updated_at": datetime.now().isoformat(),
+            })
+            return shard_ids
+
+        return allocate(self.client.transaction())
+
+    def _assign_shards(self, new_clients: List[Tuple[str, Dict[str, Any], bool]]) -> Dict[str, str]:
+        """
+        Summary shard for each new client (client_id, summary_data, replayed).
+        Clients that already have a shard keep it; the others are allocated
+        one counter transaction per partition.
+        """
+        assigned = {}
+        to_allocate: Dict[str, List[Tuple[str, int]]] = {}
+        for client_id, summary_data, replayed in new_clients:
+            if client_id in assigned:
+                continue
+            shard_id = self.shard_of.get(client_id)
+            if shard_id is None and replayed:
+                # Replayed after a restart: the write may already have landed in a shard
+                shard_id = self._shard_from_client_doc(client_id)
+            if shard_id is not None:
+                assigned[client_id] = shard_id
+                continue
+            to_allocate.setdefault(summary_partition(summary_data), []).append(
+                (client_id, _summary_entry_size(client_id, summary_data)))
+        for partition, entries in to_allocate.items():
+            shard_ids = self._allocate_shards(partition, [size for _, size in entries])
+            assigned.update((client_id, shard_id) for (client_id, _), shard_id in zip(entries, shard_ids))
+        return assigned
+
+    def find_summary_index(self, client_id: str,
+                           deferred_write: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        # Summary shard of a client, None if the client has no summary entry.
+        # Before the load the client document records its shard (1 firestore read);
+        # for older documents without it deferred_write(shard_id) is queued to run
+        # once the load has found the shard, and None is returned without waiting.
+        shard_id = self.shard_of.get(client_id)
+        if shard_id is not None:
+            return shard_id
+        if not self._loaded.is_set():
+            shard_id = self._shard_from_client_doc(client_id)
+            if shard_id is not None:
+                return shard_id
+            with self._deferred_lock:
+                if not self._loaded.is_set():
+                    if deferred_write is not None:
+                        self._deferred_summary_updates.append((client_id, deferred_write))
+                    return None
+            shard_id = self.shard_of.get(client_id)
+            if shard_id is not None:
+                return shard_id
+        print(f"No summary shard found for client {client_id}, skipping its summary update")
+        return None
+
+    async def find_summary_index_async(self, client_id: str,
+                                       deferred_write: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        if client_id in self.shard_of or self._loaded.is_set():
+            return self.find_summary_index(client_id, deferred_write)
+        return await asyncio.to_thread(self.find_summary_index, client_id, deferred_write)
+
+    def _update_summary(self, client_id: str, write: Callable[[str], None]):
+        # Runs write(shard_id) now, or after the load for clients it has yet to find
+        shard_id = self.find_summary_index(client_id, write)
+        if shard_id is not None:
+            write(shard_id)
+
+    def _shard_from_client_doc(self, client_id: str) -> Optional[str]:
+        try:
+            doc = self.clients_collection.document(client_id).get(field_paths=["summary_shard"])
+        except Exception as e:
+            print(f"Error reading summary shard of client {client_id}: {e}")
+            return None
+        if not doc.exists:
+            return None
+        shard_id = (doc.to_dict() or {}).get("summary_shard")
+        # Clients saved before the day/store partitioning point to numbered shards
+        return str(shard_id) if shard_id is not None else None
+
+    _client_documents = staticmethod(_client_documents)
+
+    def _register_client(self, shard_id: str, client_id: str, summary_data: Dict[str, Any]):
+        self.summary.setdefault(shard_id, {})[client_id] = summary_data
+        self.shard_of[client_id] = shard_id
+        self.summary_index.add(client_id, summary_data)
+        self.analytics.observe(client_id, summary_data)
+        self._mark_shard_written(shard_id)
+
+    def save_new_client(self, **client_fields):
+        # Save new client
+        # 1 firestore transaction (shard allocation) + 3 firestore writes
+        client_id = client_fields["client_id"]
+        data, summary_data = self._client_documents(**client_fields)
+        shard_id = self._assign_shards([(client_id, summary_data, False)])[client_id]
+        # Lets updates find the shard before the summary is loaded
+        data["summary_shard"] = shard_id
+        print(f"Saving new client {client_id} to summary shard {shard_id}")
         
-        self.clients_summary_collection.document(str(summary_index)).set({client_id: summary_data}, merge=True)
+        self.clients_summary_collection.document(shard_id).set({client_id: summary_data}, merge=True)
         self.clients_collection.document(client_id).set(data)
-        self.summary[summary_index][client_id] = summary_data
+        self.clients_landmarks_collection.document(client_id).set(
+            _landmarks_document(client_id, client_fields.get("face_landmarks")))
+        self._register_client(shard_id, client_id, summary_data)
+
+    async def save_new_client_async(self, **client_fields):
+        # Save new client without blocking the event loop
+        # 1 firestore transaction (shard allocation) + 3 firestore writes, issued concurrently
+        if self.async_client is None:
+            return await asyncio.to_thread(self.save_new_client, **client_fields)
+        client_id = client_fields["client_id"]
+        data, summary_data = self._client_documents(**client_fields)
+        shard_id = (await asyncio.to_thread(self._assign_shards, [(client_id, summary_data, False)]))[client_id]
+        data["summary_shard"] = shard_id
+        print(f"Saving new client {client_id} to summary shard {shard_id}")
+        
+        # Register locally first so concurrent updates of this client find its shard
+        self._register_client(shard_id, client_id, summary_data)
+        await asyncio.gather(
+            self.async_clients_summary_collection.document(shard_id).set({client_id: summary_data}, merge=True),
+            self.async_clients_collection.document(client_id).set(data),
+            self.async_clients_landmarks_collection.document(client_id).set(
+                _landmarks_document(client_id, client_fields.get("face_landmarks"))),
+        )
 
     def get_client_features(self, client_id: str) -> Dict[str, Any]:
         # Get client features
@@ -224,6 +763,17 @@ class ClientsDBFirestore:
             return doc.to_dict().get("features", {})
         else:
             raise ValueError("Client ID not found")
+
+    async def get_client_features_async(self, client_id: str) -> Dict[str, Any]:
+        # Get client features without blocking the event loop
+        # 1 firestore read
+        if self.async_client is None:
+            return await asyncio.to_thread(self.get_client_features, client_id)
+        doc = await self.async_clients_collection.document(client_id).get()
+        if doc.exists:
+            return doc.to_dict().get("features", {})
+        else:
+            raise ValueError("Client ID not found")
         
     def get_client_skin_tone(self, client_id: str) -> Dict[str, Any]:
         # Get client skin tone (average color)
@@ -238,6 +788,12 @@ class ClientsDBFirestore:
         features = self.get_client_features(client_id)
         return features.get("colors_lab", {})
 
+    async def get_client_all_skin_data_async(self, client_id: str) -> Dict[str, Any]:
+        # Get all client skin data (colors_lab)
+        # 1 firestore read
+        features = await self.get_client_features_async(client_id)
+        return features.get("colors_lab", {})
+
     
     def get_client_option_data(self, client_id: str) -> Dict[str, Any]:
         # Get client option data (answers to questions)
@@ -253,8 +809,15 @@ class ClientsDBFirestore:
         self.clients_collection.document(client_id).update({
             f"user_flow.{field_name}": phone_page_timestamp
         })
-        self.clients_summary_collection.document(str(self.find_summary_index(client_id))).update({f"{client_id}.user_flow.{field_name}": phone_page_timestamp})
-        self.summary[self.find_summary_index(client_id)][client_id]["user_flow"][field_name] = phone_page_timestamp
+        self._update_summary(client_id, partial(self._write_phone_page_summary, client_id, phone_page_timestamp))
+
+    def _write_phone_page_summary(self, client_id: str, phone_page_timestamp: str, shard_id: str):
+        field_name = "phone_page_results_timestamp"
+        self.clients_summary_collection.document(shard_id).update({f"{client_id}.user_flow.{field_name}": phone_page_timestamp})
+        self._mark_shard_written(shard_id)
+        entry = self.summary.get(shard_id, {}).get(client_id)
+        if entry is not None:
+            entry["user_flow"][field_name] = phone_page_timestamp
 
     def focus_update(self, 
                      client_id: str, 
@@ -270,22 +833,28 @@ class ClientsDBFirestore:
                 "final_recommendations": final_recommendations
             }
         })
-        self.clients_summary_collection.document(str(self.find_summary_index(client_id))).update({
+        self._update_summary(client_id, partial(self._write_focus_summary, client_id, filters, final_recommendations))
+
+    def _write_focus_summary(self, client_id: str, filters: List[str],
+                             final_recommendations: List[Dict[str, Any]], shard_id: str):
+        self.clients_summary_collection.document(shard_id).update({
             f"{client_id}.recommendation_focus": {
                 "filters": filters,
                 "final_recommendations": final_recommendations
             }
         })
-        self.summary[self.find_summary_index(client_id)][client_id]["recommendation_focus"] = {
-            "filters": filters,
-            "final_recommendations": final_recommendations
-        }
+        self._mark_shard_written(shard_id)
+        entry = self.summary.get(shard_id, {}).get(client_id)
+        if entry is not None:
+            entry["recommendation_focus"] = {
+                "filters": filters,
+                "final_recommendations": final_recommendations
+            }
+            self.analytics.observe(client_id, entry)
 
-    def exit_update(self, client_id: str, exit_timestamp: str, filters: List[str], 
-                 final_recommendations: List[Dict[str, Any]]):
-        # Update exit timestamp and recommendation focus
-        # 2 firestore writes
-        
+    @staticmethod
+    def _exit_documents(client_id: str, exit_timestamp: str, filters: List[str],
+                        final_recommendations: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
         # Prepare the update data for both exit timestamp and recommendation focus
         main_update_data = {
             "user_flow.exit_timestamp": exit_timestamp,
@@ -295,22 +864,8 @@ class ClientsDBFirestore:
             }
         }
         
-        # For summary updates, we need to use bracket notation for client_id with hyphens
-        summary_update_data = {
-            f"`{client_id}`.user_flow.exit_timestamp": exit_timestamp,
-            f"`{client_id}`.recommendation_focus": {
-                "filters": filters,
-                "final_recommendations": final_recommendations
-            }
-        }
-        
-        # Write 1: Update main client document
-        self.clients_collection.document(client_id).update(main_update_data)
-        
-        # Write 2: Update summary document using set with merge=True instead of update
-        summary_index = self.find_summary_index(client_id)
-        
-        # Use set with merge=True to avoid field path issues
+        # Summary uses set with merge=True to avoid field path issues
+        # (client ids contain hyphens)
         nested_update = {
             client_id: {
                 "user_flow": {
@@ -322,36 +877,161 @@ class ClientsDBFirestore:
                 }
             }
         }
-        
-        self.clients_summary_collection.document(str(summary_index)).set(nested_update, merge=True)
-        
+        return main_update_data, nested_update
+
+    def _apply_exit_locally(self, shard_id: str, client_id: str, exit_timestamp: str,
+                            filters: List[str], final_recommendations: List[Dict[str, Any]]):
         # Update local cache
-        if summary_index in self.summary:
-            if client_id in self.summary[summary_index]:
-                self.summary[summary_index][client_id]["user_flow"]["exit_timestamp"] = exit_timestamp
-                self.summary[summary_index][client_id]["recommendation_focus"] = {
+        self._mark_shard_written(shard_id)
+        if shard_id in self.summary:
+            if client_id in self.summary[shard_id]:
+                self.summary[shard_id][client_id]["user_flow"]["exit_timestamp"] = exit_timestamp
+                self.summary[shard_id][client_id]["recommendation_focus"] = {
                     "filters": filters,
                     "final_recommendations": final_recommendations
                 }
+                self.analytics.observe(client_id, self.summary[shard_id][client_id])
+
+    def exit_update(self, client_id: str, exit_timestamp: str, filters: List[str], 
+                 final_recommendations: List[Dict[str, Any]]):
+        # Update exit timestamp and recommendation focus
+        # 2 firestore writes
+        main_update_data, nested_update = self._exit_documents(client_id, exit_timestamp, filters, final_recommendations)
+        
+        # Write 1: Update main client document
+        self.clients_collection.document(client_id).update(main_update_data)
+        
+        # Write 2: Update summary document
+        self._update_summary(client_id, partial(self._write_exit_summary, client_id, exit_timestamp, filters,
+                                                final_recommendations))
+
+    def _write_exit_summary(self, client_id: str, exit_timestamp: str, filters: List[str],
+                            final_recommendations: List[Dict[str, Any]], shard_id: str):
+        _, nested_update = self._exit_documents(client_id, exit_timestamp, filters, final_recommendations)
+        self.clients_summary_collection.document(shard_id).set(nested_update, merge=True)
+        self._apply_exit_locally(shard_id, client_id, exit_timestamp, filters, final_recommendations)
+
+    async def exit_update_async(self, client_id: str, exit_timestamp: str, filters: List[str],
+                                final_recommendations: List[Dict[str, Any]]):
+        # Update exit timestamp and recommendation focus without blocking the event loop
+        # 2 firestore writes, issued concurrently
+        if self.async_client is None:
+            return await asyncio.to_thread(self.exit_update, client_id, exit_timestamp, filters, final_recommendations)
+        main_update_data, nested_update = self._exit_documents(client_id, exit_timestamp, filters, final_recommendations)
+        shard_id = await self.find_summary_index_async(client_id, partial(
+            self._write_exit_summary, client_id, exit_timestamp, filters, final_recommendations))
+        if shard_id is None:
+            await self.async_clients_collection.document(client_id).update(main_update_data)
+            return
+        await asyncio.gather(
+            self.async_clients_collection.document(client_id).update(main_update_data),
+            self.async_clients_summary_collection.document(shard_id).set(nested_update, merge=True),
+        )
+        self._apply_exit_locally(shard_id, client_id, exit_timestamp, filters, final_recommendations)
+
+    _feedback_data = staticmethod(_feedback_data)
+
+    def _apply_feedback_locally(self, shard_id: str, client_id: str, feedback_data: Dict[str, Any]):
+        self._mark_shard_written(shard_id)
+        if shard_id in self.summary:
+            if client_id in self.summary[shard_id]:
+                self.summary[shard_id][client_id]["feedback"] = feedback_data
+                self.analytics.observe(client_id, self.summary[shard_id][client_id])
 
     def save_feedback(self, client_id: str, rating: int, improvements: list, opinions: str):
         # Save feedback
         # 2 firestore writes
-        feedback_data = {
-            "feedback_timestamp":  datetime.now().isoformat(),
-            "rating": rating,
-            "improvements": improvements,
-            "opinions": opinions,
-        }
+        feedback_data = self._feedback_data(rating, improvements, opinions)
         self.clients_collection.document(client_id).update({
             "feedback": feedback_data
         })
-        self.clients_summary_collection.document(str(self.find_summary_index(client_id))).update({
+        self._update_summary(client_id, partial(self._write_feedback_summary, client_id, feedback_data))
+
+    def _write_feedback_summary(self, client_id: str, feedback_data: Dict[str, Any], shard_id: str):
+        self.clients_summary_collection.document(shard_id).update({
             f"{client_id}.feedback": feedback_data
         })
-        if self.find_summary_index(client_id) in self.summary:
-            if client_id in self.summary[self.find_summary_index(client_id)]:
-                self.summary[self.find_summary_index(client_id)][client_id]["feedback"] = feedback_data
+        self._apply_feedback_locally(shard_id, client_id, feedback_data)
+
+    async def save_feedback_async(self, client_id: str, rating: int, improvements: list, opinions: str):
+        # Save feedback without blocking the event loop
+        # 2 firestore writes, issued concurrently
+        if self.async_client is None:
+            return await asyncio.to_thread(self.save_feedback, client_id, rating, improvements, opinions)
+        feedback_data = self._feedback_data(rating, improvements, opinions)
+        shard_id = await self.find_summary_index_async(client_id, partial(
+            self._write_feedback_summary, client_id, feedback_data))
+        writes = [self.async_clients_collection.document(client_id).update({
+            "feedback": feedback_data
+        })]
+        if shard_id is not None:
+            writes.append(self.async_clients_summary_collection.document(shard_id).update({
+                f"{client_id}.feedback": feedback_data
+            }))
+        await asyncio.gather(*writes)
+        if shard_id is not None:
+            self._apply_feedback_locally(shard_id, client_id, feedback_data)
+
+    def commit_writes(self, operations: List[Dict[str, Any]]):
+        """
+        Writes queued operations (see lib.write_behind) in one Firestore batch and
+        applies them to the in-memory summary. Each operation is a dict with
+        "kind" (save_new_client, exit_update or feedback) and "args"; writing an
+        operation again leaves the same documents (at-least-once delivery).
+        3 firestore writes per new client and 2 per update, at most 500 writes per
+        call, plus one shard allocation transaction per day/store partition of the
+        new clients.
+        """
+        new_clients = {}
+        for operation in operations:
+            if operation["kind"] == "save_new_client":
+                new_clients[operation["args"]["client_id"]] = (self._client_documents(**operation["args"]),
+                                                               operation.get("replayed", False))
+        shards = self._assign_shards([(client_id, summary_data, replayed)
+                                      for client_id, ((_, summary_data), replayed) in new_clients.items()])
+
+        batch = self.client.batch()
+        local_updates = []
+        for operation in operations:
+            kind, args = operation["kind"], operation["args"]
+            client_id = args["client_id"]
+            client_ref = self.clients_collection.document(client_id)
+            if kind == "save_new_client":
+                (data, summary_data), _ = new_clients[client_id]
+                shard_id = shards[client_id]
+                # Registered before the commit so a retry of the batch keeps the shard
+                self._register_client(shard_id, client_id, summary_data)
+                data["summary_shard"] = shard_id
+                batch.set(self.clients_summary_collection.document(shard_id), {client_id: summary_data}, merge=True)
+                batch.set(client_ref, data)
+                batch.set(self.clients_landmarks_collection.document(client_id),
+                          _landmarks_document(client_id, args.get("face_landmarks")))
+            elif kind == "exit_update":
+                main_update_data, nested_update = self._exit_documents(
+                    client_id, args["exit_timestamp"], args["filters"], args["final_recommendations"])
+                batch.update(client_ref, main_update_data)
+                shard_id = self.find_summary_index(client_id, partial(
+                    self._write_exit_summary, client_id, args["exit_timestamp"], args["filters"],
+                    args["final_recommendations"]))
+                if shard_id is not None:
+                    batch.set(self.clients_summary_collection.document(shard_id), nested_update, merge=True)
+                    local_updates.append(partial(self._apply_exit_locally, shard_id, client_id, args["exit_timestamp"],
+                                                 args["filters"], args["final_recommendations"]))
+            elif kind == "feedback":
+                feedback_data = args["feedback_data"]
+                batch.update(client_ref, {"feedback": feedback_data})
+                shard_id = self.find_summary_index(client_id, partial(
+                    self._write_feedback_summary, client_id, feedback_data))
+                if shard_id is not None:
+                    batch.update(self.clients_summary_collection.document(shard_id), {
+                        f"{client_id}.feedback": feedback_data
+                    })
+                    local_updates.append(partial(self._apply_feedback_locally, shard_id, client_id, feedback_data))
+            else:
+                raise ValueError(f"Unsupported write operation: {kind}")
+        batch.commit()
+        for apply_locally in local_updates:
+            apply_locally()
 
     def get_client(self, client_id: str) -> Dict[str, Any]:
         # Get full client data
@@ -362,148 +1042,456 @@ class ClientsDBFirestore:
         else:
             raise ValueError("Client ID not found")
 
+    async def get_client_async(self, client_id: str) -> Dict[str, Any]:
+        # Get full client data without blocking the event loop
+        # 1 firestore read
+        if self.async_client is None:
+            return await asyncio.to_thread(self.get_client, client_id)
+        doc = await self.async_clients_collection.document(client_id).get()
+        if doc.exists:
+            return doc.to_dict()
+        else:
+            raise ValueError("Client ID not found")
+
     def get_client_with_product_details(self, client_id: str, products_db: Any) -> Dict[str, Any]:
-        client_data = self.get_client(client_id)
-        recommended_products = client_data.get("recommendations", [])
-        for product in recommended_products:
-            gtin = product.get("product_id")
-            product_details = products_db.get_product_by_gtin("dm",gtin)
-            if product_details:
-                product["color_lab"] = product_details.get("color_lab", {})
-                product["color_hex"] = product_details.get("color_hex", "")
-                product["rescanned"] = len(product_details.get("changes", [])) > 1
-                product["changes"] = product_details.get("changes", [])
-        return client_data
+        return _with_product_details(self.get_client(client_id), products_db)
 
+    def get_client_landmarks(self, client_id: str) -> Any:
+        # Get the face landmarks of a client (kept out of the client document)
+        # 1 firestore read
+        doc = self.clients_landmarks_collection.document(client_id).get()
+        if doc.exists:
+            return decode_landmarks(doc.to_dict())
+        # Clients saved before the landmarks were split off
+        return self.get_client_features(client_id).get("face_landmarks")
 
-    def generate_summary_table(self):
+
+    def _joined_summary(self) -> List[Tuple[str, Dict[str, Any]]]:
+        # Snapshot of (client_id, summary entry) over all shards; later shards win
         joined_summary = {}
-        for index, clients in self.summary.items():
+        for index, clients in list(self.summary.items()):
             joined_summary.update(clients)
+        return list(joined_summary.items())
 
-        table = []
+    def iter_summary_rows(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the summary table rows, newest result page first.
+        The order is computed once up front; rows are built lazily.
+        """
+        entries = self._joined_summary()
+        # Sort by "user_flow.result_page_timestamp" (descending, bigger string first)
+        entries.sort(key=lambda entry: str(_safe_get(entry[1], "user_flow", "result_page_timestamp")), reverse=True)
+        for user_id, user_data in entries:
+            yield _checked_summary_row(user_id, user_data)
+
+    def generate_summary_table(self):
+        return list(self.iter_summary_rows())
+
+    def summary_page(self, limit: int = 50, cursor: Optional[str] = None, **filters) -> Dict[str, Any]:
+        """
+        One page of summary table rows, filtered and ordered by the summary index.
+        Filters: date_from, date_to, retailer, store_location, has_feedback, rating, order.
+        """
+        entries, next_cursor = self.summary_index.page(limit=limit, cursor=cursor, **filters)
+        rows = [_checked_summary_row(user_id, user_data) for user_id, user_data in entries]
+        return {"rows": rows, "next_cursor": next_cursor, "total_clients": len(self.summary_index),
+                "summary_ready": self.ready}
 
-        for user_id, user_data in joined_summary.items():
+    def generate_csv_stream(self, chunk_rows: int = 500, compress: bool = False) -> Iterator[bytes]:
+        """
+        Generate the CSV export as a stream of byte chunks for StreamingResponse.
+        Rows come from iter_summary_rows and are encoded chunk_rows at a time, so
+        neither the table nor the CSV is ever held in memory as a whole.
+        With compress=True the chunks form a single gzip stream.
+        Raises ValueError (before streaming starts) if there is no client data.
+        """
+        if not any(self.summary.values()):
+            raise ValueError("No client data available")
+        return _csv_chunks(self.iter_summary_rows(), chunk_rows, compress)
+
+
+# Indexed columns are copied from the summary entry; the documents are stored as JSON
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    client_id TEXT PRIMARY KEY,
+    retailer TEXT NOT NULL DEFAULT '',
+    store_location TEXT NOT NULL DEFAULT '',
+    result_page_timestamp TEXT NOT NULL DEFAULT '',
+    has_feedback INTEGER NOT NULL DEFAULT 0,
+    rating INTEGER,
+    document TEXT NOT NULL,
+    summary TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clients_by_time ON clients (result_page_timestamp, client_id);
+CREATE INDEX IF NOT EXISTS clients_by_retailer ON clients (retailer, result_page_timestamp, client_id);
+CREATE INDEX IF NOT EXISTS clients_by_store ON clients (store_location, result_page_timestamp, client_id);
+CREATE TABLE IF NOT EXISTS landmarks (
+    client_id TEXT PRIMARY KEY,
+    encoding TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    user_id TEXT PRIMARY KEY,
+    saved_at TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+"""
+
+# Rows fetched per query while streaming the summary table
+SQLITE_SUMMARY_FETCH_ROWS = 500
+
+
+def _sqlite_columns(summary_data: Dict[str, Any]) -> Tuple[str, str, str, int, Optional[int]]:
+    # Values of the indexed columns of a client row
+    user_flow = summary_data.get("user_flow") or {}
+    feedback = summary_data.get("feedback") or {}
+    rating = feedback.get("rating")
+    return (str(user_flow.get("retailer") or ""), str(user_flow.get("store_location") or ""),
+            str(user_flow.get("result_page_timestamp") or ""), int(bool(feedback)),
+            rating if isinstance(rating, int) else None)
+
+
+class ClientsDBSQLite:
+    # Local clients database in one SQLite file (WAL mode) with the method
+    # surface of ClientsDBFirestore, for deployments without Firestore.
+    # Each client is one row: the client document and its summary entry as
+    # JSON, next to indexed columns for the summary table filters and order.
+    # Every thread gets its own connection; writes are serialized by a lock
+    # and each call (or commit_writes batch) is a single transaction.
+    def __init__(self, db_path="clients/clients.db", skin_tone_classifier=None):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        with self._write_lock:
+            self._connection().executescript(SQLITE_SCHEMA)
+
+        self.analytics = SessionAggregates(skin_tone_classifier)
+        started_at = datetime.now().isoformat()
+        self.analytics.rebuild(self._iter_summary_entries())
+        clients = self._connection().execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+        self.load_state = {
+            "status": "ready",
+            "from_snapshot": False,
+            "shards_loaded": 0,
+            "clients_loaded": clients,
+            "started_at": started_at,
+            "finished_at": datetime.now().isoformat(),
+            "error": None,
+        }
+        print(f"Opened SQLite clients database {db_path} with {clients} clients")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # isolation_level=None: transactions are opened explicitly by _transaction
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._write_lock:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
             try:
-                # Helper function to safely get nested values
-                def safe_get(data, *keys, default=""):
-                    current = data
-                    try:
-                        for key in keys:
-                            current = current[key]
-                        return current
-                    except (KeyError, IndexError, TypeError):
-                        return default
-                    
-                def safe_get_final_recommendation_gtin(data, index=0, default=""):
-                    try:
-                        f_r = safe_get(user_data, "recommendation_focus", "final_recommendations", default={})
-                        if not f_r:
-                            return default
-                        try:
-                            return f_r[index].get("gtin", default)
-                        except (IndexError, AttributeError):
-                            return default
-                    except (IndexError, AttributeError):
-                        return default
-                    
-                def safe_get_final_recommendation_name(data, index=0, default=""):
-                    try:
-                        f_r = safe_get(user_data, "recommendation_focus", "final_recommendations", default={})
-                        if not f_r:
-                            return default
-                        try:
-                            brand = f_r[index].get("brand", "")
-                            description = f_r[index].get("description", "")
-                            return f"{brand} {description}".strip()
-                        except (IndexError, AttributeError):
-                            return default
-                    except (IndexError, AttributeError):
-                        return default
-                    
-                    
-
-                row = {
-                    "client_id": safe_get(user_data, "client_id", default=user_id),
-                    "features.colors_lab.1.L": safe_get(user_data, "features", "colors_lab", "1", "L"),
-                    "features.colors_lab.1.a": safe_get(user_data, "features", "colors_lab", "1", "a"),
-                    "features.colors_lab.1.b": safe_get(user_data, "features", "colors_lab", "1", "b"),
-                    "features.colors_lab.2.L": safe_get(user_data, "features", "colors_lab", "2", "L"),
-                    "features.colors_lab.2.a": safe_get(user_data, "features", "colors_lab", "2", "a"),
-                    "features.colors_lab.2.b": safe_get(user_data, "features", "colors_lab", "2", "b"),
-                    "features.colors_lab.3.L": safe_get(user_data, "features", "colors_lab", "3", "L"),
-                    "features.colors_lab.3.a": safe_get(user_data, "features", "colors_lab", "3", "a"),
-                    "features.colors_lab.3.b": safe_get(user_data, "features", "colors_lab", "3", "b"),
-                    "features.colors_hex.1": safe_get(user_data, "features", "colors_hex", "1"),
-                    "features.colors_hex.2": safe_get(user_data, "features", "colors_hex", "2"),
-                    "features.colors_hex.3": safe_get(user_data, "features", "colors_hex", "3"),
-                    "features.color_avg_lab.L": safe_get(user_data, "features", "color_avg_lab", "L"),
-                    "features.color_avg_lab.a": safe_get(user_data, "features", "color_avg_lab", "a"),
-                    "features.color_avg_lab.b": safe_get(user_data, "features", "color_avg_lab", "b"),
-                    "features.color_avg_hex": safe_get(user_data, "features", "color_avg_hex"),
-                    "user_flow.browser_name": safe_get(user_data, "user_flow", "browser_name"),
-                    "user_flow.retailer": safe_get(user_data, "user_flow", "retailer"),
-                    "user_flow.store_location": safe_get(user_data, "user_flow", "store_location"),
-                    "user_flow.clarity_id": safe_get(user_data, "user_flow", "clarity_id"),
-                    "user_flow.result_page_timestamp": safe_get(user_data, "user_flow", "result_page_timestamp"),
-                    "user_flow.phone_page_results_timestamp": safe_get(user_data, "user_flow", "phone_page_results_timestamp"),
-                    "user_flow.exit_timestamp": safe_get(user_data, "user_flow", "exit_timestamp"),
-                    "recommendation_focus.filters": safe_get(user_data, "recommendation_focus", "filters", default={}),
-                    "recommendation_focus.final_recommendations.1.gtin": safe_get_final_recommendation_gtin(user_data, index=0),
-                    "recommendation_focus.final_recommendations.1.name": safe_get_final_recommendation_name(user_data, index=0),
-                    "recommendation_focus.final_recommendations.2.gtin": safe_get_final_recommendation_gtin(user_data, index=1),
-                    "recommendation_focus.final_recommendations.2.name": safe_get_final_recommendation_name(user_data, index=1),
-                    "recommendation_focus.final_recommendations.3.gtin": safe_get_final_recommendation_gtin(user_data, index=2),
-                    "recommendation_focus.final_recommendations.3.name": safe_get_final_recommendation_name(user_data, index=2),
-                    "recommendation_focus.final_recommendations": safe_get(user_data, "recommendation_focus", "final_recommendations", default={}),
-                    "feedback.feedback_timestamp": safe_get(user_data, "feedback", "feedback_timestamp"),
-                    "feedback.rating": safe_get(user_data, "feedback", "rating"),
-                    "feedback.improvements": safe_get(user_data, "feedback", "improvements", default=[]),
-                    "feedback.opinions": safe_get(user_data, "feedback", "opinions", default=""),
-                }
-                table.append(row)
-                # Sort table by "user_flow.result_page_timestamp" (descending, bigger string first)
-                table.sort(key=lambda x: str(x.get("user_flow.result_page_timestamp", "")), reverse=True)
-            except Exception as e:
-                print(f"Error processing client {user_id}: {type(e).__name__}: {str(e)}")
-                # Add a minimal row with just the client_id to avoid losing the record completely
-                table.append({"client_id": user_id, "error": f"Error processing data: {str(e)}"})
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    @property
+    def ready(self) -> bool:
+        return True
+
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> bool:
+        return True
+
+    def save_snapshot(self) -> bool:
+        # Every write is already durable in the database file
+        return False
 
-        return table
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    _client_documents = staticmethod(_client_documents)
+    _feedback_data = staticmethod(_feedback_data)
+
+    def _insert_client(self, connection: sqlite3.Connection, client_fields: Dict[str, Any]) -> Dict[str, Any]:
+        # Saving a client again replaces it (replayed writes)
+        data, summary_data = self._client_documents(**client_fields)
+        landmarks = _landmarks_document(data["client_id"], client_fields.get("face_landmarks"))
+        connection.execute(
+            "INSERT OR REPLACE INTO clients (client_id, retailer, store_location, result_page_timestamp, "
+            "has_feedback, rating, document, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (data["client_id"], *_sqlite_columns(summary_data), json.dumps(data), json.dumps(summary_data)))
+        connection.execute("INSERT OR REPLACE INTO landmarks (client_id, encoding, data) VALUES (?, ?, ?)",
+                           (data["client_id"], landmarks["encoding"], landmarks["data"]))
+        return summary_data
+
+    @staticmethod
+    def _update_documents(connection: sqlite3.Connection, client_id: str,
+                          apply: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+        # Applies the same change to the client document and its summary entry
+        row = connection.execute("SELECT document, summary FROM clients WHERE client_id = ?", (client_id,)).fetchone()
+        if row is None:
+            raise ValueError("Client ID not found")
+        data, summary_data = json.loads(row[0]), json.loads(row[1])
+        apply(data)
+        apply(summary_data)
+        connection.execute(
+            "UPDATE clients SET retailer = ?, store_location = ?, result_page_timestamp = ?, has_feedback = ?, "
+            "rating = ?, document = ?, summary = ? WHERE client_id = ?",
+            (*_sqlite_columns(summary_data), json.dumps(data), json.dumps(summary_data), client_id))
+        return summary_data
+
+    @staticmethod
+    def _exit_change(exit_timestamp: str, filters: List[str], final_recommendations: List[Dict[str, Any]]):
+        def apply(document: Dict[str, Any]):
+            document.setdefault("user_flow", {})["exit_timestamp"] = exit_timestamp
+            document["recommendation_focus"] = {"filters": filters, "final_recommendations": final_recommendations}
+        return apply
+
+    @staticmethod
+    def _feedback_change(feedback_data: Dict[str, Any]):
+        def apply(document: Dict[str, Any]):
+            document["feedback"] = feedback_data
+        return apply
+
+    def _update_client_documents(self, client_id: str, apply: Callable[[Dict[str, Any]], None]):
+        with self._transaction() as connection:
+            summary_data = self._update_documents(connection, client_id, apply)
+        self.analytics.observe(client_id, summary_data)
+
+    def save_new_client(self, **client_fields):
+        # Save new client
+        # 1 sqlite transaction
+        print(f"Saving new client {client_fields['client_id']} to {self.db_path}")
+        with self._transaction() as connection:
+            summary_data = self._insert_client(connection, client_fields)
+        self.analytics.observe(client_fields["client_id"], summary_data)
+
+    async def save_new_client_async(self, **client_fields):
+        return await asyncio.to_thread(self.save_new_client, **client_fields)
+
+    def get_client_features(self, client_id: str) -> Dict[str, Any]:
+        # Get client features
+        # 1 sqlite read (only the features are decoded)
+        row = self._connection().execute(
+            "SELECT json_extract(document, '$.features') FROM clients WHERE client_id = ?", (client_id,)).fetchone()
+        if row is None:
+            raise ValueError("Client ID not found")
+        return json.loads(row[0]) if row[0] else {}
 
-    def generate_csv_stream(self) -> str:
+    async def get_client_features_async(self, client_id: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_client_features, client_id)
+
+    def get_client_skin_tone(self, client_id: str) -> Dict[str, Any]:
+        # Get client skin tone (average color)
+        features = self.get_client_features(client_id)
+        color_dic = features.get("color_avg_lab", {})
+        return [color_dic.get("L", 0), color_dic.get("a", 0), color_dic.get("b", 0)]
+
+    def get_client_all_skin_data(self, client_id: str) -> Dict[str, Any]:
+        # Get all client skin data (colors_lab)
+        features = self.get_client_features(client_id)
+        return features.get("colors_lab", {})
+
+    async def get_client_all_skin_data_async(self, client_id: str) -> Dict[str, Any]:
+        features = await self.get_client_features_async(client_id)
+        return features.get("colors_lab", {})
+
+    def get_client_option_data(self, client_id: str) -> Dict[str, Any]:
+        # Get client option data (answers to questions)
+        features = self.get_client_features(client_id)
+        return features.get("option_data", {})
+
+    def phone_page_update(self, client_id: str, phone_page_timestamp: str):
+        def apply(document: Dict[str, Any]):
+            document.setdefault("user_flow", {})["phone_page_results_timestamp"] = phone_page_timestamp
+        self._update_client_documents(client_id, apply)
+
+    def focus_update(self,
+                     client_id: str,
+                     filters: List[str],
+                     final_recommendations: List[Dict[str, Any]]):
+        def apply(document: Dict[str, Any]):
+            document["recommendation_focus"] = {"filters": filters, "final_recommendations": final_recommendations}
+        self._update_client_documents(client_id, apply)
+
+    def exit_update(self, client_id: str, exit_timestamp: str, filters: List[str],
+                    final_recommendations: List[Dict[str, Any]]):
+        # Update exit timestamp and recommendation focus
+        # 1 sqlite transaction
+        self._update_client_documents(client_id, self._exit_change(exit_timestamp, filters, final_recommendations))
+
+    async def exit_update_async(self, client_id: str, exit_timestamp: str, filters: List[str],
+                                final_recommendations: List[Dict[str, Any]]):
+        return await asyncio.to_thread(self.exit_update, client_id, exit_timestamp, filters, final_recommendations)
+
+    def save_feedback(self, client_id: str, rating: int, improvements: list, opinions: str):
+        # Save feedback
+        # 1 sqlite transaction
+        self._update_client_documents(client_id, self._feedback_change(self._feedback_data(rating, improvements, opinions)))
+
+    async def save_feedback_async(self, client_id: str, rating: int, improvements: list, opinions: str):
+        return await asyncio.to_thread(self.save_feedback, client_id, rating, improvements, opinions)
+
+    def commit_writes(self, operations: List[Dict[str, Any]]):
         """
-        Generate CSV content as a string for streaming download.
-        Uses the data from generate_summary_table function.
-        Returns the CSV content that can be used with StreamingResponse.
+        Writes queued operations (see lib.write_behind) in one transaction, so a
+        batch of new clients costs a single commit. Operations have the same
+        "kind" and "args" as for ClientsDBFirestore.commit_writes; writing an
+        operation again leaves the same rows.
         """
-        # Get the table data from the existing method
-        table = self.generate_summary_table()
-        
-        if not table:
+        summaries = {}
+        with self._transaction() as connection:
+            for operation in operations:
+                kind, args = operation["kind"], operation["args"]
+                client_id = args["client_id"]
+                if kind == "save_new_client":
+                    summary_data = self._insert_client(connection, args)
+                elif kind == "exit_update":
+                    summary_data = self._update_documents(connection, client_id, self._exit_change(
+                        args["exit_timestamp"], args["filters"], args["final_recommendations"]))
+                elif kind == "feedback":
+                    summary_data = self._update_documents(connection, client_id,
+                                                          self._feedback_change(args["feedback_data"]))
+                else:
+                    raise ValueError(f"Unsupported write operation: {kind}")
+                summaries[client_id] = summary_data
+        for client_id, summary_data in summaries.items():
+            self.analytics.observe(client_id, summary_data)
+
+    def get_client(self, client_id: str) -> Dict[str, Any]:
+        # Get full client data
+        # 1 sqlite read
+        row = self._connection().execute("SELECT document FROM clients WHERE client_id = ?", (client_id,)).fetchone()
+        if row is None:
+            raise ValueError("Client ID not found")
+        return json.loads(row[0])
+
+    async def get_client_async(self, client_id: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_client, client_id)
+
+    def get_client_with_product_details(self, client_id: str, products_db: Any) -> Dict[str, Any]:
+        return _with_product_details(self.get_client(client_id), products_db)
+
+    def get_client_landmarks(self, client_id: str) -> Any:
+        # Get the face landmarks of a client (kept out of the client document)
+        row = self._connection().execute(
+            "SELECT encoding, data FROM landmarks WHERE client_id = ?", (client_id,)).fetchone()
+        if row is None:
+            raise ValueError("Client ID not found")
+        return decode_landmarks({"encoding": row[0], "data": row[1]})
+
+    def _iter_summary_entries(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for client_id, summary in self._connection().execute("SELECT client_id, summary FROM clients"):
+            yield client_id, json.loads(summary)
+
+    def _summary_query(self,
+                       date_from: Optional[str] = None,
+                       date_to: Optional[str] = None,
+                       retailer: Optional[str] = None,
+                       store_location: Optional[str] = None,
+                       has_feedback: Optional[bool] = None,
+                       rating: Optional[int] = None,
+                       order: str = "desc",
+                       limit: int = 50,
+                       after: Optional[Tuple[str, str]] = None) -> List[Tuple[str, str, str]]:
+        # (timestamp, client_id, summary JSON) rows after the (timestamp, client_id) key, in order
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'")
+        conditions, parameters = [], []
+        for column, value in (("retailer", retailer), ("store_location", store_location), ("rating", rating)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if has_feedback is not None:
+            conditions.append("has_feedback = ?")
+            parameters.append(int(has_feedback))
+        if date_from:
+            conditions.append("result_page_timestamp >= ?")
+            parameters.append(date_from)
+        if date_to:
+            # Sorts after every character that can follow a date prefix in an ISO timestamp
+            conditions.append("result_page_timestamp <= ?")
+            parameters.append(date_to + '\uffff')
+        if after is not None:
+            conditions.append(f"(result_page_timestamp, client_id) {'<' if order == 'desc' else '>'} (?, ?)")
+            parameters.extend(after)
+        direction = "DESC" if order == "desc" else "ASC"
+        query = ("SELECT result_page_timestamp, client_id, summary FROM clients"
+                 + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+                 + f" ORDER BY result_page_timestamp {direction}, client_id {direction} LIMIT ?")
+        return self._connection().execute(query, (*parameters, limit)).fetchall()
+
+    def iter_summary_rows(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the summary table rows, newest result page first.
+        Rows are read SQLITE_SUMMARY_FETCH_ROWS at a time with keyset queries,
+        so a stream can be resumed from any thread.
+        """
+        after = None
+        while True:
+            fetched = self._summary_query(limit=SQLITE_SUMMARY_FETCH_ROWS, after=after)
+            for _, user_id, summary in fetched:
+                yield _checked_summary_row(user_id, json.loads(summary))
+            if len(fetched) < SQLITE_SUMMARY_FETCH_ROWS:
+                return
+            after = fetched[-1][:2]
+
+    def generate_summary_table(self):
+        return list(self.iter_summary_rows())
+
+    def summary_page(self, limit: int = 50, cursor: Optional[str] = None, **filters) -> Dict[str, Any]:
+        """
+        One page of summary table rows, filtered and ordered by the table indexes.
+        Filters: date_from, date_to, retailer, store_location, has_feedback, rating, order.
+        """
+        fetched = self._summary_query(limit=limit + 1, after=decode_cursor(cursor) if cursor else None, **filters)
+        next_cursor = encode_cursor(tuple(fetched[limit - 1][:2])) if len(fetched) > limit else None
+        rows = [_checked_summary_row(user_id, json.loads(summary)) for _, user_id, summary in fetched[:limit]]
+        total_clients = self._connection().execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+        return {"rows": rows, "next_cursor": next_cursor, "total_clients": total_clients, "summary_ready": True}
+
+    def generate_csv_stream(self, chunk_rows: int = 500, compress: bool = False) -> Iterator[bytes]:
+        """
+        Generate the CSV export as a stream of byte chunks for StreamingResponse.
+        Raises ValueError (before streaming starts) if there is no client data.
+        """
+        if self._connection().execute("SELECT 1 FROM clients LIMIT 1").fetchone() is None:
             raise ValueError("No client data available")
-        
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Get column names from the first row (all rows should have same keys)
-        if table:
-            column_names = list(table[0].keys())
-            
-            # Write header row
-            writer.writerow(column_names)
-            
-            # Write data rows
-            for row_data in table:
-                row = [row_data.get(col, "") for col in column_names]
-                writer.writerow(row)
-        
-        # Return CSV content as string
-        output.seek(0)
-        csv_content = output.getvalue()
-        
-        print(f"CSV generated with {len(table)} clients and {len(column_names) if table else 0} columns")
-        
-        return csv_content
+        return _csv_chunks(self.iter_summary_rows(), chunk_rows, compress)
 
+    def save_result(self, user_id: str, return_info: Dict[str, Any]):
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO results (user_id, saved_at, result) VALUES (?, ?, ?)",
+                               (user_id, datetime.now().isoformat(), json.dumps(return_info)))
+
+    def get_result(self, user_id: str) -> Dict[str, Any]:
+        row = self._connection().execute("SELECT result FROM results WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            raise FileNotFoundError("User ID not found")
+        return json.loads(row[0])
+
+    def get_all_clients(self) -> List[Dict[str, Any]]:
+        return [{"client_id": client_id, "timestamp": timestamp} for client_id, timestamp in self._connection().execute(
+            "SELECT client_id, result_page_timestamp FROM clients ORDER BY result_page_timestamp, client_id")]
+
+    def update_client(self, client: Dict[str, Any]):
+        def apply(document: Dict[str, Any]):
+            document.update({key: value for key, value in client.items() if key != "client_id"})
+        self._update_client_documents(client["client_id"], apply)
@@ -0,0 +1,177 @@
+"""
+Incrementally maintained index over the in-memory clients summary.
+
+Keeps the summary entries ordered by result page timestamp, overall and per
+retailer and store location, so the admin dashboard can filter and page
+through sessions without recomputing the whole summary table. Entries are the
+same dictionaries held in the summary shards, so exit/feedback updates applied
+to the shards are visible to queries without touching the index.
+"""
+
+import base64
+import bisect
+import json
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Sorts after every character that can follow a date prefix in an ISO timestamp
+_RANGE_END = '\uffff'
+
+
+def _sort_key(client_id: str, entry: Dict[str, Any]) -> Tuple[str, str]:
+    timestamp = (entry.get("user_flow") or {}).get("result_page_timestamp") or ""
+    return str(timestamp), client_id
+
+
+def encode_cursor(key: Tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        timestamp, client_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(timestamp), str(client_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class ClientsSummaryIndex:
+    """
+    Sorted views of the clients summary.
+
+    Usage:
+        index = ClientsSummaryIndex()
+        index.add(client_id, summary_entry)
+        entries, next_cursor = index.page(retailer="dm", date_from="2025-06-01", limit=50)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._keys: Dict[str, Tuple[str, str]] = {}
+        self._all: List[Tuple[str, str]] = []
+        self._by_retailer: Dict[str, List[Tuple[str, str]]] = {}
+        self._by_store: Dict[str, List[Tuple[str, str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _partitions(entry: Dict[str, Any]) -> Tuple[str, str]:
+        user_flow = entry.get("user_flow") or {}
+        return str(user_flow.get("retailer") or ""), str(user_flow.get("store_location") or "")
+
+    def rebuild(self, shards: Iterable[Dict[str, Dict[str, Any]]]) -> None:
+        """Rebuilds the index from summary shards ({client_id: entry} dictionaries)."""
+        entries = {}
+        for shard in shards:
+            entries.update((client_id, entry) for client_id, entry in shard.items() if isinstance(entry, dict))
+        keys = {client_id: _sort_key(client_id, entry) for client_id, entry in entries.items()}
+        by_retailer: Dict[str, List[Tuple[str, str]]] = {}
+        by_store: Dict[str, List[Tuple[str, str]]] = {}
+        for client_id, entry in entries.items():
+            retailer, store_location = self._partitions(entry)
+            by_retailer.setdefault(retailer, []).append(keys[client_id])
+            by_store.setdefault(store_location, []).append(keys[client_id])
+        for keys_list in list(by_retailer.values()) + list(by_store.values()):
+            keys_list.sort()
+        with self._lock:
+            self._entries = entries
+            self._keys = keys
+            self._all = sorted(keys.values())
+            self._by_retailer = by_retailer
+            self._by_store = by_store
+
+    def add(self, client_id: str, entry: Dict[str, Any]) -> None:
+        """Adds (or replaces) the summary entry of a client."""
+        with self._lock:
+            self._remove_locked(client_id)
+            key = _sort_key(client_id, entry)
+            retailer, store_location = self._partitions(entry)
+            self._entries[client_id] = entry
+            self._keys[client_id] = key
+            bisect.insort(self._all, key)
+            bisect.insort(self._by_retailer.setdefault(retailer, []), key)
+            bisect.insort(self._by_store.setdefault(store_location, []), key)
+
+    def remove(self, client_id: str) -> None:
+        with self._lock:
+            self._remove_locked(client_id)
+
+    def _remove_locked(self, client_id: str) -> None:
+        key = self._keys.pop(client_id, None)
+        entry = self._entries.pop(client_id, None)
+        if key is None:
+            return
+        retailer, store_location = self._partitions(entry)
+        for keys_list in (self._all, self._by_retailer.get(retailer, []), self._by_store.get(store_location, [])):
+            position = bisect.bisect_left(keys_list, key)
+            if position < len(keys_list) and keys_list[position] == key:
+                keys_list.pop(position)
+
+    def page(self,
+             date_from: Optional[str] = None,
+             date_to: Optional[str] = None,
+             retailer: Optional[str] = None,
+             store_location: Optional[str] = None,
+             has_feedback: Optional[bool] = None,
+             rating: Optional[int] = None,
+             order: str = "desc",
+             limit: int = 50,
+             cursor: Optional[str] = None) -> Tuple[List[Tuple[str, Dict[str, Any]]], Optional[str]]:
+        """
+        One page of summary entries matching the filters.
+
+        Args:
+            date_from: Earliest result page timestamp (ISO date or timestamp prefix, inclusive)
+            date_to: Latest result page timestamp (ISO date or timestamp prefix, inclusive)
+            retailer: Only sessions of this retailer
+            store_location: Only sessions of this store location
+            has_feedback: Only sessions with (True) or without (False) feedback
+            rating: Only sessions with this feedback rating
+            order: "desc" (newest first) or "asc"
+            limit: Maximum number of entries
+            cursor: next_cursor of the previous page
+
+        Returns:
+            Tuple of ([(client_id, entry), ...], next_cursor); next_cursor is None on the last page
+        """
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'")
+        with self._lock:
+            # Scan the narrowest sorted list that satisfies the partition filters
+            if store_location is not None:
+                keys = self._by_store.get(store_location, [])
+            elif retailer is not None:
+                keys = self._by_retailer.get(retailer, [])
+            else:
+                keys = self._all
+            start = bisect.bisect_left(keys, (date_from,)) if date_from else 0
+            end = bisect.bisect_right(keys, (date_to + _RANGE_END,)) if date_to else len(keys)
+            if cursor:
+                position = decode_cursor(cursor)
+                if order == "desc":
+                    end = min(end, bisect.bisect_left(keys, position))
+                else:
+                    start = max(start, bisect.bisect_right(keys, position))
+            positions = range(end - 1, start - 1, -1) if order == "desc" else range(start, end)
+
+            results = []
+            next_cursor = None
+            for i in positions:
+                key = keys[i]
+                client_id = key[1]
+                entry = self._entries[client_id]
+                entry_retailer, entry_store = self._partitions(entry)
+                if retailer is not None and entry_retailer != retailer:
+                    continue
+                feedback = entry.get("feedback") or {}
+                if has_feedback is not None and bool(feedback) != has_feedback:
+                    continue
+                if rating is not None and feedback.get("rating") != rating:
+                    continue
+                if len(results) == limit:
+                    next_cursor = encode_cursor(results[-1][0])
+                    break
+                results.append((key, entry))
+        return [(key[1], entry) for key, entry in results], next_cursor
@@ -1,10 +1,16 @@
 import numpy as np
 from colormath.color_objects import XYZColor, sRGBColor, LabColor
-from colormath.color_conversions import convert_color
 from colormath import color_diff_matrix
 import numpy as np
 
+# colormath.color_conversions imports networkx (most of the import time of this
+# module); it is imported on first use, or by warm_up() in the background at boot
+
+def warm_up():
+    lab_to_hex(50, 10, 15)
+
 def lab_to_hex(L, a, b, visual_adjustment=True):
+    from colormath.color_conversions import convert_color
     if visual_adjustment:
         L = L * 1.25  
     lab = LabColor(L, a, b)
@@ -12,6 +18,7 @@ def lab_to_hex(L, a, b, visual_adjustment=True):
     return rgb.get_rgb_hex()
 
 def hex_to_lab(hex_color):
+    from colormath.color_conversions import convert_color
     rgb = sRGBColor.new_from_rgb_hex(hex_color)
     lab = convert_color(rgb, LabColor, target_illuminant='d50')
     return [lab.lab_l, lab.lab_a, lab.lab_b]
@@ -37,6 +44,16 @@ def distance_between_colors(lab1, lab2):
     c2 = LabColor(lab2[0], lab2[1], lab2[2])
     return _delta_e_cie2000(c1, c2)
 
+def distances_to_colors(lab, lab_matrix, Kl=1, Kc=1, Kh=1):
+    """
+    Calculate the CIEDE2000 distances between one color and an (n, 3) matrix of colors in one call.
+    """
+    lab_matrix = np.asarray(lab_matrix, dtype=float)
+    if lab_matrix.size == 0:
+        return np.empty(0)
+    color_vector = np.array([lab[0], lab[1], lab[2]], dtype=float)
+    return color_diff_matrix.delta_e_cie2000(color_vector, lab_matrix, Kl=Kl, Kc=Kc, Kh=Kh)
+
 if __name__ == "__main__":
     # Test the conversion functions
     # def mse(lab1, lab2):
@@ -0,0 +1,94 @@
+"""
+Sized executors for the blocking work of the async request handlers.
+
+The handlers are async, but product matching, color math, ERP requests and
+the Firestore SDK block. Running them on the event loop serializes all
+requests, so they are handed to one of two thread pools:
+- cpu_executor: matching, color math and in-memory table building, sized to
+  the cores so concurrent requests do not oversubscribe them
+- io_executor: blocking clients (ERP requests, Firestore and SQLite calls,
+  token verification), sized for many concurrent waits; it is also the event
+  loop's default executor, so asyncio.to_thread in the libraries uses it
+
+Both are thread pools because the matching works on the catalogs held by
+this process (NumPy releases the GIL in the vectorized scoring).
+Sizes: CPU_EXECUTOR_WORKERS (default: CPU count), IO_EXECUTOR_WORKERS (default 32).
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict
+
+CPU_EXECUTOR_WORKERS = int(os.getenv("CPU_EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+IO_EXECUTOR_WORKERS = int(os.getenv("IO_EXECUTOR_WORKERS", "32"))
+
+
+class SizedExecutor:
+    """
+    Thread pool with a fixed size that runs functions for async callers and
+    counts the calls in flight.
+
+    Usage:
+        executor = SizedExecutor("cpu", workers=4)
+        result = await executor.run(func, *args, **kwargs)
+    """
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{name}-executor")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs func(*args, **kwargs) on the pool (with the caller's context variables)."""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            return await loop.run_in_executor(self.executor, partial(context.run, func, *args, **kwargs))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "completed": self.completed,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+
+cpu_executor = SizedExecutor("cpu", CPU_EXECUTOR_WORKERS)
+io_executor = SizedExecutor("io", IO_EXECUTOR_WORKERS)
+
+
+async def run_cpu(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Runs CPU-bound work (matching, color math) on the CPU executor."""
+    return await cpu_executor.run(func, *args, **kwargs)
+
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Runs a blocking client call (ERP, Firestore, SQLite, token verification) on the I/O executor."""
+    return await io_executor.run(func, *args, **kwargs)
+
+
+def install_default_executor(loop: asyncio.AbstractEventLoop = None):
+    """Makes the I/O executor the loop's default executor (used by asyncio.to_thread)."""
+    (loop or asyncio.get_running_loop()).set_default_executor(io_executor.executor)
+
+
+def executors_status() -> Dict[str, Dict[str, Any]]:
+    return {executor.name: executor.status() for executor in (cpu_executor, io_executor)}
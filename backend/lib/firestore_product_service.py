@@ -3,16 +3,41 @@ Firestore Product Service for Makeup Matching System
 
 This service manages product data in Firestore with versioning and change tracking.
 Provides methods for CRUD operations and product matching functionality.
+
+Document layout (products/{product_id}):
+- current: current product state
+- metadata: compact change summary (created_at, version_count, last_modified,
+  last_rescan, rescanned)
+- history/{entry_id}: one document per change, ordered by entry id
+
+Older documents may still carry the change history as a 'changes' map;
+migrate_product_history() moves it into the subcollection.
 """
 
+import copy
 import json
 import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Callable, Dict, Any, Optional, List, Tuple
 from pathlib import Path
 from google.cloud import firestore
+from google.cloud.firestore_v1.bulk_writer import BulkRetry, BulkWriterOptions
 from google.oauth2 import service_account
 from .color_tools import distance_between_colors
+from .metrics import external_call
+from .product_catalog import ProductCatalog
+
+
+HISTORY_SUBCOLLECTION = 'history'
+COLOR_FIELDS = ('color_lab', 'color_hex')
+# Attempts per document write in BulkWriter jobs (retries use exponential backoff)
+BULK_WRITE_MAX_ATTEMPTS = 5
+# Minimum seconds between two progress reports of an import
+IMPORT_PROGRESS_INTERVAL = 1.0
 
 
 class FirestoreProductService:
@@ -31,7 +56,8 @@ class FirestoreProductService:
                  service_account_path: Optional[str] = None,
                  project_id: str = None,
                  database_id: str = 'your-database-id',
-                 collection_name: str = 'products'):
+                 collection_name: str = 'products',
+                 meta_collection_name: str = 'catalog_meta'):
         """
         Initialize the Firestore product service.
         
@@ -40,6 +66,7 @@ class FirestoreProductService:
             project_id: Google Cloud Project ID
             database_id: Firestore database ID
             collection_name: Collection name for products
+            meta_collection_name: Collection holding catalog-wide documents (facets)
         """
         self.project_id = project_id
         self.database_id = database_id
@@ -50,19 +77,43 @@ class FirestoreProductService:
         self._cache_timestamps = {}
         self._cache_ttl = 300  # 5 minutes cache TTL
         
+        # Compact per-store catalogs, the single in-RAM copy of the store
+        # catalogs (FoundationMatchingService reads them from here)
+        self._catalogs: Dict[str, ProductCatalog] = {}
+        self._catalog_loaded_at: Dict[str, datetime] = {}
+        self._catalog_lock = threading.Lock()
+        # One load per store at a time; writes made during a load are kept and re-applied to its result
+        self._catalog_load_locks: Dict[str, threading.Lock] = {}
+        self._catalog_generations: Dict[str, int] = {}
+        self._catalog_load_changes: Dict[str, List[Tuple[str, Dict[str, Any], Dict[str, Any]]]] = {}
+        
+        # Catalog facets (brands, types, counts, price ranges) served from memory
+        self._facets: Optional[Dict[str, Any]] = None
+        self._facets_loaded_at: Optional[datetime] = None
+        self._facets_lock = threading.Lock()
+        
+        # Callbacks notified after product writes (keeps in-memory catalogs in sync)
+        self._change_listeners: List[Callable[[List[Tuple[str, Dict[str, Any], Dict[str, Any]]]], None]] = []
+        self._history_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='product-history')
+        
         # Initialize Firestore client
         try:
             if service_account_path:
                 # Use service account file (local development)
                 cred = service_account.Credentials.from_service_account_file(service_account_path)
                 self.db = firestore.Client(project=project_id, credentials=cred, database=database_id)
+                # Async client for request handlers (does not block the event loop)
+                self.async_db = firestore.AsyncClient(project=project_id, credentials=cred, database=database_id)
                 print(f"Firestore client initialized with service account file: {service_account_path}")
             else:
                 # Use default application credentials (GCP environment)
                 self.db = firestore.Client(project=project_id, database=database_id)
+                self.async_db = firestore.AsyncClient(project=project_id, database=database_id)
                 print(f"Firestore client initialized with default credentials")
             
             self.collection = self.db.collection(collection_name)
+            self.async_collection = self.async_db.collection(collection_name)
+            self.facets_doc = self.db.collection(meta_collection_name).document('facets')
             print(f"Firestore client initialized successfully for project: {project_id}")
         except Exception as e:
             print(f"Error initializing Firestore client: {e}")
@@ -98,13 +149,449 @@ class FirestoreProductService:
         """Clear all cached data."""
         self._cache.clear()
         self._cache_timestamps.clear()
+        self.clear_catalogs()
         print("Cache cleared")
     
+    def clear_catalogs(self) -> None:
+        """Drop the cached store catalogs; they are reloaded on next access."""
+        with self._catalog_lock:
+            self._catalogs.clear()
+            self._catalog_loaded_at.clear()
+
+    def add_change_listener(self, listener: Callable[[List[Tuple[str, Dict[str, Any], Dict[str, Any]]]], None]) -> None:
+        """
+        Registers a callback invoked after products were written by this service.
+        
+        Args:
+            listener: Callable receiving a list of (product_id, new_current, metadata)
+                tuples; bulk writes deliver all their products in one call
+        """
+        self._change_listeners.append(listener)
+    
+    def _notify_product_changes(self, changes: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]) -> None:
+        """
+        Applies product writes to the cached store catalogs, invalidates cached
+        reads of the written products and notifies the change listeners.
+        """
+        if not changes:
+            return
+        for product_id, _, _ in changes:
+            cache_key = self._get_cache_key('get_product_current', product_id)
+            self._cache.pop(cache_key, None)
+            self._cache_timestamps.pop(cache_key, None)
+        with self._catalog_lock:
+            for store_brand, load_changes in self._catalog_load_changes.items():
+                # A load is streaming this store: its result may predate these writes
+                load_changes.extend(changes)
+                self._catalog_generations[store_brand] = self._catalog_generations.get(store_brand, 0) + 1
+            for store_brand, catalog in list(self._catalogs.items()):
+                # Only products sold by the store or already in its catalog (keyed lookup) touch it
+                store_changes = [
+                    (product_id,
+                     self.store_product_view(product_id, current, store_brand, metadata)
+                     if store_brand in (current.get('retailers') or {}) else None)
+                    for product_id, current, metadata in changes
+                    if store_brand in (current.get('retailers') or {}) or catalog.find(product_id) is not None
+                ]
+                if store_changes:
+                    # One new catalog per store and batch; catalogs are replaced, not
+                    # mutated, so readers of the previous one are unaffected
+                    self._catalogs[store_brand] = catalog.with_changes(store_changes)
+                    self._catalog_generations[store_brand] = self._catalog_generations.get(store_brand, 0) + 1
+        for listener in self._change_listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                print(f"Error in product change listener for {len(changes)} product(s): {e}")
+    
+    def _notify_product_change(self, product_id: str, current: Dict[str, Any],
+                               metadata: Dict[str, Any]) -> None:
+        """Single-product shortcut for _notify_product_changes."""
+        self._notify_product_changes([(product_id, current, metadata)])
+
+    @staticmethod
+    def _parse_price(value: Any) -> Optional[float]:
+        """Best-effort conversion of a stored price ('6.95', '6,95 €', 6.95) to float."""
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            return float(value)
+        if isinstance(value, str):
+            cleaned = value.replace('€', '').replace(',', '.').strip()
+            try:
+                return float(cleaned)
+            except ValueError:
+                return None
+        return None
+
+    def _product_facet_entries(self, current: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Extracts the facet-relevant values of a product for every store it is listed in.
+
+        Args:
+            current: Current product state (the 'current' map of the document)
+
+        Returns:
+            dict: store_brand -> {'brand', 'type', 'price'}
+        """
+        entries = {}
+        if not current:
+            return entries
+
+        for store_brand, store_info in (current.get('retailers') or {}).items():
+            # Store-specific fields override general product fields (same as get_products_by_store)
+            view = {**current, **(store_info if isinstance(store_info, dict) else {})}
+            entries[store_brand] = {
+                'brand': view.get('brand') or None,
+                'type': view.get('type') or None,
+                'price': self._parse_price(view.get('price')),
+            }
+        return entries
+
+    def _facets_delta(self, old_current: Optional[Dict[str, Any]],
+                      new_current: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Computes the counter changes caused by replacing old_current with new_current.
+
+        Returns:
+            dict with 'stores' (store -> {'product_count', 'brands', 'types'} deltas),
+            'types' (catalog-wide type deltas), 'product_count' delta and 'prices'
+            (store -> list of new prices to fold into the price range)
+        """
+        delta = {'stores': {}, 'types': {}, 'product_count': 0, 'prices': {}}
+
+        def add(entries: Dict[str, Dict[str, Any]], current: Optional[Dict[str, Any]], sign: int):
+            if current is None:
+                return
+            delta['product_count'] += sign
+            product_type = current.get('type')
+            if product_type:
+                delta['types'][product_type] = delta['types'].get(product_type, 0) + sign
+            for store_brand, entry in entries.items():
+                store_delta = delta['stores'].setdefault(
+                    store_brand, {'product_count': 0, 'brands': {}, 'types': {}})
+                store_delta['product_count'] += sign
+                if entry['brand']:
+                    store_delta['brands'][entry['brand']] = store_delta['brands'].get(entry['brand'], 0) + sign
+                if entry['type']:
+                    store_delta['types'][entry['type']] = store_delta['types'].get(entry['type'], 0) + sign
+                if sign > 0 and entry['price'] is not None:
+                    delta['prices'].setdefault(store_brand, []).append(entry['price'])
+
+        add(self._product_facet_entries(old_current), old_current, -1)
+        add(self._product_facet_entries(new_current), new_current, 1)
+        return delta
+
+    @staticmethod
+    def _merge_facets_delta(target: Dict[str, Any], delta: Dict[str, Any]) -> None:
+        """Accumulates a facets delta into another delta (used to write one update per batch)."""
+        target['product_count'] += delta['product_count']
+        for product_type, n in delta['types'].items():
+            target['types'][product_type] = target['types'].get(product_type, 0) + n
+        for store_brand, store_delta in delta['stores'].items():
+            store_target = target['stores'].setdefault(
+                store_brand, {'product_count': 0, 'brands': {}, 'types': {}})
+            store_target['product_count'] += store_delta['product_count']
+            for key in ('brands', 'types'):
+                for name, n in store_delta[key].items():
+                    store_target[key][name] = store_target[key].get(name, 0) + n
+        for store_brand, prices in delta['prices'].items():
+            target['prices'].setdefault(store_brand, []).extend(prices)
+
+    def _apply_facets_delta(self, delta: Dict[str, Any]) -> None:
+        """
+        Applies a facets delta to the in-memory facets and to the facets document.
+
+        Counters are written with Firestore increment transforms so concurrent
+        instances do not overwrite each other. Price ranges only ever widen on
+        write; rebuild_facets() recomputes them exactly.
+        """
+        timestamp = datetime.utcnow().isoformat() + 'Z'
+        update: Dict[str, Any] = {'updated_at': timestamp}
+
+        if delta['product_count']:
+            update['product_count'] = firestore.Increment(delta['product_count'])
+        types_update = {t: firestore.Increment(n) for t, n in delta['types'].items() if n}
+        if types_update:
+            update['types'] = types_update
+
+        stores_update = {}
+        for store_brand, store_delta in delta['stores'].items():
+            store_update = {}
+            if store_delta['product_count']:
+                store_update['product_count'] = firestore.Increment(store_delta['product_count'])
+            for key in ('brands', 'types'):
+                counters = {name: firestore.Increment(n) for name, n in store_delta[key].items() if n}
+                if counters:
+                    store_update[key] = counters
+            if store_update:
+                stores_update[store_brand] = store_update
+        for store_brand, prices in delta['prices'].items():
+            store_update = stores_update.setdefault(store_brand, {})
+            store_update['price_min'] = firestore.Minimum(min(prices))
+            store_update['price_max'] = firestore.Maximum(max(prices))
+        if stores_update:
+            update['stores'] = stores_update
+
+        with self._facets_lock:
+            if self._facets is not None:
+                # Copy on write: facets returned by get_catalog_facets() are never mutated
+                facets = copy.deepcopy(self._facets)
+                facets['product_count'] = facets.get('product_count', 0) + delta['product_count']
+                for product_type, n in delta['types'].items():
+                    facets.setdefault('types', {})[product_type] = facets.get('types', {}).get(product_type, 0) + n
+                for store_brand, store_delta in delta['stores'].items():
+                    store_facets = facets.setdefault('stores', {}).setdefault(
+                        store_brand, {'product_count': 0, 'brands': {}, 'types': {}})
+                    store_facets['product_count'] = store_facets.get('product_count', 0) + store_delta['product_count']
+                    for key in ('brands', 'types'):
+                        counters = store_facets.setdefault(key, {})
+                        for name, n in store_delta[key].items():
+                            counters[name] = counters.get(name, 0) + n
+                for store_brand, prices in delta['prices'].items():
+                    store_facets = facets.setdefault('stores', {}).setdefault(
+                        store_brand, {'product_count': 0, 'brands': {}, 'types': {}})
+                    store_facets['price_min'] = min([store_facets.get('price_min', min(prices)), *prices])
+                    store_facets['price_max'] = max([store_facets.get('price_max', max(prices)), *prices])
+                facets['updated_at'] = timestamp
+                self._facets = facets
+
+        try:
+            self.facets_doc.set(update, merge=True)
+        except Exception as e:
+            print(f"Error updating catalog facets: {e}")
+
+    def rebuild_facets(self) -> Dict[str, Any]:
+        """
+        Recomputes the catalog facets document with a single pass over the collection.
+
+        Only needed once for an existing catalog (or to tighten price ranges);
+        afterwards the document is maintained on every write.
+
+        Returns:
+            dict: The rebuilt facets
+        """
+        delta = {'stores': {}, 'types': {}, 'product_count': 0, 'prices': {}}
+        for doc in self.collection.select(['current']).stream():
+            current = (doc.to_dict() or {}).get('current')
+            self._merge_facets_delta(delta, self._facets_delta(None, current))
+
+        facets = {
+            'product_count': delta['product_count'],
+            'types': delta['types'],
+            'stores': {},
+            'updated_at': datetime.utcnow().isoformat() + 'Z',
+        }
+        for store_brand, store_delta in delta['stores'].items():
+            facets['stores'][store_brand] = {
+                'product_count': store_delta['product_count'],
+                'brands': store_delta['brands'],
+                'types': store_delta['types'],
+            }
+            prices = delta['prices'].get(store_brand)
+            if prices:
+                facets['stores'][store_brand]['price_min'] = min(prices)
+                facets['stores'][store_brand]['price_max'] = max(prices)
+
+        self.facets_doc.set(facets)
+        with self._facets_lock:
+            self._facets = facets
+            self._facets_loaded_at = datetime.now()
+        print(f"Catalog facets rebuilt: {facets['product_count']} products, "
+              f"{len(facets['stores'])} stores")
+        return facets
+
+    def get_catalog_facets(self) -> Dict[str, Any]:
+        """
+        Gets the catalog facets (brands, types per store, counts, price ranges).
+
+        Served from memory; the facets document is re-read (one document read)
+        once the cache TTL expires so writes from other instances are picked up.
+        The collection is only scanned if the facets document does not exist yet.
+        The returned dict is shared and must not be modified: writes replace the
+        cached facets with an updated copy instead of changing them in place.
+
+        Returns:
+            dict: Facets document
+        """
+        with self._facets_lock:
+            if (self._facets is not None and self._facets_loaded_at is not None and
+                    datetime.now() - self._facets_loaded_at < timedelta(seconds=self._cache_ttl)):
+                return self._facets
+
+        doc = self.facets_doc.get()
+        if not doc.exists:
+            print("Catalog facets document not found, rebuilding")
+            return self.rebuild_facets()
+
+        with self._facets_lock:
+            self._facets = doc.to_dict() or {}
+            self._facets_loaded_at = datetime.now()
+            return self._facets
+
+    def _history_collection(self, product_id: str):
+        """Gets the history subcollection of a product."""
+        return self.collection.document(product_id).collection(HISTORY_SUBCOLLECTION)
+    
+    @staticmethod
+    def _history_entry_id(timestamp: str) -> str:
+        """History entry ids start with the timestamp so ordering by id orders by time."""
+        return f"{timestamp}_{uuid.uuid4().hex[:8]}"
+    
+    @staticmethod
+    def _history_entry(timestamp: str, change_record: Dict[str, Any]) -> Dict[str, Any]:
+        """Builds the history document stored for a change record."""
+        fields = change_record.get('fields') or {}
+        return {
+            **change_record,
+            'timestamp': timestamp,
+            'color_change': any(field in fields for field in COLOR_FIELDS),
+        }
+    
+    @staticmethod
+    def _initial_metadata(timestamp: str) -> Dict[str, Any]:
+        """Metadata summary of a newly created product."""
+        return {
+            'created_at': timestamp,
+            'version_count': 1,
+            'last_modified': timestamp,
+            'last_rescan': None,
+            'rescanned': False,
+        }
+    
+    @staticmethod
+    def _next_metadata(metadata: Dict[str, Any], timestamp: str,
+                       change_record: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Advances the metadata summary for an update.
+        
+        A product counts as rescanned once it was updated after its creation
+        (see _is_rescanned_metadata); last_rescan is the time of the last
+        update of one of its color fields.
+        """
+        metadata = dict(metadata or {})
+        metadata['version_count'] = metadata.get('version_count', 0) + 1
+        metadata['last_modified'] = timestamp
+        metadata['rescanned'] = FirestoreProductService._is_rescanned_metadata(metadata)
+        if any(field in (change_record.get('fields') or {}) for field in COLOR_FIELDS):
+            metadata['last_rescan'] = timestamp
+        return metadata
+    
+    @staticmethod
+    def _is_rescanned_metadata(metadata: Dict[str, Any]) -> bool:
+        """
+        Whether a product counts as rescanned: updated at least once after its
+        creation, the rule of the legacy 'changes' map (more than one entry)
+        and of default_is_rescanned for catalog products.
+        """
+        return bool(metadata.get('rescanned')) or metadata.get('version_count', 1) > 1
+    
+    @staticmethod
+    def store_product_view(product_id: str, current: Dict[str, Any], store_brand: str,
+                           metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Builds the flat product dictionary used for matching in one store.
+        
+        Args:
+            product_id: Product identifier
+            current: Current product state
+            store_brand: Store brand whose retailer fields are merged in
+            metadata: Document metadata summary
+            
+        Returns:
+            dict: General product info merged with the store-specific info
+        """
+        metadata = metadata or {}
+        product = current.copy()
+        product.update(current['retailers'][store_brand])
+        product['store_brand'] = store_brand
+        product['product_id'] = product_id
+        product['version_count'] = metadata.get('version_count', 1)
+        product['last_rescan'] = metadata.get('last_rescan')
+        product['rescanned'] = FirestoreProductService._is_rescanned_metadata(metadata)
+        return product
+    
+    def _legacy_history(self, changes: Optional[Dict[str, Any]], metadata: Dict[str, Any]
+                        ) -> Tuple[Dict[str, Any], List[Tuple[str, Dict[str, Any]]]]:
+        """
+        History entries of a legacy 'changes' map and the metadata summary
+        updated for them.
+        
+        Entry ids are derived from the legacy timestamps, so moving the same
+        map twice does not duplicate entries.
+        
+        Returns:
+            Tuple of (metadata, [(entry_id, history entry), ...])
+        """
+        metadata = dict(metadata or {})
+        entries = []
+        color_changes = []
+        for timestamp, change_record in (changes or {}).items():
+            entry = self._history_entry(timestamp, change_record or {})
+            if entry['color_change']:
+                color_changes.append(timestamp)
+            entries.append((f"{timestamp}_legacy", entry))
+        if entries:
+            # Same rule as _is_rescanned_metadata: one 'changes' entry per version
+            metadata['rescanned'] = bool(metadata.get('rescanned')) or len(entries) > 1
+            if color_changes and not metadata.get('last_rescan'):
+                metadata['last_rescan'] = max(color_changes)
+        return metadata, entries
+    
+    def _create_documents(self, product_data: Dict[str, Any], timestamp: str, created_by: str,
+                          existing: Optional[Dict[str, Any]] = None
+                          ) -> Tuple[Dict[str, Any], Dict[str, Any], List[Tuple[str, Dict[str, Any]]]]:
+        """
+        Document fields and history entries for creating a product.
+        
+        Creating an existing product overwrites it as a new version: its
+        metadata summary is carried forward (version_count, rescanned,
+        last_rescan), so it keeps matching the history subcollection, and a
+        legacy 'changes' map is moved into the history and deleted.
+        
+        Args:
+            product_data: Dictionary containing product fields
+            timestamp: Timestamp of the change
+            created_by: User/system that created the product
+            existing: Stored document ('current', 'metadata' and a legacy
+                'changes' map), None for a new product
+            
+        Returns:
+            Tuple of (fields, change_record, legacy_entries): fields to set()
+            as a new document or update() an existing one with, the change
+            record of the new history entry and the (entry_id, entry) pairs of
+            the legacy history
+        """
+        current = {**product_data, 'last_updated': timestamp}
+        if existing is None:
+            change_record = {'action': 'create', 'data': product_data, 'by': created_by}
+            return {'current': current, 'metadata': self._initial_metadata(timestamp)}, change_record, []
+        
+        old_current = existing.get('current') or {}
+        field_changes = {
+            field: {'old': old_current.get(field), 'new': current.get(field)}
+            for field in sorted(set(old_current) | set(current))
+            if field != 'last_updated' and old_current.get(field) != current.get(field)
+        }
+        change_record = {'action': 'overwrite', 'data': product_data, 'fields': field_changes, 'by': created_by}
+        metadata, legacy_entries = self._legacy_history(existing.get('changes'), existing.get('metadata'))
+        fields = {
+            'current': current,
+            'metadata': self._next_metadata(metadata, timestamp, change_record),
+            'changes': firestore.DELETE_FIELD,
+        }
+        return fields, change_record, legacy_entries
+    
     def create_product(self, product_id: str, product_data: Dict[str, Any], 
                       created_by: str = 'system') -> bool:
         """
         Creates a new product with initial data and change tracking.
         
+        An existing product with the same id is overwritten as a new version
+        (see _create_documents); its previous state is read in the same
+        transaction, so the facets counters move from the old to the new
+        values instead of counting the product twice.
+        
         Args:
             product_id: Unique identifier for the product
             product_data: Dictionary containing product fields
@@ -115,28 +602,29 @@ class FirestoreProductService:
         """
         try:
             timestamp = datetime.utcnow().isoformat() + 'Z'
+            doc_ref = self.collection.document(product_id)
+            history_ref = self._history_collection(product_id)
             
-            # Prepare the document structure
-            doc_data = {
-                'current': {
-                    **product_data,
-                    'last_updated': timestamp
-                },
-                'changes': {
-                    timestamp: {
-                        'action': 'create',
-                        'data': product_data,
-                        'by': created_by
-                    }
-                },
-                'metadata': {
-                    'created_at': timestamp,
-                    'version_count': 1,
-                    'last_modified': timestamp
-                }
-            }
+            # Previous state, document and history entries in one transaction
+            @firestore.transactional
+            def apply_create(transaction):
+                doc = doc_ref.get(field_paths=['current', 'metadata', 'changes'], transaction=transaction)
+                existing = doc.to_dict() if doc.exists else None
+                fields, change_record, legacy_entries = self._create_documents(
+                    product_data, timestamp, created_by, existing)
+                if existing is None:
+                    transaction.set(doc_ref, fields)
+                else:
+                    transaction.update(doc_ref, fields)
+                for entry_id, entry in legacy_entries:
+                    transaction.set(history_ref.document(entry_id), entry)
+                transaction.set(history_ref.document(self._history_entry_id(timestamp)),
+                                self._history_entry(timestamp, change_record))
+                return (existing or {}).get('current'), fields
             
-            self.collection.document(product_id).set(doc_data)
+            old_current, fields = apply_create(self.db.transaction())
+            self._apply_facets_delta(self._facets_delta(old_current, fields['current']))
+            self._notify_product_change(product_id, fields['current'], fields['metadata'])
             print(f"Product '{product_id}' created successfully")
             return True
             
@@ -144,11 +632,54 @@ class FirestoreProductService:
             print(f"Error creating product '{product_id}': {e}")
             return False
     
+    @staticmethod
+    def _diff_product(old_current: Dict[str, Any], updates: Dict[str, Any],
+                      timestamp: str, updated_by: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        Computes the new current state and change record for an update.
+        
+        Args:
+            old_current: Current product state before the update
+            updates: Dictionary of field updates
+            timestamp: Timestamp of the change
+            updated_by: User/system that updated the product
+            
+        Returns:
+            Tuple of (new_current, change_record), or None if nothing changed
+        """
+        # Track field changes
+        field_changes = {}
+        for field, new_value in updates.items():
+            old_value = old_current.get(field)
+            if old_value != new_value:
+                field_changes[field] = {
+                    'old': old_value,
+                    'new': new_value
+                }
+        
+        if not field_changes:
+            return None
+        
+        # Update current state
+        new_current = {**old_current, **updates, 'last_updated': timestamp}
+        
+        # Add change record
+        change_record = {
+            'action': 'update',
+            'fields': field_changes,
+            'by': updated_by
+        }
+        return new_current, change_record
+    
     def update_product(self, product_id: str, updates: Dict[str, Any], 
                       updated_by: str = 'system') -> bool:
         """
         Updates product fields with change tracking.
         
+        The read, the document update and the history entry run in one
+        transaction, so concurrent updates of the same product cannot overwrite
+        each other's changes.
+        
         Args:
             product_id: Product identifier
             updates: Dictionary of field updates
@@ -159,51 +690,43 @@ class FirestoreProductService:
         """
         try:
             doc_ref = self.collection.document(product_id)
-            doc = doc_ref.get()
+            timestamp = datetime.utcnow().isoformat().split('.')[0] + 'Z'
             
-            if not doc.exists:
+            @firestore.transactional
+            def apply_update(transaction):
+                doc = doc_ref.get(transaction=transaction)
+                if not doc.exists:
+                    return None
+                
+                current_data = doc.to_dict()
+                old_current = current_data.get('current', {})
+                diff = self._diff_product(old_current, updates, timestamp, updated_by)
+                if diff is None:
+                    return old_current, None, None
+                new_current, change_record = diff
+                metadata = self._next_metadata(current_data.get('metadata', {}), timestamp, change_record)
+                
+                transaction.update(doc_ref, {
+                    'current': new_current,
+                    'metadata': metadata
+                })
+                transaction.set(history_ref.document(self._history_entry_id(timestamp)),
+                                self._history_entry(timestamp, change_record))
+                return old_current, new_current, metadata
+            
+            history_ref = self._history_collection(product_id)
+            result = apply_update(self.db.transaction())
+            if result is None:
                 print(f"Product '{product_id}' does not exist")
                 return False
             
-            current_data = doc.to_dict()
-            old_current = current_data.get('current', {})
-            timestamp = datetime.utcnow().isoformat().split('.')[0] + 'Z'
-            
-            # Track field changes
-            field_changes = {}
-            for field, new_value in updates.items():
-                old_value = old_current.get(field)
-                if old_value != new_value:
-                    field_changes[field] = {
-                        'old': old_value,
-                        'new': new_value
-                    }
-            
-            if not field_changes:
+            old_current, new_current, metadata = result
+            if new_current is None:
                 print(f"No changes detected for product '{product_id}'")
                 return True
             
-            # Update current state
-            new_current = {**old_current, **updates, 'last_updated': timestamp}
-            
-            # Add change record
-            change_record = {
-                'action': 'update',
-                'fields': field_changes,
-                'by': updated_by
-            }
-            
-            # Update metadata
-            metadata = current_data.get('metadata', {})
-            metadata['version_count'] = metadata.get('version_count', 0) + 1
-            metadata['last_modified'] = timestamp
-            
-            # Update document
-            doc_ref.update({
-                'current': new_current,
-                f'changes.{timestamp}': change_record,
-                'metadata': metadata
-            })
+            self._apply_facets_delta(self._facets_delta(old_current, new_current))
+            self._notify_product_change(product_id, new_current, metadata)
             
             print(f"Product '{product_id}' updated successfully")
             return True
@@ -212,6 +735,142 @@ class FirestoreProductService:
             print(f"Error updating product '{product_id}': {e}")
             return False
     
+    def bulk_update_products(self, items: List[Dict[str, Any]],
+                             updated_by: str = 'system') -> List[Dict[str, Any]]:
+        """
+        Updates many products at once (e.g. after a rescan session).
+        
+        All documents are fetched with one batched read, diffed locally and the
+        changed ones are written in parallel through a BulkWriter. Every write
+        carries a last-update-time precondition, so a product modified by
+        someone else in the meantime is reported as a conflict instead of being
+        silently overwritten. History entries are written in a second pass for
+        the updates that succeeded.
+        
+        Args:
+            items: List of dictionaries with 'product_id' and 'updates' keys
+            updated_by: User/system that updated the products
+            
+        Returns:
+            List of per-item results in input order, each with 'product_id',
+            'status' ('updated', 'unchanged', 'not_found', 'conflict', 'error' or
+            'invalid'), 'changed_fields' and 'error'
+        """
+        results = []
+        pending = {}
+        for item in items:
+            product_id = item.get('product_id') if isinstance(item, dict) else None
+            updates = item.get('updates') if isinstance(item, dict) else None
+            result = {'product_id': product_id, 'status': 'invalid', 'changed_fields': [], 'error': None}
+            results.append(result)
+            if not product_id or not isinstance(updates, dict) or not updates:
+                result['error'] = 'product_id and updates are required'
+            elif product_id in pending:
+                result['error'] = 'duplicate product_id in request'
+            else:
+                pending[product_id] = (result, updates)
+        
+        if not pending:
+            return results
+        
+        timestamp = datetime.utcnow().isoformat().split('.')[0] + 'Z'
+        refs = [self.collection.document(product_id) for product_id in pending]
+        try:
+            snapshots = {snapshot.id: snapshot for snapshot in self.db.get_all(refs)}
+        except Exception as e:
+            print(f"Error reading products for bulk update: {e}")
+            for result, _ in pending.values():
+                result['status'] = 'error'
+                result['error'] = str(e)
+            return results
+        
+        # Diff every product locally before writing anything
+        staged = {}
+        for product_id, (result, updates) in pending.items():
+            snapshot = snapshots.get(product_id)
+            if snapshot is None or not snapshot.exists:
+                result['status'] = 'not_found'
+                continue
+            
+            current_data = snapshot.to_dict()
+            old_current = current_data.get('current', {})
+            diff = self._diff_product(old_current, updates, timestamp, updated_by)
+            if diff is None:
+                result['status'] = 'unchanged'
+                continue
+            
+            new_current, change_record = diff
+            metadata = self._next_metadata(current_data.get('metadata', {}), timestamp, change_record)
+            result['changed_fields'] = sorted(change_record['fields'].keys())
+            staged[product_id] = {
+                'snapshot': snapshot,
+                'old_current': old_current,
+                'new_current': new_current,
+                'change_record': change_record,
+                'metadata': metadata,
+            }
+        
+        if staged:
+            lock = threading.Lock()
+            written = set()
+            
+            def on_result(reference, write_result, bulk_writer):
+                with lock:
+                    written.add(reference.id)
+            
+            def on_error(failure, bulk_writer) -> bool:
+                product_id = failure.operation.reference.id
+                # FAILED_PRECONDITION: the document changed after it was read
+                if failure.code == 9:
+                    with lock:
+                        pending[product_id][0]['status'] = 'conflict'
+                        pending[product_id][0]['error'] = 'product was modified concurrently'
+                    return False
+                retry = failure.attempts < BULK_WRITE_MAX_ATTEMPTS
+                if not retry:
+                    with lock:
+                        pending[product_id][0]['status'] = 'error'
+                        pending[product_id][0]['error'] = failure.message
+                return retry
+            
+            bulk_writer = self.db.bulk_writer()
+            bulk_writer.on_write_result(on_result)
+            bulk_writer.on_write_error(on_error)
+            for product_id, change in staged.items():
+                bulk_writer.update(
+                    change['snapshot'].reference,
+                    {
+                        'current': change['new_current'],
+                        'metadata': change['metadata']
+                    },
+                    option=self.db.write_option(last_update_time=change['snapshot'].update_time)
+                )
+            bulk_writer.close()
+            
+            history_writer = self.db.bulk_writer()
+            history_writer.on_write_error(lambda failure, bulk_writer: failure.attempts < BULK_WRITE_MAX_ATTEMPTS)
+            batch_delta = {'stores': {}, 'types': {}, 'product_count': 0, 'prices': {}}
+            changes = []
+            for product_id in written:
+                change = staged[product_id]
+                pending[product_id][0]['status'] = 'updated'
+                history_writer.set(
+                    self._history_collection(product_id).document(self._history_entry_id(timestamp)),
+                    self._history_entry(timestamp, change['change_record'])
+                )
+                self._merge_facets_delta(batch_delta, self._facets_delta(change['old_current'], change['new_current']))
+                changes.append((product_id, change['new_current'], change['metadata']))
+            history_writer.close()
+            if written:
+                self._apply_facets_delta(batch_delta)
+                self._notify_product_changes(changes)
+        
+        summary = {}
+        for result in results:
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+        print(f"Bulk update finished: {summary}")
+        return results
+    
     def get_product_current(self, product_id: str) -> Optional[Dict[str, Any]]:
         """
         Gets the current state of a product.
@@ -244,50 +903,140 @@ class FirestoreProductService:
             print(f"Error getting product '{product_id}': {e}")
             return None
     
-    def get_products_by_store(self, store_brand: str) -> List[Dict[str, Any]]:
+    async def get_product_current_async(self, product_id: str) -> Optional[Dict[str, Any]]:
         """
-        Gets all products available in a specific store brand.
+        Gets the current state of a product without blocking the event loop.
+        
+        Shares the cache with get_product_current.
         
         Args:
-            store_brand: Store brand identifier (e.g., 'dm', 'douglas')
+            product_id: Product identifier
             
         Returns:
-            List of product dictionaries
+            dict or None: Current product data or None if not found
         """
         try:
-            # Check cache first
-            cache_key = self._get_cache_key('get_products_by_store', store_brand)
+            cache_key = self._get_cache_key('get_product_current', product_id)
             cached_result = self._get_from_cache(cache_key)
             if cached_result is not None:
-                print(f"Cache hit for store '{store_brand}'")
                 return cached_result
             
-            products = []
-            docs = self.collection.where(f'current.retailers.{store_brand}', '>', {}).stream()
+            doc = await self.async_collection.document(product_id).get(['current'])
+            if doc.exists:
+                result = doc.to_dict().get('current')
+                self._set_cache(cache_key, result)
+                return result
+            
+            return None
+            
+        except Exception as e:
+            print(f"Error getting product '{product_id}': {e}")
+            return None
+    
+    def get_store_catalog(self, store_brand: str, max_age_seconds: Optional[float] = None) -> ProductCatalog:
+        """
+        Gets the compact catalog of all products available in a store brand.
+        
+        The catalog is loaded once and then kept in sync with the writes made
+        through this service; max_age_seconds additionally reloads it when it
+        is older (to pick up writes made by other instances). Concurrent
+        callers share one load per store; writes made through this service
+        while it streams are re-applied to the loaded catalog before it is
+        cached.
+        
+        Args:
+            store_brand: Store brand identifier (e.g., 'dm', 'douglas')
+            max_age_seconds: Optional maximum age of a cached catalog
             
+        Returns:
+            ProductCatalog of the store (read-only product views)
+        """
+        requested_at = datetime.now()
+        catalog = self._fresh_catalog(store_brand, max_age_seconds)
+        if catalog is not None:
+            return catalog
+        
+        with self._catalog_lock:
+            load_lock = self._catalog_load_locks.setdefault(store_brand, threading.Lock())
+        with load_lock:
+            # Loaded by another caller while this one waited for the lock
+            catalog = self._fresh_catalog(store_brand, max_age_seconds)
+            loaded_at = self._catalog_loaded_at.get(store_brand)
+            if catalog is None and loaded_at is not None and loaded_at >= requested_at:
+                catalog = self._catalogs.get(store_brand)
+            if catalog is not None:
+                return catalog
+            return self._load_store_catalog(store_brand)
+    
+    def _fresh_catalog(self, store_brand: str, max_age_seconds: Optional[float]) -> Optional[ProductCatalog]:
+        catalog = self._catalogs.get(store_brand)
+        loaded_at = self._catalog_loaded_at.get(store_brand)
+        if catalog is not None and loaded_at is not None and (
+                max_age_seconds is None or datetime.now() - loaded_at < timedelta(seconds=max_age_seconds)):
+            return catalog
+        return None
+    
+    def _load_store_catalog(self, store_brand: str) -> ProductCatalog:
+        # Caller holds the store's load lock
+        with self._catalog_lock:
+            self._catalog_load_changes[store_brand] = []
+            generation = self._catalog_generations.get(store_brand, 0)
+        
+        # Only the current state and the metadata summary are read, so the
+        # catalog size does not grow with the change history. Documents are
+        # encoded into the catalog one by one, never held as a full dict list.
+        docs = (self.collection
+                .where(f'current.retailers.{store_brand}', '>', {})
+                .select(['current', 'metadata'])
+                .stream())
+        
+        def store_products():
             for doc in docs:
                 data = doc.to_dict()
-                changes = data.get('changes', {})
-                for timestamp, change in changes.items():
-                    if change.get('action', "") == 'create':
-                        changes[timestamp] = {} # Clear out create changes
                 current = data.get('current')
                 if current and 'retailers' in current and store_brand in current['retailers']:
                     # Merge general product info with store-specific info
-                    product = current.copy()
-                    store_info = current['retailers'][store_brand]
-                    
-                    # Add store-specific fields to the product
-                    product.update(store_info)
-                    product['store_brand'] = store_brand
-                    product['product_id'] = doc.id
-                    product['changes'] = changes
-                    
-                    products.append(product)
+                    yield self.store_product_view(doc.id, current, store_brand, data.get('metadata'))
+        
+        try:
+            with external_call("firestore", "catalog_load"):
+                catalog = ProductCatalog(store_brand, store_products())
+        except BaseException:
+            with self._catalog_lock:
+                self._catalog_load_changes.pop(store_brand, None)
+            raise
+        with self._catalog_lock:
+            load_changes = self._catalog_load_changes.pop(store_brand)
+            if self._catalog_generations.get(store_brand, 0) != generation:
+                # Writes during the load: the streamed documents may predate them
+                catalog = catalog.with_changes(
+                    (product_id,
+                     self.store_product_view(product_id, current, store_brand, metadata)
+                     if store_brand in (current.get('retailers') or {}) else None)
+                    for product_id, current, metadata in load_changes
+                )
+            self._catalog_loaded_at[store_brand] = datetime.now()
+            self._catalogs[store_brand] = catalog
+        print(f"Loaded catalog for store '{store_brand}': {len(catalog)} products")
+        return catalog
+    
+    def cached_store_catalog(self, store_brand: str) -> Optional[ProductCatalog]:
+        """Cached catalog of a store, or None if it has not been loaded (never reads Firestore)."""
+        return self._catalogs.get(store_brand)
+    
+    def get_products_by_store(self, store_brand: str) -> ProductCatalog:
+        """
+        Gets all products available in a specific store brand.
+        
+        Args:
+            store_brand: Store brand identifier (e.g., 'dm', 'douglas')
             
-            # Update cache
-            self._set_cache(cache_key, products)
-            return products
+        Returns:
+            Sequence of read-only product mappings (the store's ProductCatalog);
+            copy() a product to get a modifiable dictionary
+        """
+        try:
+            return self.get_store_catalog(store_brand, max_age_seconds=self._cache_ttl)
             
         except Exception as e:
             print(f"Error getting products for store '{store_brand}': {e}")
@@ -360,7 +1109,7 @@ class FirestoreProductService:
             
             if store_brand:
                 # More efficient: only get products available in the specified store
-                docs = self.collection.where(f'current.retailers.{store_brand}', '>', {}).stream()
+                docs = self.collection.where(f'current.retailers.{store_brand}', '>', {}).select(['current']).stream()
                 
                 for doc in docs:
                     data = doc.to_dict()
@@ -373,7 +1122,7 @@ class FirestoreProductService:
                         products[doc.id] = product
             else:
                 # If no store filter, still be selective about what we load
-                docs = self.collection.where('current.color_lab', '>', []).stream()
+                docs = self.collection.where('current.color_lab', '>', []).select(['current']).stream()
                 
                 for doc in docs:
                     data = doc.to_dict()
@@ -394,6 +1143,10 @@ class FirestoreProductService:
         """
         Matches products by color similarity.
         
+        Streams the whole store from Firestore on every call; request handlers
+        should use FoundationMatchingService.match_products_by_color, which is
+        served from the cached match index.
+        
         Args:
             target_color: Target color in LAB format [L, a, b]
             store_brand: Store brand to filter by
@@ -430,46 +1183,157 @@ class FirestoreProductService:
             print(f"Error matching products by color: {e}")
             return []
     
-    def get_store_brands(self) -> List[str]:
+    def migrate_product_history(self, product_id: str) -> int:
         """
-        Gets all available store brands efficiently using caching.
+        Moves a legacy 'changes' map of a product into the history subcollection.
+        
+        Entry ids are derived from the legacy timestamps, so running the
+        migration twice does not duplicate entries.
         
+        Args:
+            product_id: Product identifier
+            
         Returns:
-            List of store brand names
+            int: Number of history entries moved (0 if there was nothing to migrate)
         """
-        cache_key = self._get_cache_key('get_store_brands')
-        cached_result = self._get_from_cache(cache_key)
-        if cached_result is not None:
-            print(f"Cache hit for store brands")
-            return cached_result
+        doc_ref = self.collection.document(product_id)
+        history_ref = self._history_collection(product_id)
         
-        try:
-            # Use a more efficient approach - cache the brands or use a separate collection
-            # For now, we'll use the known brands from our system
-            known_brands = ['dm', 'douglas']
+        @firestore.transactional
+        def migrate(transaction):
+            doc = doc_ref.get(transaction=transaction)
+            if not doc.exists:
+                return 0
+            data = doc.to_dict()
+            changes = data.get('changes')
+            if not changes:
+                return 0
             
-            # Verify at least one product exists for each brand
-            verified_brands = []
-            for brand in known_brands:
-                # Use limit(1) to check if any products exist for this brand
-                docs = self.collection.where(f'current.retailers.{brand}', '>', {}).limit(1).stream()
-                if any(docs):
-                    verified_brands.append(brand)
+            metadata, entries = self._legacy_history(changes, data.get('metadata', {}))
+            for entry_id, entry in entries:
+                transaction.set(history_ref.document(entry_id), entry)
+            transaction.update(doc_ref, {
+                'changes': firestore.DELETE_FIELD,
+                'metadata': metadata
+            })
+            return len(changes)
+        
+        try:
+            moved = migrate(self.db.transaction())
+            if moved:
+                print(f"Migrated {moved} history entries of product '{product_id}'")
+            return moved
+        except Exception as e:
+            print(f"Error migrating history of product '{product_id}': {e}")
+            return 0
+    
+    def migrate_all_history(self) -> Dict[str, int]:
+        """
+        Migrates the legacy 'changes' maps of all products into history subcollections.
+        
+        Returns:
+            dict with the number of migrated 'products' and moved 'entries'
+        """
+        migrated_products = 0
+        moved_entries = 0
+        for doc in self.collection.select(['changes']).stream():
+            if (doc.to_dict() or {}).get('changes'):
+                moved = self.migrate_product_history(doc.id)
+                if moved:
+                    migrated_products += 1
+                    moved_entries += moved
+        print(f"History migration finished: {migrated_products} products, {moved_entries} entries")
+        return {'products': migrated_products, 'entries': moved_entries}
+    
+    def get_product_history(self, product_id: str, page_size: int = 50,
+                            cursor: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Gets one page of a product's change history, newest first.
+        
+        A product that still carries a legacy 'changes' map is migrated when its
+        first page is requested.
+        
+        Args:
+            product_id: Product identifier
+            page_size: Maximum number of entries per page
+            cursor: Id of the last entry of the previous page (None for the first page)
             
-            result = sorted(verified_brands)
+        Returns:
+            dict with 'entries' (each with its 'id'), 'next_cursor' (None on the last
+            page) and the document's 'metadata', or None if the product does not exist
+        """
+        page_size = max(1, min(int(page_size), 500))
+        doc = self.collection.document(product_id).get(['metadata', 'changes'] if cursor is None else ['metadata'])
+        if not doc.exists:
+            return None
+        data = doc.to_dict() or {}
+        metadata = data.get('metadata', {})
+        if cursor is None and data.get('changes'):
+            self.migrate_product_history(product_id)
+            metadata = (self.collection.document(product_id).get(['metadata']).to_dict() or {}).get('metadata', {})
+        
+        history_ref = self._history_collection(product_id)
+        query = history_ref.order_by(firestore.FieldPath.document_id(), direction=firestore.Query.DESCENDING)
+        if cursor:
+            query = query.start_after({firestore.FieldPath.document_id(): history_ref.document(cursor)})
+        # One extra entry tells whether another page exists
+        docs = list(query.limit(page_size + 1).stream())
+        
+        entries = [{'id': entry.id, **entry.to_dict()} for entry in docs[:page_size]]
+        next_cursor = entries[-1]['id'] if len(docs) > page_size else None
+        return {
+            'product_id': product_id,
+            'metadata': metadata,
+            'entries': entries,
+            'next_cursor': next_cursor
+        }
+    
+    def get_color_histories(self, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Gets the color change history of several products concurrently.
+        
+        Args:
+            product_ids: Product identifiers
             
-            # Cache the result
-            self._set_cache(cache_key, result)
-            return result
+        Returns:
+            dict: product_id -> {timestamp: change_record} of color changes
+        """
+        def load(product_id: str) -> Dict[str, Any]:
+            try:
+                docs = self._history_collection(product_id).where('color_change', '==', True).stream()
+                history = {}
+                for doc in docs:
+                    entry = doc.to_dict()
+                    history[entry.get('timestamp', doc.id)] = entry
+                return history
+            except Exception as e:
+                print(f"Error getting color history of product '{product_id}': {e}")
+                return {}
+        
+        unique_ids = [product_id for product_id in dict.fromkeys(product_ids) if product_id]
+        with external_call("firestore", "color_histories"):
+            return dict(zip(unique_ids, self._history_executor.map(load, unique_ids)))
+    
+    def get_store_brands(self) -> List[str]:
+        """
+        Gets all store brands that list at least one product, from the catalog facets.
+        
+        Returns:
+            List of store brand names
+        """
+        try:
+            facets = self.get_catalog_facets()
+            return sorted(store_brand for store_brand, store_facets in facets.get('stores', {}).items()
+                          if store_facets.get('product_count', 0) > 0)
             
         except Exception as e:
             print(f"Error getting store brands: {e}")
-            # Fallback to known brands if query fails
+            # Fallback to known brands if the facets are unavailable
             return ['dm', 'douglas']
     
     def get_product_types(self, store_brand: str = None) -> List[str]:
         """
-        Gets all available product types efficiently with caching, optionally filtered by store brand.
+        Gets all available product types from the catalog facets, optionally filtered by store brand.
         
         Args:
             store_brand: Optional store brand filter
@@ -477,44 +1341,13 @@ class FirestoreProductService:
         Returns:
             List of product type names
         """
-        cache_key = self._get_cache_key('get_product_types', store_brand)
-        cached_result = self._get_from_cache(cache_key)
-        if cached_result is not None:
-            print(f"Cache hit for product types (store: {store_brand})")
-            return cached_result
-        
         try:
-            # Use distinct query approach - get unique types more efficiently
-            types = set()
-            
+            facets = self.get_catalog_facets()
             if store_brand:
-                # Query only products available in the specified store
-                docs = self.collection.where(f'current.retailers.{store_brand}', '>', {}).stream()
-                
-                for doc in docs:
-                    data = doc.to_dict()
-                    current = data.get('current', {})
-                    if 'type' in current:
-                        types.add(current['type'])
-                        # Early exit if we have all expected types
-                        if len(types) >= 10:  # Reasonable limit
-                            break
+                type_counts = facets.get('stores', {}).get(store_brand, {}).get('types', {})
             else:
-                # For all products, use a more efficient approach
-                # Get a sample of products to determine types
-                docs = self.collection.limit(100).stream()
-                
-                for doc in docs:
-                    data = doc.to_dict()
-                    current = data.get('current', {})
-                    if 'type' in current:
-                        types.add(current['type'])
-            
-            result = sorted(list(types))
-            
-            # Cache the result
-            self._set_cache(cache_key, result)
-            return result
+                type_counts = facets.get('types', {})
+            return sorted(product_type for product_type, count in type_counts.items() if count > 0)
             
         except Exception as e:
             print(f"Error getting product types: {e}")
@@ -526,63 +1359,190 @@ class FirestoreProductService:
             else:
                 return ['foundation', 'concealer', 'powder', 'highlighter', 'BB-cream and CC-cream']
     
-    def batch_create_products(self, products: List[Dict[str, Any]], 
-                            batch_size: int = 500) -> Tuple[int, int]:
+    def import_products(self, products: List[Dict[str, Any]], created_by: str = 'batch_import',
+                        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         """
-        Creates multiple products in batches.
+        Creates (or overwrites) many products through a parallel BulkWriter.
+        
+        Each product is written as its document, then (once written) its
+        history entry. Failed writes are retried per document with exponential
+        backoff, so a single bad document no longer fails the rest of its
+        batch. Existing products are read first: new products are written with
+        create(), existing ones are overwritten as a new version like in
+        create_product (see _create_documents), only if unchanged since the
+        read (otherwise 'conflict'), so the facets move from the old to the new
+        values. Facets and change listeners are updated once for all written
+        products at the end.
         
         Args:
             products: List of product dictionaries with 'id' and 'data' keys
-            batch_size: Number of products per batch
+            created_by: User/system recorded in the history entries
+            progress_callback: Optional callable receiving progress snapshots
+                ({'total', 'written', 'failed', 'elapsed_seconds',
+                'products_per_second'}); called from the writer threads
             
         Returns:
-            Tuple of (successful_count, failed_count)
+            Dictionary with 'total', 'successful', 'failed', 'duration_seconds',
+            'products_per_second' and 'results', the per-product results in input
+            order, each with 'product_id', 'status' ('created', 'conflict',
+            'error' or 'invalid') and 'error'
         """
-        successful_count = 0
-        failed_count = 0
+        started = time.monotonic()
+        timestamp = datetime.utcnow().isoformat() + 'Z'
+        results = []
+        staged = {}
+        for product in products:
+            product_id = product.get('id') if isinstance(product, dict) else None
+            product_data = product.get('data') if isinstance(product, dict) else None
+            result = {'product_id': product_id, 'status': 'invalid', 'error': None}
+            results.append(result)
+            if not product_id or not isinstance(product_data, dict):
+                result['error'] = 'id and data are required'
+            elif product_id in staged:
+                result['error'] = 'duplicate id in request'
+            else:
+                staged[product_id] = (result, product_data)
         
-        for i in range(0, len(products), batch_size):
-            batch = products[i:i + batch_size]
-            batch_obj = self.db.batch()
-            
+        lock = threading.Lock()
+        progress = {'total': len(staged), 'written': 0, 'failed': 0}
+        last_report = [0.0]
+        
+        def report(force: bool = False) -> None:
+            if progress_callback is None:
+                return
+            now = time.monotonic()
+            with lock:
+                if not force and now - last_report[0] < IMPORT_PROGRESS_INTERVAL:
+                    return
+                last_report[0] = now
+                elapsed = now - started
+                snapshot = {
+                    **progress,
+                    'elapsed_seconds': round(elapsed, 2),
+                    'products_per_second': round(progress['written'] / elapsed, 1) if elapsed > 0 else 0.0,
+                }
             try:
-                timestamp = datetime.utcnow().isoformat() + 'Z'
-                
-                for product in batch:
-                    product_id = product['id']
-                    product_data = product['data']
-                    
-                    doc_data = {
-                        'current': {
-                            **product_data,
-                            'last_updated': timestamp
-                        },
-                        'changes': {
-                            timestamp: {
-                                'action': 'create',
-                                'data': product_data,
-                                'by': 'batch_import'
-                            }
-                        },
-                        'metadata': {
-                            'created_at': timestamp,
-                            'version_count': 1,
-                            'last_modified': timestamp
-                        }
-                    }
-                    
-                    doc_ref = self.collection.document(product_id)
-                    batch_obj.set(doc_ref, doc_data)
-                
-                batch_obj.commit()
-                successful_count += len(batch)
-                print(f"Successfully created batch {i//batch_size + 1}: {len(batch)} products")
-                
+                progress_callback(snapshot)
+            except Exception as e:
+                print(f"Error in import progress callback: {e}")
+        
+        def is_history(reference) -> bool:
+            return reference.parent.id == HISTORY_SUBCOLLECTION
+        
+        def on_result(reference, write_result, bulk_writer):
+            if is_history(reference):
+                return
+            with lock:
+                staged[reference.id][0]['status'] = 'created'
+                progress['written'] += 1
+            report()
+        
+        def on_error(failure, bulk_writer) -> bool:
+            reference = failure.operation.reference
+            # ALREADY_EXISTS / FAILED_PRECONDITION: created or changed by someone else after the read
+            if not is_history(reference) and failure.code in (6, 9):
+                with lock:
+                    staged[reference.id][0]['status'] = 'conflict'
+                    staged[reference.id][0]['error'] = 'product was created or modified concurrently'
+                    progress['failed'] += 1
+                report()
+                return False
+            if failure.attempts < BULK_WRITE_MAX_ATTEMPTS:
+                return True
+            if is_history(reference):
+                # The product itself was written; only its first history entry is missing
+                product_id = reference.parent.parent.id
+                with lock:
+                    staged[product_id][0]['error'] = f"history entry not written: {failure.message}"
+                return False
+            with lock:
+                staged[reference.id][0]['status'] = 'error'
+                staged[reference.id][0]['error'] = failure.message
+                progress['failed'] += 1
+            report()
+            return False
+        
+        existing = {}
+        writes = {}
+        if staged:
+            refs = [self.collection.document(product_id) for product_id in staged]
+            try:
+                existing = {snapshot.id: snapshot for snapshot in
+                            self.db.get_all(refs, field_paths=['current', 'metadata', 'changes'])
+                            if snapshot.exists}
             except Exception as e:
-                failed_count += len(batch)
-                print(f"Error creating batch {i//batch_size + 1}: {e}")
+                print(f"Error reading existing products for import: {e}")
+                for result, _ in staged.values():
+                    result['status'] = 'error'
+                    result['error'] = str(e)
+                staged = {}
+        
+        if staged:
+            bulk_writer = self.db.bulk_writer(options=BulkWriterOptions(retry=BulkRetry.exponential))
+            bulk_writer.on_write_result(on_result)
+            bulk_writer.on_write_error(on_error)
+            for product_id, (_, product_data) in staged.items():
+                snapshot = existing.get(product_id)
+                writes[product_id] = self._create_documents(
+                    product_data, timestamp, created_by, snapshot.to_dict() if snapshot is not None else None)
+                fields = writes[product_id][0]
+                if snapshot is None:
+                    bulk_writer.create(self.collection.document(product_id), fields)
+                else:
+                    # New version of the document, only if it did not change since the read
+                    bulk_writer.update(snapshot.reference, fields,
+                                       option=self.db.write_option(last_update_time=snapshot.update_time))
+            bulk_writer.close()
+            
+            # History entries only for the products actually written
+            history_writer = self.db.bulk_writer(options=BulkWriterOptions(retry=BulkRetry.exponential))
+            history_writer.on_write_error(on_error)
+            batch_delta = {'stores': {}, 'types': {}, 'product_count': 0, 'prices': {}}
+            changes = []
+            for product_id, (result, _) in staged.items():
+                if result['status'] != 'created':
+                    continue
+                fields, change_record, legacy_entries = writes[product_id]
+                history_ref = self._history_collection(product_id)
+                for entry_id, entry in legacy_entries:
+                    history_writer.set(history_ref.document(entry_id), entry)
+                history_writer.set(history_ref.document(self._history_entry_id(timestamp)),
+                                   self._history_entry(timestamp, change_record))
+                old_current = existing[product_id].to_dict().get('current') if product_id in existing else None
+                self._merge_facets_delta(batch_delta, self._facets_delta(old_current, fields['current']))
+                changes.append((product_id, fields['current'], fields['metadata']))
+            history_writer.close()
+            if changes:
+                self._apply_facets_delta(batch_delta)
+                self._notify_product_changes(changes)
+        report(force=True)
         
-        return successful_count, failed_count
+        duration = time.monotonic() - started
+        successful = sum(1 for result in results if result['status'] == 'created')
+        summary = {
+            'total': len(products),
+            'successful': successful,
+            'failed': len(products) - successful,
+            'duration_seconds': round(duration, 2),
+            'products_per_second': round(successful / duration, 1) if duration > 0 else 0.0,
+            'results': results,
+        }
+        print(f"Imported {successful}/{len(products)} products in {summary['duration_seconds']}s "
+              f"({summary['products_per_second']} products/s)")
+        return summary
+    
+    def batch_create_products(self, products: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Creates multiple products; see import_products for per-product results.
+        
+        Args:
+            products: List of product dictionaries with 'id' and 'data' keys
+            
+        Returns:
+            Tuple of (successful_count, failed_count)
+        """
+        summary = self.import_products(products)
+        return summary['successful'], summary['failed']
     
     def get_cache_stats(self) -> Dict[str, Any]:
         """
@@ -595,9 +1555,16 @@ class FirestoreProductService:
             'cache_entries': len(self._cache),
             'cache_keys': list(self._cache.keys()),
             'cache_timestamps': {k: v.isoformat() for k, v in self._cache_timestamps.items()},
-            'cache_ttl_seconds': self._cache_ttl
+            'cache_ttl_seconds': self._cache_ttl,
+            'catalogs': {store_brand: {'products': len(catalog),
+                                       'loaded_at': self._catalog_loaded_at[store_brand].isoformat()}
+                         for store_brand, catalog in self._catalogs.items()}
         }
     
+    def catalog_memory_report(self) -> Dict[str, Any]:
+        """Memory footprint of the cached store catalogs (walks every product; admin use only)."""
+        return {store_brand: catalog.memory_footprint() for store_brand, catalog in self._catalogs.items()}
+    
     def set_cache_ttl(self, ttl_seconds: int) -> None:
         """
         Set cache TTL (time to live).
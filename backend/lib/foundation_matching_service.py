@@ -7,12 +7,19 @@ as the data source with fallback to local files during transition.
 
 import json
 import math
+from functools import partial
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+import numpy as np
 
 from .bundle_matching_service import bundle_service
 from .firestore_product_service import FirestoreProductService
 from .color_tools import distance_between_colors
+from .executors import run_cpu, run_io
+from .metrics import external_call, stage, timed_stage
+from .product_catalog import INDEXED_FIELDS, ProductCatalog, default_is_rescanned
+from .product_match_index import ProductMatchIndex
 
 # Import availability functions
 try:
@@ -23,6 +30,7 @@ try:
 except ImportError:
     print("Warning: ERP availability modules not found. Stock info will be unavailable.")
     availability_instore_dm = None
+    fetch_products_data_dm = None
     availability_instore_douglas = None
 
 
@@ -35,9 +43,13 @@ class FoundationMatchingService:
     - Color-based product matching
     - Store availability integration
     - Product type filtering
-    - Caching for performance
+    - Caching for performance, with a shared in-memory color match index
     """
     
+    STORE_BRANDS = ['dm', 'douglas']
+    # Center of the color correction when no rescanned product has a color
+    DEFAULT_CENTER = (50, 0, 0)
+
     def __init__(self, 
                  firestore_service: FirestoreProductService = None,
                  use_firestore: bool = True,
@@ -54,38 +66,64 @@ class FoundationMatchingService:
         self.use_firestore = use_firestore
         self.cache_products = cache_products
         
-        # Cache for products
-        self._product_cache: Dict[str, Dict[str, Any]] = {}
+        # Catalogs loaded from local files; Firestore catalogs are held by the
+        # Firestore service and only referenced here
+        self._product_cache: Dict[str, ProductCatalog] = {}
         self._cache_timestamp: Optional[str] = None
         
         # Store brands available
-        self.brand_list = ['dm', 'douglas']
+        self.brand_list = list(self.STORE_BRANDS)
         
         # Initialize data structure for backward compatibility
         self.data = {}
         
+        # Color index over the cached catalogs, used by every matching entry point
+        self.match_index = ProductMatchIndex()
+        self.center_L, self.center_a, self.center_b = self.DEFAULT_CENTER
+        
+        # Keep cached catalogs in sync with product writes made through the service
+        if self.firestore_service:
+            self.firestore_service.add_change_listener(self._on_product_changes)
+        
         print(f"Foundation matching service initialized with Firestore: {use_firestore}")
     
-    def _get_products_from_firestore(self, store_brand: str) -> List[Dict[str, Any]]:
+    def _get_products_from_firestore(self, store_brand: str, refresh: bool = False) -> ProductCatalog:
         """
         Get products from Firestore for a specific store brand.
         
         Args:
             store_brand: Store brand identifier
+            refresh: Reload the catalog instead of using the cached one
             
         Returns:
-            List of product dictionaries
+            The store's ProductCatalog (empty list on error)
         """
         if not self.firestore_service:
             return []
         
         try:
-            products = self.firestore_service.get_products_by_store(store_brand)
-            return products
+            return self.firestore_service.get_store_catalog(store_brand, max_age_seconds=0 if refresh else None)
         except Exception as e:
             print(f"Error getting products from Firestore for {store_brand}: {e}")
             return []
     
+    def _on_product_changes(self, changes: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]) -> None:
+        """
+        Rebuilds the match index of the stores whose catalog a product write replaced.
+        
+        The Firestore service applies the writes to its cached catalogs before
+        notifying, so only the index has to follow.
+        
+        Args:
+            changes: List of (product_id, new_current, metadata) tuples
+        """
+        for store_brand in self.brand_list:
+            if f"{store_brand}_products" in self._product_cache:
+                continue  # Served from local files
+            catalog = self.firestore_service.cached_store_catalog(store_brand)
+            if catalog is not None and self.match_index.get(store_brand) is not None:
+                self.match_index.ensure(store_brand, catalog)
+    
     def _get_products_from_local(self, store_brand: str) -> List[Dict[str, Any]]:
         """
         Get products from local JSON files (fallback method).
@@ -210,19 +248,106 @@ class FoundationMatchingService:
         Returns:
             Product dictionary or None if not found
         """
-        products = self.get_products(store_brand, use_cache=True)
-        for product in products:
-            if str(product.get('gtin', "")) == str(gtin) or product.get('code', "") == gtin:
-                try:
-                    refereshed_list = self._add_data_source_info([product], store_brand)
-                    refereshed_list = self._add_availability_info(refereshed_list, store_brand)
-                    return refereshed_list[0] if refereshed_list else product
-                except Exception as e:
-                    print(f"Error refreshing product data: {e}")
-                    return product
-        return None
+        return self.get_products_by_gtins(store_brand, [gtin]).get(str(gtin))
+
+    def get_products_by_gtins(self, store_brand: str, gtins: List[str],
+                              enrich: bool = True) -> Dict[str, Dict[str, Any]]:
+        """
+        Get several products by GTIN (or store code), see get_products_by_ids.
+        """
+        return self.get_products_by_ids(store_brand, gtins, fields=('gtin', 'code'), enrich=enrich)
+
+    def get_products_by_ids(self, store_brand: str, ids: List[str],
+                            fields: Sequence[str] = INDEXED_FIELDS,
+                            enrich: bool = True) -> Dict[str, Dict[str, Any]]:
+        """
+        Get several products by identifier through the catalog's hash indexes.
+        
+        Args:
+            store_brand: Store brand identifier
+            ids: Product identifiers
+            fields: Identifier fields to match, tried in order ('gtin', 'dan', 'code', 'product_id')
+            enrich: Refresh the found products with one product data call and
+                one availability call for all of them
+        Returns:
+            Dictionary of requested id -> product copy; ids not found are left out
+        """
+        found = {key: product.copy() for key, product in
+                 self.get_products(store_brand, use_cache=True).lookup_many(ids, fields).items()}
+        
+        if enrich and found:
+            products = list(found.values())
+            try:
+                self._add_data_source_info(products, store_brand)
+                self._add_availability_info(products, store_brand)
+            except Exception as e:
+                print(f"Error refreshing product data: {e}")
+        return found
     
-    def get_products(self, store_brand: str, use_cache: bool = True) -> List[Dict[str, Any]]:
+    def recommendation_refs(self, store_brand: str, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Compact references to formatted match results, for storing with a session.
+        
+        Args:
+            store_brand: Store brand the products were matched in
+            products: Results of match_foundation, best match first
+            
+        Returns:
+            List of {product_id, dan, color_distance, rank, catalog_version}
+        """
+        catalog = self.get_products(store_brand)
+        refs = []
+        for rank, product in enumerate(products, start=1):
+            catalog_product = catalog.find(product.get('product_id', ''))
+            refs.append({
+                'product_id': product.get('product_id', ''),
+                'dan': str(catalog_product.get('dan') or '') if catalog_product is not None else '',
+                'color_distance': product.get('color_distance'),
+                'rank': rank,
+                'catalog_version': catalog.version,
+            })
+        return refs
+
+    def rehydrate_recommendations(self, store_brand: str, refs: List[Dict[str, Any]],
+                                  store_location: str = None) -> List[Dict[str, Any]]:
+        """
+        Formatted match results for stored recommendation references (see recommendation_refs).
+        
+        Products are resolved through the catalog's hash indexes (by product_id,
+        then by DAN for products re-created since) and refreshed with one product
+        data call and one availability call. References to products no longer
+        in the catalog are left out.
+        
+        Args:
+            store_brand: Store brand of the session
+            refs: Stored recommendation references
+            store_location: Store location for availability check
+            
+        Returns:
+            List of formatted product dictionaries in rank order
+        """
+        catalog = self.get_products(store_brand)
+        refs = sorted(refs, key=lambda ref: ref.get('rank', 0))
+        by_id = catalog.lookup_many([ref.get('product_id') for ref in refs], fields=('product_id',))
+        by_dan = catalog.lookup_many([ref.get('dan') for ref in refs if str(ref.get('product_id')) not in by_id],
+                                     fields=('dan',))
+        products = []
+        for ref in refs:
+            product = by_id.get(str(ref.get('product_id'))) or by_dan.get(str(ref.get('dan')))
+            if product is None:
+                continue
+            product = product.copy()
+            product['color_distance'] = ref.get('color_distance')
+            products.append(product)
+        
+        try:
+            products = self._add_availability_info(products, store_brand, store_location)
+            products = self._add_data_source_info(products, store_brand)
+        except Exception as e:
+            print(f"Error refreshing product data: {e}")
+        return self._format_results(products, target_color=None)
+
+    def get_products(self, store_brand: str, use_cache: bool = True) -> ProductCatalog:
         """
         Get products for a store brand with caching.
         
@@ -231,28 +356,28 @@ class FoundationMatchingService:
             use_cache: Whether to use cached data
             
         Returns:
-            List of product dictionaries
+            The store's ProductCatalog, a sequence of read-only product mappings
         """
         cache_key = f"{store_brand}_products"
         
-        # Check cache first
+        # Check cache first (catalogs that fell back to local files)
         if use_cache and cache_key in self._product_cache:
             return self._product_cache[cache_key]
         
         # Get products from Firestore or local files
+        products = []
         if self.use_firestore:
-            products = self._get_products_from_firestore(store_brand)
+            products = self._get_products_from_firestore(store_brand, refresh=not use_cache)
             
             # Fallback to local if Firestore fails
             if not products:
                 print(f"Firestore returned no products for {store_brand}, falling back to local files")
-                products = self._get_products_from_local(store_brand)
-        else:
-            products = self._get_products_from_local(store_brand)
-        
-        # Cache the results
-        if self.cache_products:
-            self._product_cache[cache_key] = products
+        if not products:
+            products = ProductCatalog(store_brand, self._get_products_from_local(store_brand))
+            # Cache the results
+            if self.cache_products:
+                self._product_cache[cache_key] = products
+        self.match_index.ensure(store_brand, products)
         
         return products
     
@@ -278,35 +403,61 @@ class FoundationMatchingService:
         
         return sorted(list(types))
     
-    def update_center_color(self, products):
+    @staticmethod
+    def _is_rescanned(product: Dict[str, Any]) -> bool:
+        """Whether a product's color was rescanned (legacy products: updated after creation)."""
+        return default_is_rescanned(product)
+    
+    def _products_center_color(self, products) -> Tuple[float, float, float]:
+        """Mean Lab color of the rescanned products (DEFAULT_CENTER without any)."""
         sum_L = 0
         sum_a = 0
         sum_b = 0
         count = 0
         for product in products:
             if 'color_lab' in product and product['color_lab']:
-                if 'changes' in product and product['changes']:
-                    if len(product['changes'].keys()) > 1:
-                        try:
-                            sum_L += product['color_lab'][0]
-                            sum_a += product['color_lab'][1]
-                            sum_b += product['color_lab'][2]
-                            count += 1
-                        except Exception as e:
-                            print(f"Error calculating center color for product: {e}")
+                if self._is_rescanned(product):
+                    try:
+                        sum_L += product['color_lab'][0]
+                        sum_a += product['color_lab'][1]
+                        sum_b += product['color_lab'][2]
+                        count += 1
+                    except Exception as e:
+                        print(f"Error calculating center color for product: {e}")
         if count > 0:
-            self.center_L = sum_L / count
-            self.center_a = sum_a / count
-            self.center_b = sum_b / count
-        else:
-            self.center_L = 50
-            self.center_a = 0
-            self.center_b = 0
+            return sum_L / count, sum_a / count, sum_b / count
+        return self.DEFAULT_CENTER
+
+    def _center_color(self, store_brand: str, product_type: str = None) -> Tuple[float, float, float]:
+        """Vectorized _products_center_color() over the indexed catalog of a store."""
+        snapshot = self.match_index.get(store_brand)
+        if snapshot is None:
+            return self.DEFAULT_CENTER
+        mask = snapshot.mask(product_type, rescanned_only=True)
+        if mask.any():
+            return tuple(float(v) for v in snapshot.lab[mask].mean(axis=0))
+        return self.DEFAULT_CENTER
+
+    def update_center_color(self, products):
+        # Legacy sync path; concurrent matching passes the center to color_correction_array instead
+        self.center_L, self.center_a, self.center_b = self._products_center_color(products)
 
     def color_correction(self, color_lab: List[float]) -> List[float]:
-        L = color_lab[0]
-        a = color_lab[1]
-        b = color_lab[2]
+        # Legacy sync path, corrects around the center set by update_center_color
+        corrected = self.color_correction_array(np.array([color_lab[:3]], dtype=float))
+        return [float(v) for v in corrected[0]]
+
+    def color_correction_array(self, lab: np.ndarray,
+                               center: Optional[Tuple[float, float, float]] = None) -> np.ndarray:
+        """
+        Applies the color correction to an (n, 3) array of Lab colors, around
+        center (default: the one set by update_center_color).
+        """
+        center_L, center_a, center_b = center if center is not None else (self.center_L, self.center_a,
+                                                                          self.center_b)
+        L = lab[:, 0]
+        a = lab[:, 1]
+        b = lab[:, 2]
 
         scale_x = 0.8
         scale_y = 0.6
@@ -319,18 +470,18 @@ class FoundationMatchingService:
         rotation_z = -25
 
         # 1. Scale relative to center
-        L = self.center_L + (L - self.center_L) * scale_x
-        a = self.center_a + (a - self.center_a) * scale_y
-        b = self.center_b + (b - self.center_b) * scale_z
+        L = center_L + (L - center_L) * scale_x
+        a = center_a + (a - center_a) * scale_y
+        b = center_b + (b - center_b) * scale_z
 
         # 2. Apply rotation (simplified - around center)
         rot_x = (rotation_x * math.pi) / 180
         rot_y = (rotation_y * math.pi) / 180
         rot_z = (rotation_z * math.pi) / 180
         # Translate to origin for rotation
-        x = L - self.center_L
-        y = a - self.center_a
-        z = b - self.center_b   
+        x = L - center_L
+        y = a - center_a
+        z = b - center_b   
         # Apply rotations (simplified 3D rotation)
         if rot_x != 0:
             newY = y * math.cos(rot_x) - z * math.sin(rot_x)
@@ -348,11 +499,11 @@ class FoundationMatchingService:
             x = newX
             y = newY
         # Translate back and add translation offset
-        L = x + self.center_L + offset_x
-        a = y + self.center_a + offset_y
-        b = z + self.center_b + offset_z
+        L = x + center_L + offset_x
+        a = y + center_a + offset_y
+        b = z + center_b + offset_z
 
-        return [L, a, b]
+        return np.column_stack((L, a, b))
 
     def compute_average_color(self, color_points_: List[List[float]]) -> List[float]:
         color_points = color_points_.copy()
@@ -396,45 +547,107 @@ class FoundationMatchingService:
         Returns:
             List of matched products with similarity scores
         """
+        sorted_products = self._match_candidates(target_color, store_brand, length, product_type, only_rescanned)
+        return self._finish_matches(sorted_products, target_color, store_brand, store_location,
+                                    include_availability, include_scanning_history)
+
+    async def match_foundation_async(self,
+                                     target_color: List[float],
+                                     store_brand: str,
+                                     store_location: str = None,
+                                     length: int = 5,
+                                     product_type: str = None,
+                                     include_availability: bool = True,
+                                     include_scanning_history: bool = False,
+                                     only_rescanned: bool = True) -> List[Dict[str, Any]]:
+        """
+        match_foundation for async handlers: the color scoring runs on the CPU
+        executor, the availability, product data and history calls on the I/O executor.
+        """
+        sorted_products = await run_cpu(self._match_candidates, target_color, store_brand, length,
+                                        product_type, only_rescanned)
+        return await run_io(self._finish_matches, sorted_products, target_color, store_brand, store_location,
+                            include_availability, include_scanning_history)
+
+    @timed_stage("index_lookup")
+    def _match_candidates(self, target_color: List[float], store_brand: str, length: int,
+                          product_type: Optional[str], only_rescanned: bool) -> List[Dict[str, Any]]:
+        # Best matches with their corrected color and distance (CPU only, no ERP calls)
         if store_brand not in self.brand_list:
             raise ValueError(f"Invalid store brand: {store_brand}. Choose from {self.brand_list}.")
         
-        # Get products
-        products = self.get_products(store_brand)
-        
-        # Filter by product type if specified
-        if product_type:
-            products = [p for p in products if p.get('type') == product_type]
-        
-        # Filter products with color information
-        products_with_color = []
-        self.update_center_color(products)
-        for product in products:
-            if 'color_lab' in product and product['color_lab']:
-                if 'changes' in product and product['changes']:
-                    if not only_rescanned or (only_rescanned and len(product['changes'].keys()) > 1):
-                        try:
-                            product_copy = product.copy()  # Avoid modifying original
-                            corrected_color = self.color_correction(product['color_lab'])
-                            product_copy['corrected_color_lab'] = corrected_color
-                            distance = distance_between_colors(target_color, corrected_color)
-                            product_copy['color_distance'] = distance
-                            products_with_color.append(product_copy)
-                        except Exception as e:
-                            print(f"Error calculating color distance for product: {e}")
-        
-        # Sort by color distance and limit results
-        sorted_products = sorted(products_with_color, key=lambda x: x['color_distance'])[:length]
-        
+        # Make sure the catalog (and its match index) is loaded
+        self.get_products(store_brand)
+        
+        # Score all products with color information in one vectorized pass; the center is
+        # local to the request, as this runs concurrently on the CPU executor
+        center = self._center_color(store_brand, product_type)
+        matches = self.match_index.query(
+            store_brand,
+            target_color,
+            limit=length,
+            product_type=product_type,
+            rescanned_only=only_rescanned,
+            transform=partial(self.color_correction_array, center=center)
+        )
+        
+        sorted_products = []
+        for product, distance, corrected_color in matches:
+            product_copy = product.copy()  # Avoid modifying original
+            product_copy['corrected_color_lab'] = [float(v) for v in corrected_color]
+            product_copy['color_distance'] = distance
+            sorted_products.append(product_copy)
+        return sorted_products
+
+    def _finish_matches(self, sorted_products: List[Dict[str, Any]], target_color: List[float], store_brand: str,
+                        store_location: Optional[str], include_availability: bool,
+                        include_scanning_history: bool) -> List[Dict[str, Any]]:
+        # Availability, product data and history of the matches (blocking ERP/Firestore calls), formatted
         # Add availability information
         if include_availability:
             sorted_products = self._add_availability_info(sorted_products, store_brand, store_location)
         sorted_products = self._add_data_source_info(sorted_products, store_brand)
+        # The change history is stored outside the catalog; fetch it for the results only
+        if include_scanning_history and self.firestore_service:
+            with stage("scanning_history"):
+                histories = self.firestore_service.get_color_histories(
+                    [product.get('product_id') for product in sorted_products])
+                for product in sorted_products:
+                    if product.get('product_id') in histories:
+                        product['changes'] = histories[product['product_id']]
         # Format results for frontend
         formatted_results = self._format_results(sorted_products, target_color, include_scanning_history)
         
         return formatted_results
 
+    def match_products_by_color(self, target_color: List[float], store_brand: str,
+                                product_type: str = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Matches products by raw color similarity (no color correction, all products).
+        
+        Served from the same cached match index as match_foundation, so a request
+        costs no Firestore reads once the store catalog is loaded.
+        
+        Args:
+            target_color: Target color in LAB format [L, a, b]
+            store_brand: Store brand to filter by
+            product_type: Optional product type filter
+            limit: Maximum number of results
+            
+        Returns:
+            List of matched products sorted by color distance
+        """
+        self.get_products(store_brand)
+        matches = self.match_index.query(store_brand, target_color, limit=limit, product_type=product_type)
+        
+        results = []
+        for product, distance, _ in matches:
+            product_copy = product.copy()
+            product_copy['color_distance'] = distance
+            results.append(product_copy)
+        return results
+
+    @timed_stage("product_metadata")
     def _add_data_source_info(self, products: List[Dict[str, Any]], store_brand: str) -> List[Dict[str, Any]]:
         """
         Add data source information to products.
@@ -444,7 +657,8 @@ class FoundationMatchingService:
             for product in products:
                 if 'dan' in product and product['dan']:
                     dans_list.append(str(product['dan']))
-            fetched_data = fetch_products_data_dm(dans_list, fetch_brand=True, fetch_image=True, fetch_description=True, fetch_prices=True) if fetch_products_data_dm else {}
+            with external_call("erp", "product_data_dm"):
+                fetched_data = fetch_products_data_dm(dans_list, fetch_brand=True, fetch_image=True, fetch_description=True, fetch_prices=True) if fetch_products_data_dm else {}
             for product in products:
                 dan_str = str(product.get('dan', ''))
                 if dan_str in fetched_data:
@@ -452,6 +666,7 @@ class FoundationMatchingService:
         
         return products
 
+    @timed_stage("availability")
     def _add_availability_info(self, products: List[Dict[str, Any]], 
                              store_brand: str, store_location: str = None) -> List[Dict[str, Any]]:
         """
@@ -471,10 +686,11 @@ class FoundationMatchingService:
                            if 'dan' in product and product['dan']]
                 
                 if dan_list:
-                    if store_location:
-                        availability = availability_instore_dm(dan_list, store=store_location)
-                    else:
-                        availability = availability_instore_dm(dan_list)
+                    with external_call("erp", "availability_dm"):
+                        if store_location:
+                            availability = availability_instore_dm(dan_list, store=store_location)
+                        else:
+                            availability = availability_instore_dm(dan_list)
                     
                     for product in products:
                         dan_str = str(product.get('dan', ''))
@@ -505,10 +721,11 @@ class FoundationMatchingService:
                       if 'code' in product and product['code']]
                 
                 if ids:
-                    if store_location:
-                        availability = availability_instore_douglas(ids, store=store_location)
-                    else:
-                        availability = availability_instore_douglas(ids)
+                    with external_call("erp", "availability_douglas"):
+                        if store_location:
+                            availability = availability_instore_douglas(ids, store=store_location)
+                        else:
+                            availability = availability_instore_douglas(ids)
                     
                     for product in products:
                         code = product.get('code', '')
@@ -532,6 +749,7 @@ class FoundationMatchingService:
         
         return products
     
+    @timed_stage("formatting")
     def _format_results(self, products: List[Dict[str, Any]], 
                        target_color: List[float], include_scanning_history: bool = False) -> List[Dict[str, Any]]:
         """
@@ -606,6 +824,9 @@ class FoundationMatchingService:
     def clear_cache(self):
         """Clear the product cache."""
         self._product_cache.clear()
+        if self.firestore_service:
+            self.firestore_service.clear_catalogs()
+        self.match_index.clear()
         self._cache_timestamp = None
         print("Product cache cleared")
     
@@ -614,9 +835,23 @@ class FoundationMatchingService:
         return {
             'cache_size': len(self._product_cache),
             'cached_stores': list(self._product_cache.keys()),
+            'firestore_catalogs': {store_brand: len(self.firestore_service.cached_store_catalog(store_brand))
+                                   for store_brand in self.brand_list
+                                   if self.firestore_service and self.firestore_service.cached_store_catalog(store_brand)},
+            'indexed_products': {store_brand: len(self.match_index.get(store_brand) or [])
+                                 for store_brand in self.brand_list if self.match_index.get(store_brand)},
             'cache_timestamp': self._cache_timestamp
         }
     
+    def get_memory_report(self) -> Dict[str, Any]:
+        """Memory footprint of every loaded store catalog (walks all products; admin use only)."""
+        report = {}
+        if self.firestore_service:
+            report.update(self.firestore_service.catalog_memory_report())
+        for catalog in self._product_cache.values():
+            report[catalog.store_brand] = catalog.memory_footprint()
+        return report
+    
     def classify_skin_tone(self, cie_lab: List[float]) -> str:
         """
         Classify skin tone based on CIE LAB color.
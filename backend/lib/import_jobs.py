@@ -0,0 +1,129 @@
+"""
+Background jobs for long-running product imports.
+
+Large catalog imports run on a dedicated worker thread instead of the request
+worker; the request returns a job id and clients poll the job status, which
+carries the live progress reported by FirestoreProductService.import_products.
+"""
+
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ImportJob:
+    """State of one background import."""
+
+    def __init__(self, total: int, created_by: str):
+        self.job_id = str(uuid.uuid4())
+        self.status = 'queued'
+        self.total = total
+        self.created_by = created_by
+        self.created_at = datetime.utcnow().isoformat() + 'Z'
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.progress: Dict[str, Any] = {'total': total, 'written': 0, 'failed': 0}
+        self.summary: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('completed', 'failed')
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            'job_id': self.job_id,
+            'status': self.status,
+            'total': self.total,
+            'created_by': self.created_by,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'progress': dict(self.progress),
+            'error': self.error,
+        }
+        if self.summary is not None:
+            data.update(summarize_import(self.summary))
+        return data
+
+
+def summarize_import(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Import summary with only the failed products listed."""
+    return {
+        'successful': summary['successful'],
+        'failed': summary['failed'],
+        'duration_seconds': summary['duration_seconds'],
+        'products_per_second': summary['products_per_second'],
+        'failures': [result for result in summary['results'] if result['status'] != 'created'],
+    }
+
+
+class ImportJobRegistry:
+    """
+    Runs imports one at a time in the background and keeps the most recent jobs.
+
+    Usage:
+        jobs = ImportJobRegistry()
+        job = jobs.submit(lambda progress: service.import_products(products, progress_callback=progress),
+                          total=len(products))
+        jobs.get(job.job_id).to_dict()
+    """
+
+    def __init__(self, max_jobs: int = 50):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='product-import')
+        self._jobs: "OrderedDict[str, ImportJob]" = OrderedDict()
+        self._max_jobs = max_jobs
+        self._lock = threading.Lock()
+
+    def submit(self, run: Callable[[Callable[[Dict[str, Any]], None]], Dict[str, Any]],
+               total: int, created_by: str = 'batch_import') -> ImportJob:
+        """
+        Queues an import.
+
+        Args:
+            run: Callable receiving a progress callback and returning the import summary
+            total: Number of products in the import
+            created_by: User/system that started the import
+
+        Returns:
+            The queued job
+        """
+        job = ImportJob(total, created_by)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def _run(self, job: ImportJob, run: Callable[[Callable[[Dict[str, Any]], None]], Dict[str, Any]]) -> None:
+        job.status = 'running'
+        job.started_at = datetime.utcnow().isoformat() + 'Z'
+
+        def on_progress(progress: Dict[str, Any]) -> None:
+            job.progress = progress
+
+        try:
+            job.summary = run(on_progress)
+            job.status = 'completed'
+        except Exception as e:
+            print(f"Import job {job.job_id} failed: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = datetime.utcnow().isoformat() + 'Z'
+
+    def _prune(self) -> None:
+        # Drop the oldest finished jobs beyond the retention limit
+        excess = len(self._jobs) - self._max_jobs
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[ImportJob]:
+        with self._lock:
+            return list(reversed(self._jobs.values()))
@@ -0,0 +1,311 @@
+"""
+In-process metrics, exported in the Prometheus text format on /metrics.
+
+- makeupmatch_request_duration_seconds: every HTTP request, by route
+  template, method, status and retailer (MetricsMiddleware)
+- makeupmatch_stage_duration_seconds: the stages of the matching requests
+  (request parse, average color, index lookup, availability, product
+  metadata, scanning history, formatting, client save, response encode), by
+  stage, route and retailer
+- makeupmatch_external_call_duration_seconds: ERP and Firestore calls, by
+  system, call, route and retailer
+- collectors: cache hit ratios, queue depths and executor load, read from
+  the stats() / status() of the components when /metrics is scraped
+
+The route and retailer labels come from the request being served: the
+middleware puts them in a context variable (copied to the executor threads
+by lib.executors), handlers set the retailer once it is known. Work outside
+a request (background flushes, warm-ups) is labelled route="background".
+
+Recording is a perf_counter pair, a bisect and a short lock per observation;
+there is no dependency on prometheus_client. Retailer labels are limited to
+RETAILER_LABELS (others are reported as "other") to bound the series count.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RETAILER_LABELS = {"dm", "douglas"}
+
+# (name, type, help, [(labels, value), ...]) as returned by the collectors
+Samples = List[Tuple[Dict[str, str], float]]
+Family = Tuple[str, str, str, Samples]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Histogram with a fixed label set.
+
+    Usage:
+        histogram = Histogram("stage_duration_seconds", "Stage latency", ["stage"])
+        histogram.observe(0.012, ("index_lookup",))
+    """
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str], buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (the last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, label_values: Tuple[str, ...]):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self._series.items()]
+        for label_values, counts, total in sorted(series):
+            labels = dict(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Histograms recorded in process plus collectors evaluated on every scrape."""
+
+    def __init__(self):
+        self.histograms: List[Histogram] = []
+        self.collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str],
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        histogram = Histogram(name, help, label_names, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        families: Dict[str, Tuple[str, str, Samples]] = {}
+        for collector in self.collectors:
+            try:
+                for name, kind, help, samples in collector():
+                    families.setdefault(name, (kind, help, []))[2].extend(samples)
+            except Exception as e:
+                print(f"Metrics collector failed: {type(e).__name__}: {str(e)}")
+        for name, (kind, help, samples) in families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+request_duration = registry.histogram(
+    "makeupmatch_request_duration_seconds", "HTTP request latency.", ["route", "method", "status", "retailer"])
+stage_duration = registry.histogram(
+    "makeupmatch_stage_duration_seconds", "Latency of the stages of a request.", ["stage", "route", "retailer"])
+external_call_duration = registry.histogram(
+    "makeupmatch_external_call_duration_seconds", "Latency of ERP and Firestore calls.",
+    ["system", "call", "route", "retailer"])
+
+
+# Request labels
+
+_request_labels: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar(
+    "metrics_request_labels", default=None)
+_BACKGROUND_LABELS = {"route": "background", "retailer": "none"}
+
+
+def set_retailer(retailer: Optional[str]):
+    """Labels the current request's metrics with its retailer."""
+    labels = _request_labels.get()
+    if labels is not None:
+        retailer = str(retailer or "none").lower()
+        labels["retailer"] = retailer if retailer in RETAILER_LABELS or retailer == "none" else "other"
+
+
+def _labels() -> Dict[str, str]:
+    return _request_labels.get() or _BACKGROUND_LABELS
+
+
+def observe_stage(stage: str, seconds: float):
+    labels = _labels()
+    stage_duration.observe(seconds, (stage, labels["route"], labels["retailer"]))
+
+
+@contextmanager
+def stage(name: str):
+    """Times the block as a stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def timed_stage(name: str):
+    """Decorator form of stage() for functions that are one stage."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def external_call(system: str, call: str):
+    """Times a call to an external system ("erp", "firestore")."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        labels = _labels()
+        external_call_duration.observe(time.perf_counter() - start, (system, call, labels["route"], labels["retailer"]))
+
+
+def _route_template(router, method: str, path: str) -> str:
+    # Route path template (e.g. /get_client/{client_id}) so IDs in paths do not become labels
+    scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+    partial = None
+    for route in router.routes:
+        match, _ = route.matches(scope)
+        if match.name == "FULL":
+            return route.path
+        if match.name == "PARTIAL" and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records makeupmatch_request_duration_seconds and sets
+    the request labels for the stage and external call metrics.
+
+    Usage:
+        app.add_middleware(MetricsMiddleware)
+    """
+
+    ROUTE_CACHE_SIZE = 4096
+
+    def __init__(self, app):
+        self.app = app
+        # (method, path) -> route template; cleared when full (paths with IDs are unbounded)
+        self._routes: Dict[Tuple[str, str], str] = {}
+
+    def _route(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        route = self._routes.get(key)
+        if route is None:
+            router = getattr(scope.get("app"), "router", None)
+            route = _route_template(router, *key) if router is not None else "unmatched"
+            if len(self._routes) >= self.ROUTE_CACHE_SIZE:
+                self._routes.clear()
+            self._routes[key] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        labels = {"route": self._route(scope), "retailer": "none"}
+        token = _request_labels.set(labels)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_duration.observe(time.perf_counter() - start,
+                                     (labels["route"], scope["method"], str(status[0]), labels["retailer"]))
+            _request_labels.reset(token)
+
+
+# Collectors over the stats of the components
+
+def cache_collector(cache: str, stats: Callable[[], Dict[str, Any]]) -> Callable[[], List[Family]]:
+    """Hits, misses, evictions, entries and hit ratio of a cache with a stats() like SessionCache's."""
+    def collect() -> List[Family]:
+        values = stats()
+        labels = {"cache": cache}
+        return [
+            ("makeupmatch_cache_hits_total", "counter", "Cache hits.", [(labels, values.get("hits"))]),
+            ("makeupmatch_cache_misses_total", "counter", "Cache misses.", [(labels, values.get("misses"))]),
+            ("makeupmatch_cache_evictions_total", "counter", "Cache evictions.", [(labels, values.get("evictions"))]),
+            ("makeupmatch_cache_entries", "gauge", "Cached entries.", [(labels, values.get("entries"))]),
+            ("makeupmatch_cache_hit_ratio", "gauge", "Hits / lookups since start.", [(labels, values.get("hit_ratio"))]),
+        ]
+    return collect
+
+
+def executors_collector(status: Callable[[], Dict[str, Dict[str, Any]]]) -> Callable[[], List[Family]]:
+    """Load of the executors of lib.executors (executors_status())."""
+    def collect() -> List[Family]:
+        executors = status()
+        return [
+            ("makeupmatch_executor_workers", "gauge", "Executor threads.",
+             [({"executor": name}, values["workers"]) for name, values in executors.items()]),
+            ("makeupmatch_executor_in_flight", "gauge", "Calls running or queued on an executor.",
+             [({"executor": name}, values["in_flight"]) for name, values in executors.items()]),
+            ("makeupmatch_executor_queued", "gauge", "Calls waiting for an executor thread.",
+             [({"executor": name}, values["queued"]) for name, values in executors.items()]),
+            ("makeupmatch_executor_completed_total", "counter", "Calls completed by an executor.",
+             [({"executor": name}, values["completed"]) for name, values in executors.items()]),
+        ]
+    return collect
+
+
+def write_behind_collector(status: Callable[[], Dict[str, Any]]) -> Callable[[], List[Family]]:
+    """Depth and throughput of the write-behind queue (WriteBehindQueue.status())."""
+    def collect() -> List[Family]:
+        values = status()
+        return [
+            ("makeupmatch_write_behind_pending", "gauge", "Spooled writes not committed yet.",
+             [({}, values["pending"])]),
+            ("makeupmatch_write_behind_operations_total", "counter", "Write-behind operations by outcome.",
+             [({"outcome": outcome}, values[outcome])
+              for outcome in ("enqueued", "replayed", "flushed", "retries", "failed")]),
+            ("makeupmatch_write_behind_batches_total", "counter", "Committed write-behind batches.",
+             [({}, values["batches"])]),
+        ]
+    return collect
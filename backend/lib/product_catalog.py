@@ -0,0 +1,491 @@
+"""
+Compact in-memory product catalog.
+
+A store catalog is kept as a struct of arrays instead of a list of flat
+product dictionaries:
+- NumPy arrays for the numeric fields (Lab color, price, version count,
+  rescanned flag)
+- small integer codes into process-wide pools for brand, type and store brand
+- one __slots__ record per product for the remaining fields, with all strings
+  interned so repeated values (product lines, features, ingredient lists
+  shared by the shades of a line) are stored once
+
+Products are exposed as read-only ProductView mappings and are only
+materialized into dictionaries when a caller copies them. The nested
+'retailers' map of a product is not kept: a store catalog already has that
+store's retailer fields merged in, and the other stores are not needed.
+"""
+
+import sys
+import threading
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+_MISSING = object()
+
+# Category codes for absent fields and fields explicitly set to None
+ABSENT = -1
+NONE = -2
+
+# Per-product fields kept in the __slots__ record
+RECORD_FIELDS = ('product_id', 'gtin', 'dan', 'code', 'title', 'product_line', 'color_hex',
+                 'product_link', 'image_path', 'last_rescan', 'last_updated')
+
+# Fields never kept in a store catalog (see module docstring)
+DROPPED_FIELDS = ('retailers',)
+# Identifier fields with a hash index (value as string -> first row holding it)
+INDEXED_FIELDS = ('gtin', 'dan', 'code', 'product_id')
+
+
+def default_is_rescanned(product: Mapping) -> bool:
+    """Whether a product's color was rescanned (legacy products: updated after creation)."""
+    if 'rescanned' in product:
+        return bool(product['rescanned'])
+    return len(product.get('changes') or {}) > 1
+
+
+def _compact(value: Any) -> Any:
+    """Interns the strings of a value (recursively for dicts and lists)."""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {sys.intern(k) if isinstance(k, str) else k: _compact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_compact(v) for v in value]
+    return value
+
+
+def _index_key(record: 'ProductRecord', field: str) -> Optional[str]:
+    value = getattr(record, field)
+    if value is _MISSING or value is None or value == '':
+        return None
+    return str(value)
+
+
+def _build_index(field: str, records: List['ProductRecord']) -> Dict[str, int]:
+    """Identifier value (as string) -> first row holding it."""
+    index = {}
+    for row, record in enumerate(records):
+        key = _index_key(record, field)
+        if key is not None:
+            index.setdefault(key, row)
+    return index
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class CategoryPool:
+    """Append-only pool of category strings shared by all catalogs of the process."""
+
+    def __init__(self):
+        self._values: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def encode(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(value)
+                if code is None:
+                    code = len(self._values)
+                    self._values.append(sys.intern(value))
+                    self._codes[value] = code
+        return code
+
+    def code(self, value: str) -> int:
+        """Code of a known value, ABSENT if the value never occurred."""
+        return self._codes.get(value, ABSENT)
+
+    def decode(self, code: int) -> Optional[str]:
+        return None if code == NONE else self._values[code]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+BRANDS = CategoryPool()
+TYPES = CategoryPool()
+STORE_BRANDS = CategoryPool()
+CATEGORY_FIELDS = {'brand': BRANDS, 'type': TYPES, 'store_brand': STORE_BRANDS}
+
+
+class ProductRecord:
+    """Non-numeric fields of one product; unknown fields go to 'extra'."""
+
+    __slots__ = RECORD_FIELDS + ('extra',)
+
+    def __init__(self):
+        for field in RECORD_FIELDS:
+            setattr(self, field, _MISSING)
+        self.extra: Optional[Dict[str, Any]] = None
+
+
+# Column name -> (dtype, value for absent fields)
+COLUMNS = {
+    'lab': (float, np.nan),
+    'price': (float, np.nan),
+    'version_count': (np.int32, -1),
+    'rescanned_flag': (np.int8, -1),
+    'rescanned': (bool, False),
+    'brand_codes': (np.int16, ABSENT),
+    'type_codes': (np.int16, ABSENT),
+    'store_codes': (np.int16, ABSENT),
+}
+# Product keys served from the columns, in item order
+COLUMN_KEYS = ('color_lab', 'price', 'version_count', 'rescanned', 'brand', 'type', 'store_brand')
+CATEGORY_COLUMNS = {'brand': 'brand_codes', 'type': 'type_codes', 'store_brand': 'store_codes'}
+
+
+def _encode(product: Mapping, is_rescanned: Callable[[Mapping], bool]) -> Tuple[Dict[str, Any], ProductRecord]:
+    """Splits a product dictionary into its column values and its record."""
+    values = {name: fill for name, (_, fill) in COLUMNS.items()}
+    values['lab'] = (np.nan, np.nan, np.nan)
+    record = ProductRecord()
+    extra = {}
+
+    for key, value in product.items():
+        if key in DROPPED_FIELDS:
+            continue
+        if key == 'color_lab' and isinstance(value, (list, tuple)) and len(value) == 3 \
+                and all(_is_number(v) for v in value):
+            values['lab'] = tuple(float(v) for v in value)
+        elif key == 'price' and isinstance(value, float):
+            values['price'] = value
+        elif key == 'version_count' and _is_number(value) and int(value) == value and value >= 0:
+            values['version_count'] = int(value)
+        elif key == 'rescanned' and isinstance(value, bool):
+            values['rescanned_flag'] = int(value)
+        elif key in CATEGORY_FIELDS and (value is None or isinstance(value, str)):
+            values[f"{'store' if key == 'store_brand' else key}_codes"] = \
+                NONE if value is None else CATEGORY_FIELDS[key].encode(value)
+        elif key in RECORD_FIELDS:
+            setattr(record, key, _compact(value))
+        else:
+            extra[sys.intern(key)] = _compact(value)
+
+    if extra:
+        record.extra = extra
+    values['rescanned'] = bool(is_rescanned(product))
+    return values, record
+
+
+class ProductView(Mapping):
+    """Read-only mapping over one catalog row; copy() returns a plain dict."""
+
+    __slots__ = ('_catalog', '_row')
+
+    def __init__(self, catalog: 'ProductCatalog', row: int):
+        self._catalog = catalog
+        self._row = row
+
+    def _column_value(self, key: str) -> Any:
+        """Value of one column-backed key, _MISSING when the product has none."""
+        catalog, row = self._catalog, self._row
+        if key == 'color_lab':
+            return _MISSING if np.isnan(catalog.lab[row, 0]) else [float(v) for v in catalog.lab[row]]
+        if key == 'price':
+            return _MISSING if np.isnan(catalog.price[row]) else float(catalog.price[row])
+        if key == 'version_count':
+            count = int(catalog.version_count[row])
+            return count if count >= 0 else _MISSING
+        if key == 'rescanned':
+            flag = int(catalog.rescanned_flag[row])
+            return bool(flag) if flag >= 0 else _MISSING
+        column = CATEGORY_COLUMNS.get(key)
+        if column is not None:
+            code = int(getattr(catalog, column)[row])
+            return _MISSING if code == ABSENT else CATEGORY_FIELDS[key].decode(code)
+        return _MISSING
+
+    def _column_items(self) -> Iterator[Tuple[str, Any]]:
+        for key in COLUMN_KEYS:
+            value = self._column_value(key)
+            if value is not _MISSING:
+                yield key, value
+
+    def _items(self) -> Iterator[Tuple[str, Any]]:
+        record = self._catalog.records[self._row]
+        for field in RECORD_FIELDS:
+            value = getattr(record, field)
+            if value is not _MISSING:
+                yield field, value
+        yield from self._column_items()
+        if record.extra:
+            yield from record.extra.items()
+
+    def __getitem__(self, key: str) -> Any:
+        record = self._catalog.records[self._row]
+        if key in RECORD_FIELDS:
+            value = getattr(record, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        if record.extra and key in record.extra:
+            return record.extra[key]
+        value = self._column_value(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return (key for key, _ in self._items())
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._items())
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self._items())
+
+    def __repr__(self) -> str:
+        return f"ProductView({self.copy()!r})"
+
+
+class ProductCatalog(Sequence):
+    """
+    Compact, immutable catalog of one store's products.
+
+    Usage:
+        catalog = ProductCatalog('dm', products)
+        catalog[0]['brand'], catalog.lab, catalog.find('product-id')
+        catalog.lookup('4058172236581'), catalog.lookup_many(gtins, fields=('gtin', 'code'))
+        catalog = catalog.with_changes([('product-id', new_product_or_None)])
+    """
+
+    def __init__(self, store_brand: str, products: Iterable[Mapping] = (),
+                 is_rescanned: Callable[[Mapping], bool] = default_is_rescanned):
+        self.store_brand = store_brand
+        self._is_rescanned = is_rescanned
+        columns = {name: [] for name in COLUMNS}
+        records = []
+        for product in products:
+            values, record = _encode(product, is_rescanned)
+            for name in COLUMNS:
+                columns[name].append(values[name])
+            records.append(record)
+        self._set_columns({name: self._column_array(name, values) for name, values in columns.items()}, records)
+
+    @staticmethod
+    def _column_array(name: str, values: List[Any]) -> np.ndarray:
+        dtype, _ = COLUMNS[name]
+        if name == 'lab':
+            return np.array(values, dtype=dtype).reshape(-1, 3)
+        return np.array(values, dtype=dtype)
+
+    def _set_columns(self, columns: Dict[str, np.ndarray], records: List[ProductRecord],
+                     positions: Optional[Dict[str, int]] = None,
+                     indexes: Optional[Dict[str, Dict[str, int]]] = None) -> None:
+        for name, array in columns.items():
+            array.setflags(write=False)
+            setattr(self, name, array)
+        self.records = records
+        self.has_color = ~np.isnan(self.lab[:, 0])
+        # Identifies this catalog state in stored references (every change builds a new catalog)
+        self.version = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+        if positions is None:
+            positions = {record.product_id: row for row, record in enumerate(records)
+                         if record.product_id is not _MISSING}
+        self._positions = positions
+        # Built with every catalog (or patched by with_changes), so the indexes always match the rows
+        if indexes is None:
+            indexes = {field: _build_index(field, records) for field in INDEXED_FIELDS}
+        self._indexes: Dict[str, Dict[str, int]] = indexes
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [ProductView(self, i) for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError('catalog row out of range')
+        return ProductView(self, row)
+
+    def __iter__(self) -> Iterator[ProductView]:
+        return (ProductView(self, row) for row in range(len(self)))
+
+    def find(self, product_id: str) -> Optional[ProductView]:
+        """Product with the given product_id, or None."""
+        row = self._positions.get(product_id)
+        return None if row is None else ProductView(self, row)
+
+    def lookup(self, value: Any, fields: Sequence[str] = INDEXED_FIELDS) -> Optional[ProductView]:
+        """
+        First product whose identifier in one of fields (tried in order) equals value, or None.
+        Values are compared as strings, so GTINs match whether stored as numbers or text.
+        """
+        key = str(value)
+        for field in fields:
+            row = self._indexes[field].get(key)
+            if row is not None:
+                return ProductView(self, row)
+        return None
+
+    def lookup_many(self, values: Iterable[Any], fields: Sequence[str] = INDEXED_FIELDS) -> Dict[str, ProductView]:
+        """Products for several identifiers (see lookup); values not found are left out."""
+        found = {}
+        for value in values:
+            if value is None or value == '':
+                continue
+            product = self.lookup(value, fields)
+            if product is not None:
+                found[str(value)] = product
+        return found
+
+    def type_mask(self, product_type: Optional[str]) -> np.ndarray:
+        """Boolean row mask of the products of a type (all rows when no type is given)."""
+        if not product_type:
+            return np.ones(len(self), dtype=bool)
+        code = TYPES.code(product_type)
+        if code == ABSENT:
+            return np.zeros(len(self), dtype=bool)
+        return self.type_codes == code
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Materializes the catalog as a list of product dictionaries."""
+        return [view.copy() for view in self]
+
+    def with_changes(self, changes: Iterable[Tuple[str, Optional[Mapping]]]) -> 'ProductCatalog':
+        """
+        Returns a new catalog with products replaced, added or removed.
+
+        The catalog itself is never modified, so readers of the previous
+        catalog are not affected.
+
+        Args:
+            changes: (product_id, product) tuples; product None removes the product
+
+        Returns:
+            The updated catalog (existing products keep their position, new
+            products are appended)
+        """
+        columns = {name: getattr(self, name).copy() for name in COLUMNS}
+        records = list(self.records)
+        keep = np.ones(len(self), dtype=bool)
+        appended: Dict[str, Mapping] = {}
+        replaced: Dict[int, ProductRecord] = {}  # row -> previous record
+
+        for product_id, product in changes:
+            row = self._positions.get(product_id)
+            if row is None:
+                if product is None:
+                    appended.pop(product_id, None)
+                else:
+                    appended[product_id] = product
+                continue
+            if product is None:
+                keep[row] = False
+                continue
+            keep[row] = True
+            values, record = _encode(product, self._is_rescanned)
+            for name in COLUMNS:
+                columns[name][row] = values[name]
+            replaced.setdefault(row, self.records[row])
+            records[row] = record
+
+        if appended:
+            added = ProductCatalog(self.store_brand, appended.values(), self._is_rescanned)
+            for name in COLUMNS:
+                columns[name] = np.concatenate([columns[name], getattr(added, name)])
+            records.extend(added.records)
+            keep = np.concatenate([keep, np.ones(len(added), dtype=bool)])
+
+        if not keep.all():
+            columns = {name: array[keep] for name, array in columns.items()}
+            records = [record for record, kept in zip(records, keep) if kept]
+
+        positions = indexes = None
+        if not appended and keep.all():
+            # Rows unchanged: patch the id indexes instead of rebuilding them over the whole catalog
+            positions, indexes = self._patched_indexes(records, replaced)
+
+        catalog = ProductCatalog.__new__(ProductCatalog)
+        catalog.store_brand = self.store_brand
+        catalog._is_rescanned = self._is_rescanned
+        catalog._set_columns(columns, records, positions, indexes)
+        return catalog
+
+    def _patched_indexes(self, records: List[ProductRecord], replaced: Dict[int, ProductRecord]
+                         ) -> Tuple[Optional[Dict[str, int]], Optional[Dict[str, Dict[str, int]]]]:
+        """
+        Positions and indexes for records that replaced the given rows in
+        place, derived from this catalog's in O(changed rows). (None, None)
+        when a product_id changed, then both are rebuilt.
+        """
+        if any(records[row].product_id != old.product_id for row, old in replaced.items()):
+            return None, None
+        indexes = {}
+        for field, index in self._indexes.items():
+            changed = [(row, _index_key(old, field), _index_key(records[row], field))
+                       for row, old in replaced.items()]
+            changed = [(row, old_key, new_key) for row, old_key, new_key in changed if old_key != new_key]
+            if not changed:
+                indexes[field] = index  # Never mutated, shared with this catalog
+            elif any(old_key is not None and index.get(old_key) == row for row, old_key, _ in changed):
+                # A first occurrence moved away: the next row holding the value is unknown
+                indexes[field] = _build_index(field, records)
+            else:
+                index = dict(index)
+                for row, _, new_key in changed:
+                    if new_key is not None and (new_key not in index or row < index[new_key]):
+                        index[new_key] = row
+                indexes[field] = index
+        return self._positions, indexes
+
+    def memory_footprint(self, sample_size: int = 200) -> Dict[str, Any]:
+        """
+        Approximate memory used by the catalog.
+
+        Shared objects (interned strings, pooled categories) are counted once.
+        'dict_estimate_bytes' extrapolates the size the same products take as
+        plain dictionaries from a sample, for comparison.
+
+        Returns:
+            Dictionary with byte counts and the per-product average
+        """
+        array_bytes = sum(getattr(self, name).nbytes for name in COLUMNS) + self.has_color.nbytes
+        seen = set()
+        record_bytes = sum(_deep_sizeof(record, seen) for record in self.records)
+        index_bytes = (sys.getsizeof(self._positions) + sys.getsizeof(self.records)
+                       + sum(sys.getsizeof(index) for index in self._indexes.values()))
+        total = array_bytes + record_bytes + index_bytes
+
+        sample = [self[row].copy() for row in range(min(sample_size, len(self)))]
+        dict_estimate = 0
+        if sample:
+            seen = set()
+            dict_estimate = int(sum(_deep_sizeof(product, seen) for product in sample) / len(sample) * len(self))
+
+        return {
+            'store_brand': self.store_brand,
+            'products': len(self),
+            'array_bytes': array_bytes,
+            'record_bytes': record_bytes,
+            'index_bytes': index_bytes,
+            'total_bytes': total,
+            'bytes_per_product': round(total / len(self), 1) if len(self) else 0,
+            'dict_estimate_bytes': dict_estimate,
+        }
+
+
+def _deep_sizeof(value: Any, seen: set) -> int:
+    """sys.getsizeof including referenced objects, counting every object once."""
+    if id(value) in seen or value is _MISSING:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(_deep_sizeof(v, seen) for v in value)
+    elif isinstance(value, ProductRecord):
+        size += sum(_deep_sizeof(getattr(value, field), seen) for field in ProductRecord.__slots__)
+    return size
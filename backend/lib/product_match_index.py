@@ -0,0 +1,129 @@
+"""
+In-memory color match index for product catalogs.
+
+Keeps, per store brand, the rows of the store's ProductCatalog that have a
+color, so a match request is scored with one vectorized CIEDE2000 call over
+the catalog's Lab array instead of one colormath call per product. The index
+is rebuilt whenever the store's catalog is replaced (initial load or a product
+write), never per request.
+"""
+
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .color_tools import distances_to_colors
+from .product_catalog import ProductCatalog, ProductView
+
+
+class StoreMatchIndex:
+    """
+    Immutable snapshot of the products of one store catalog that have color information.
+
+    Attributes:
+        catalog: The catalog the snapshot was built from
+        rows: Catalog rows with a usable 'color_lab'
+        lab: (n, 3) float array of the product colors
+        rescanned: Boolean array, True where the product color was rescanned
+    """
+
+    def __init__(self, catalog: ProductCatalog):
+        self.catalog = catalog
+        self.rows = np.flatnonzero(catalog.has_color)
+        self.lab = catalog.lab[self.rows]
+        self.rescanned = catalog.rescanned[self.rows]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def mask(self, product_type: Optional[str] = None, rescanned_only: bool = False) -> np.ndarray:
+        """Boolean row mask for the given filters."""
+        mask = self.catalog.type_mask(product_type)[self.rows]
+        if rescanned_only:
+            mask &= self.rescanned
+        return mask
+
+
+class ProductMatchIndex:
+    """
+    Color match index shared by all matching entry points.
+
+    Usage:
+        index = ProductMatchIndex()
+        index.ensure('dm', catalog)
+        matches = index.query('dm', [60.1, 12.3, 18.0], limit=10)
+    """
+
+    def __init__(self):
+        self._stores: Dict[str, StoreMatchIndex] = {}
+        self._lock = threading.Lock()
+
+    def build(self, store_brand: str, catalog: ProductCatalog) -> StoreMatchIndex:
+        """(Re)builds the index of a store from its catalog."""
+        snapshot = StoreMatchIndex(catalog)
+        with self._lock:
+            self._stores[store_brand] = snapshot
+        return snapshot
+
+    def ensure(self, store_brand: str, catalog: ProductCatalog) -> StoreMatchIndex:
+        """Index of a store, rebuilt only if it was built from a different catalog."""
+        snapshot = self._stores.get(store_brand)
+        if snapshot is None or snapshot.catalog is not catalog:
+            snapshot = self.build(store_brand, catalog)
+        return snapshot
+
+    def get(self, store_brand: str) -> Optional[StoreMatchIndex]:
+        """Current snapshot of a store, or None if it has not been built yet."""
+        return self._stores.get(store_brand)
+
+    def remove(self, store_brand: str) -> None:
+        with self._lock:
+            self._stores.pop(store_brand, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stores.clear()
+
+    def query(self, store_brand: str, target_color: List[float], limit: int = 10,
+              product_type: Optional[str] = None, rescanned_only: bool = False,
+              transform: Optional[Callable[[np.ndarray], np.ndarray]] = None
+              ) -> List[Tuple[ProductView, float, np.ndarray]]:
+        """
+        Finds the products closest to a target color.
+
+        Args:
+            store_brand: Store brand to search in
+            target_color: Target color in LAB format [L, a, b]
+            limit: Maximum number of results
+            product_type: Optional product type filter
+            rescanned_only: Only consider products whose color was rescanned
+            transform: Optional vectorized transform applied to the product colors
+                before scoring (receives and returns an (n, 3) array)
+
+        Returns:
+            List of (product, distance, scored_color) tuples sorted by distance.
+            Products are read-only catalog views; copy() them to modify.
+        """
+        snapshot = self.get(store_brand)
+        if snapshot is None or not len(snapshot):
+            return []
+
+        rows = np.flatnonzero(snapshot.mask(product_type, rescanned_only))
+        if rows.size == 0 or limit <= 0:
+            return []
+
+        colors = snapshot.lab[rows]
+        if transform is not None:
+            colors = transform(colors)
+        distances = np.asarray(distances_to_colors(target_color, colors), dtype=float)
+
+        if limit < rows.size:
+            top = np.argpartition(distances, limit - 1)[:limit]
+            # Stable order among equal distances, like sorted() over the catalog
+            top = top[np.lexsort((top, distances[top]))]
+        else:
+            top = np.argsort(distances, kind='stable')
+
+        catalog = snapshot.catalog
+        return [(catalog[int(snapshot.rows[rows[i]])], float(distances[i]), colors[i]) for i in top]
@@ -0,0 +1,142 @@
+"""
+Encoding of the large product list responses.
+
+/get_results, /get_all_products, /product-data/{store_brand} and the other
+matching endpoints return lists of up to a few hundred products with
+features, ingredients and optionally the scanning history. Returned as
+dicts, FastAPI runs them through jsonable_encoder and the standard json
+module and sends them uncompressed, over store Wi-Fi. Those endpoints opt in
+to encoded_response instead, which negotiates with the request headers:
+- body: MessagePack if the client accepts application/msgpack (kiosk
+  clients) and msgpack is installed, JSON otherwise; JSON is encoded with
+  orjson when installed (RESPONSE_FAST_JSON=0 forces the json module)
+- compression by Accept-Encoding: brotli (br) if installed, then gzip;
+  bodies under RESPONSE_COMPRESS_MIN_BYTES (default 1024) are sent as is
+
+orjson, brotli and msgpack are optional; without them the responses are
+plain JSON with gzip. The benchmark is benchmarks/response_encoding_bench.py.
+"""
+
+import gzip
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from .metrics import timed_stage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+RESPONSE_FAST_JSON = os.getenv("RESPONSE_FAST_JSON", "1") != "0"
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Close to gzip's speed with smaller output; 11 is far too slow per request
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def _to_builtin(value: Any) -> Any:
+    # NumPy scalars and arrays, datetimes
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def encode_json(content: Any, fast: bool = RESPONSE_FAST_JSON) -> bytes:
+    if orjson is not None and fast:
+        return orjson.dumps(content, default=_to_builtin,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_to_builtin, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_msgpack(content: Any) -> bytes:
+    return msgpack.packb(content, default=_to_builtin, use_bin_type=True)
+
+
+def _accepted(header: Optional[str]) -> Dict[str, float]:
+    # "gzip, br;q=0.8, *;q=0" -> {"gzip": 1.0, "br": 0.8, "*": 0.0}
+    accepted = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Preferred content coding supported here: "br", "gzip" or None (identity)."""
+    accepted = _accepted(accept_encoding)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """application/msgpack if the client accepts it (and msgpack is installed), JSON otherwise."""
+    if msgpack is not None:
+        accepted = _accepted(accept)
+        for media_type in MSGPACK_MEDIA_TYPES:
+            if accepted.get(media_type, 0.0) > 0:
+                return media_type
+    return JSON_MEDIA_TYPE
+
+
+def compress(body: bytes, coding: Optional[str]) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if coding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def encode_body(content: Any, accept: Optional[str] = None,
+                accept_encoding: Optional[str] = None) -> Tuple[bytes, str, Optional[str]]:
+    """(body, media type, content coding) for content negotiated with the Accept headers."""
+    media_type = negotiate_media_type(accept)
+    body = encode_msgpack(content) if media_type != JSON_MEDIA_TYPE else encode_json(content)
+    coding = negotiate_encoding(accept_encoding) if len(body) >= RESPONSE_COMPRESS_MIN_BYTES else None
+    return compress(body, coding), media_type, coding
+
+
+@timed_stage("response_encode")
+def encoded_response(request: Request, content: Any, status_code: int = 200) -> Response:
+    """
+    Response for a JSON-compatible content, encoded and compressed as the
+    request accepts. CPU-bound for large payloads: async handlers call it with run_cpu.
+    """
+    body, media_type, coding = encode_body(
+        content, request.headers.get("accept"), request.headers.get("accept-encoding"))
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if coding:
+        headers["Content-Encoding"] = coding
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
@@ -0,0 +1,211 @@
+"""
+Write-through cache of recently created client sessions.
+
+A kiosk saves a session and, seconds later, the phone results page and the
+bundle endpoint read it back. Sessions saved by this instance are kept in a
+bounded in-memory cache (least recently used entries are evicted, entries
+expire after a TTL) and updates made through this instance are applied to the
+cached document, so those reads are served locally. Updates made by other
+instances are only seen once the entry expires, which bounds the staleness of
+a cached document by the TTL; the skin data read by the handoff never changes
+after the save.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .clients_db import _with_product_details
+
+SESSION_CACHE_MAX_ENTRIES = 2000
+SESSION_CACHE_TTL_SECONDS = 600.0
+
+
+class SessionCache:
+    """
+    Bounded LRU cache of client documents with a time to live.
+
+    Usage:
+        cache = SessionCache(max_entries=2000, ttl_seconds=600)
+        cache.put(client_id, client_document)
+        cache.update(client_id, lambda document: document.update(feedback=feedback_data))
+        features = cache.get(client_id, lambda document: document["features"])
+    """
+
+    def __init__(self, max_entries: int = SESSION_CACHE_MAX_ENTRIES, ttl_seconds: float = SESSION_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, client_id: str, document: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries.pop(client_id, None)
+            self._entries[client_id] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(document))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _live_entry(self, client_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(client_id)
+        if entry is None:
+            return None
+        expires_at, document = entry
+        if expires_at <= time.monotonic():
+            del self._entries[client_id]
+            return None
+        return document
+
+    def get(self, client_id: str, select: Callable[[Dict[str, Any]], Any] = lambda document: document) -> Any:
+        """Copy of select(document) for a cached client, None on a miss."""
+        with self._lock:
+            document = self._live_entry(client_id)
+            if document is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(client_id)
+            return copy.deepcopy(select(document))
+
+    def update(self, client_id: str, apply: Callable[[Dict[str, Any]], None]) -> None:
+        """Applies a change to a cached client document (clients not cached are left alone)."""
+        with self._lock:
+            document = self._live_entry(client_id)
+            if document is not None:
+                apply(document)
+
+    def invalidate(self, client_id: str) -> None:
+        with self._lock:
+            self._entries.pop(client_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+class CachedClientsDB:
+    """
+    Clients database front that keeps the sessions it saves in a SessionCache.
+    Saves and updates are written to the wrapped database and to the cache;
+    client and feature reads of cached sessions are served from the cache.
+    Every other attribute is served by the wrapped database.
+
+    Usage:
+        clients_db = CachedClientsDB(WriteBehindClientsDB(firestore_clients_db, "write_behind"))
+        await clients_db.get_client_all_skin_data_async(client_id)  # local hit after a save here
+    """
+
+    def __init__(self, db, cache: Optional[SessionCache] = None):
+        self.db = db
+        self.cache = cache if cache is not None else SessionCache()
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+    # Writes (written to the database first, then to the cache)
+
+    def _cache_new_client(self, client_fields: Dict[str, Any]):
+        client, _ = self.db._client_documents(**client_fields)
+        self.cache.put(client["client_id"], client)
+
+    def save_new_client(self, **client_fields):
+        self.db.save_new_client(**client_fields)
+        self._cache_new_client(client_fields)
+
+    async def save_new_client_async(self, **client_fields):
+        await self.db.save_new_client_async(**client_fields)
+        self._cache_new_client(client_fields)
+
+    @staticmethod
+    def _exit_change(exit_timestamp: str, filters: List[str], final_recommendations: List[Dict[str, Any]]):
+        def apply(client: Dict[str, Any]):
+            client.setdefault("user_flow", {})["exit_timestamp"] = exit_timestamp
+            client["recommendation_focus"] = {"filters": filters, "final_recommendations": final_recommendations}
+        return apply
+
+    def exit_update(self, client_id: str, exit_timestamp: str, filters: List[str],
+                    final_recommendations: List[Dict[str, Any]]):
+        self.db.exit_update(client_id, exit_timestamp, filters, final_recommendations)
+        self.cache.update(client_id, self._exit_change(exit_timestamp, filters, final_recommendations))
+
+    async def exit_update_async(self, client_id: str, exit_timestamp: str, filters: List[str],
+                                final_recommendations: List[Dict[str, Any]]):
+        await self.db.exit_update_async(client_id, exit_timestamp, filters, final_recommendations)
+        self.cache.update(client_id, self._exit_change(exit_timestamp, filters, final_recommendations))
+
+    def focus_update(self, client_id: str, filters: List[str], final_recommendations: List[Dict[str, Any]]):
+        self.db.focus_update(client_id, filters, final_recommendations)
+        self.cache.update(client_id, lambda client: client.update(recommendation_focus={
+            "filters": filters, "final_recommendations": final_recommendations}))
+
+    def phone_page_update(self, client_id: str, phone_page_timestamp: str):
+        self.db.phone_page_update(client_id, phone_page_timestamp)
+        self.cache.update(client_id, lambda client: client.setdefault("user_flow", {}).update(
+            phone_page_results_timestamp=phone_page_timestamp))
+
+    def save_feedback(self, client_id: str, rating: int, improvements: list, opinions: str):
+        # The cached feedback timestamp may differ from the stored one by the call duration
+        self.db.save_feedback(client_id, rating, improvements, opinions)
+        feedback_data = self.db._feedback_data(rating, improvements, opinions)
+        self.cache.update(client_id, lambda client: client.update(feedback=feedback_data))
+
+    async def save_feedback_async(self, client_id: str, rating: int, improvements: list, opinions: str):
+        await self.db.save_feedback_async(client_id, rating, improvements, opinions)
+        feedback_data = self.db._feedback_data(rating, improvements, opinions)
+        self.cache.update(client_id, lambda client: client.update(feedback=feedback_data))
+
+    def update_client(self, client: Dict[str, Any]):
+        self.db.update_client(client)
+        self.cache.invalidate(client["client_id"])
+
+    # Reads
+
+    def get_client(self, client_id: str) -> Dict[str, Any]:
+        client = self.cache.get(client_id)
+        return client if client is not None else self.db.get_client(client_id)
+
+    async def get_client_async(self, client_id: str) -> Dict[str, Any]:
+        client = self.cache.get(client_id)
+        return client if client is not None else await self.db.get_client_async(client_id)
+
+    def get_client_with_product_details(self, client_id: str, products_db: Any) -> Dict[str, Any]:
+        return _with_product_details(self.get_client(client_id), products_db)
+
+    def get_client_features(self, client_id: str) -> Dict[str, Any]:
+        features = self.cache.get(client_id, lambda client: client.get("features", {}))
+        return features if features is not None else self.db.get_client_features(client_id)
+
+    async def get_client_features_async(self, client_id: str) -> Dict[str, Any]:
+        features = self.cache.get(client_id, lambda client: client.get("features", {}))
+        return features if features is not None else await self.db.get_client_features_async(client_id)
+
+    def get_client_skin_tone(self, client_id: str) -> List[float]:
+        color_dic = self.get_client_features(client_id).get("color_avg_lab", {})
+        return [color_dic.get("L", 0), color_dic.get("a", 0), color_dic.get("b", 0)]
+
+    def get_client_all_skin_data(self, client_id: str) -> Dict[str, Any]:
+        return self.get_client_features(client_id).get("colors_lab", {})
+
+    async def get_client_all_skin_data_async(self, client_id: str) -> Dict[str, Any]:
+        features = await self.get_client_features_async(client_id)
+        return features.get("colors_lab", {})
+
+    def get_client_option_data(self, client_id: str) -> Dict[str, Any]:
+        return self.get_client_features(client_id).get("option_data", {})
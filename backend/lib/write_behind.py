@@ -0,0 +1,420 @@
+"""
+Write-behind queue for client session writes.
+
+Session saves, exit updates and feedback are appended to a local disk spool
+and acknowledged right away; a background flusher writes them to Firestore in
+batches. A spool file is only removed once its batch was committed, so every
+queued write is delivered at least once, also across restarts (the spool is
+replayed on start). Until then the write is kept in memory and overlaid on
+reads of the client, so a kiosk reading its session back sees its own writes.
+"""
+
+import asyncio
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from .clients_db import _with_product_details
+from .metrics import external_call
+
+# Operations per Firestore batch (at most 3 writes each, a batch takes at most 500)
+WRITE_BEHIND_BATCH_SIZE = 100
+# Failed operations are retried with exponential backoff, then moved to the failed directory
+WRITE_BEHIND_MAX_ATTEMPTS = 8
+WRITE_BEHIND_MAX_RETRY_DELAY = 60.0
+
+
+def _write_json_atomic(path: str, data: Dict[str, Any]) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class PendingWrite:
+    """One spooled operation that has not been committed yet."""
+
+    __slots__ = ("seq", "kind", "args", "enqueued_at", "replayed", "attempts", "next_attempt_at", "path")
+
+    def __init__(self, seq: int, kind: str, args: Dict[str, Any], enqueued_at: str, path: str,
+                 replayed: bool = False):
+        self.seq = seq
+        self.kind = kind
+        self.args = args
+        self.enqueued_at = enqueued_at
+        self.path = path
+        self.replayed = replayed
+        self.attempts = 0
+        self.next_attempt_at = 0.0
+
+    @property
+    def client_id(self) -> str:
+        return self.args["client_id"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"seq": self.seq, "kind": self.kind, "args": self.args, "enqueued_at": self.enqueued_at}
+
+    def to_operation(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "args": self.args, "replayed": self.replayed}
+
+
+class WriteBehindQueue:
+    """
+    Durable queue of write operations, flushed in batches by a background thread.
+
+    Operations of the same client are written in the order they were queued; a
+    failing operation holds back the later ones of its client until it succeeds
+    or is given up.
+
+    Usage:
+        queue = WriteBehindQueue(clients_db.commit_writes, spool_dir="write_behind")
+        queue.enqueue("exit_update", {"client_id": client_id, ...})
+        queue.close()
+    """
+
+    def __init__(self,
+                 writer: Callable[[List[Dict[str, Any]]], None],
+                 spool_dir: str,
+                 batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval: float = 0.5,
+                 max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS):
+        """
+        Args:
+            writer: Writes a list of operations ({"kind", "args", "replayed"}) or raises
+            spool_dir: Directory of the disk spool (pending/ and failed/ subdirectories)
+            batch_size: Maximum number of operations passed to writer at once
+            flush_interval: Seconds between flusher runs when no operation is queued
+            max_attempts: Attempts per operation before it is moved to failed/
+        """
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.pending_dir = os.path.join(spool_dir, "pending")
+        self.failed_dir = os.path.join(spool_dir, "failed")
+        os.makedirs(self.pending_dir, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+        self._pending: "OrderedDict[int, PendingWrite]" = OrderedDict()
+        self._by_client: Dict[str, List[PendingWrite]] = {}
+        self._lock = threading.Lock()
+        self._enqueue_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._idle = threading.Condition(self._lock)
+        self._closed = False
+        self._seq = 0
+        self.stats = {
+            "enqueued": 0,
+            "replayed": 0,
+            "flushed": 0,
+            "batches": 0,
+            "retries": 0,
+            "failed": 0,
+            "last_error": None,
+            "last_flush_at": None,
+        }
+
+        self._replay()
+        self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+        self._thread.start()
+
+    def _replay(self):
+        # Pick up the operations left in the spool by the previous process
+        for filename in sorted(os.listdir(self.pending_dir)):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(self.pending_dir, filename)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                write = PendingWrite(data["seq"], data["kind"], data["args"], data["enqueued_at"], path, replayed=True)
+            except Exception as e:
+                print(f"Moving unreadable spool file {filename} to {self.failed_dir}: {e}")
+                os.replace(path, os.path.join(self.failed_dir, filename))
+                continue
+            self._add(write)
+            self._seq = max(self._seq, write.seq)
+            self.stats["replayed"] += 1
+        if self._pending:
+            print(f"Replaying {len(self._pending)} spooled client writes")
+
+    def _add(self, write: PendingWrite):
+        with self._lock:
+            self._pending[write.seq] = write
+            self._by_client.setdefault(write.client_id, []).append(write)
+
+    def enqueue(self, kind: str, args: Dict[str, Any]) -> PendingWrite:
+        """
+        Spools an operation and schedules it for writing.
+        Returns once the operation is on disk; args must contain client_id.
+        """
+        with self._enqueue_lock:
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed")
+            self._seq += 1
+            path = os.path.join(self.pending_dir, f"{self._seq:016d}.json")
+            write = PendingWrite(self._seq, kind, args, datetime.now().isoformat(), path)
+            _write_json_atomic(path, write.to_dict())
+            self._add(write)
+            self.stats["enqueued"] += 1
+        self._wakeup.set()
+        return write
+
+    def pending_for(self, client_id: str) -> List[Dict[str, Any]]:
+        """Operations of a client not committed yet, oldest first."""
+        with self._lock:
+            return [{"kind": write.kind, "args": write.args} for write in self._by_client.get(client_id, [])]
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            oldest = next(iter(self._pending.values()), None)
+            return {
+                "pending": len(self._pending),
+                "oldest_pending_at": oldest.enqueued_at if oldest else None,
+                **self.stats,
+            }
+
+    def _take_batch(self) -> List[PendingWrite]:
+        now = time.monotonic()
+        batch = []
+        held_back = set()
+        with self._lock:
+            for write in self._pending.values():
+                if write.client_id in held_back:
+                    continue
+                if write.next_attempt_at > now:
+                    # Keep the client's later operations behind the one waiting for a retry
+                    held_back.add(write.client_id)
+                    continue
+                batch.append(write)
+                if len(batch) == self.batch_size:
+                    break
+        return batch
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            batch = self._take_batch()
+            while batch:
+                self._flush(batch)
+                batch = self._take_batch()
+            with self._lock:
+                self._idle.notify_all()
+            if self._closed:
+                return
+
+    def _flush(self, batch: List[PendingWrite], failed_clients: Optional[set] = None):
+        # A failed batch is split in halves until the failing operations are isolated,
+        # so one bad operation costs O(log n) extra commits instead of holding back the batch
+        if failed_clients is None:
+            failed_clients = set()
+        batch = [write for write in batch if write.client_id not in failed_clients]
+        if not batch:
+            return
+        try:
+            with external_call("firestore", "write_behind_commit"):
+                self.writer([write.to_operation() for write in batch])
+            self._complete(batch)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                failed_clients.add(batch[0].client_id)
+                self._failed_attempt(batch[0], e)
+                return
+            print(f"Write-behind batch of {len(batch)} operations failed, splitting it: "
+                  f"{type(e).__name__}: {str(e)}")
+        middle = len(batch) // 2
+        self._flush(batch[:middle], failed_clients)
+        self._flush(batch[middle:], failed_clients)
+
+    def _complete(self, writes: List[PendingWrite]):
+        for write in writes:
+            self._drop(write)
+            try:
+                os.remove(write.path)
+            except FileNotFoundError:
+                pass
+        self.stats["flushed"] += len(writes)
+        self.stats["batches"] += 1
+        self.stats["last_flush_at"] = datetime.now().isoformat()
+
+    def _drop(self, write: PendingWrite):
+        with self._lock:
+            self._pending.pop(write.seq, None)
+            client_writes = self._by_client.get(write.client_id, [])
+            if write in client_writes:
+                client_writes.remove(write)
+            if not client_writes:
+                self._by_client.pop(write.client_id, None)
+
+    def _failed_attempt(self, write: PendingWrite, error: Exception):
+        write.attempts += 1
+        self.stats["last_error"] = f"{type(error).__name__}: {str(error)}"
+        if write.attempts >= self.max_attempts:
+            print(f"Giving up {write.kind} of client {write.client_id} after {write.attempts} attempts: "
+                  f"{self.stats['last_error']}")
+            self._drop(write)
+            os.replace(write.path, os.path.join(self.failed_dir, os.path.basename(write.path)))
+            self.stats["failed"] += 1
+            return
+        self.stats["retries"] += 1
+        write.next_attempt_at = time.monotonic() + min(WRITE_BEHIND_MAX_RETRY_DELAY, 0.5 * 2 ** write.attempts)
+
+    def wait_until_flushed(self, timeout: Optional[float] = None) -> bool:
+        """Waits until no operation is pending; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._wakeup.set()
+                self._idle.wait(remaining if remaining is not None else self.flush_interval)
+        return True
+
+    def close(self, timeout: float = 10.0):
+        """
+        Stops accepting operations and flushes what can be written within timeout.
+        Operations still pending stay in the spool and are replayed on the next start.
+        """
+        with self._enqueue_lock:
+            self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+
+
+class WriteBehindClientsDB:
+    """
+    ClientsDBFirestore front that queues session saves, exit updates and feedback
+    in a WriteBehindQueue and overlays the queued writes on reads of the client.
+    Every other attribute is served by the wrapped ClientsDBFirestore.
+
+    Usage:
+        clients_db = WriteBehindClientsDB(ClientsDB.create(type="firestore", client=db), "write_behind")
+        await clients_db.save_new_client_async(**client_fields)  # returns once spooled
+    """
+
+    def __init__(self, db, spool_dir: str, **queue_options):
+        self.db = db
+        self.queue = WriteBehindQueue(db.commit_writes, spool_dir, **queue_options)
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+    # Writes
+
+    def save_new_client(self, **client_fields):
+        self.queue.enqueue("save_new_client", client_fields)
+
+    async def save_new_client_async(self, **client_fields):
+        await asyncio.to_thread(self.save_new_client, **client_fields)
+
+    def exit_update(self, client_id: str, exit_timestamp: str, filters: List[str],
+                    final_recommendations: List[Dict[str, Any]]):
+        self.queue.enqueue("exit_update", {
+            "client_id": client_id,
+            "exit_timestamp": exit_timestamp,
+            "filters": filters,
+            "final_recommendations": final_recommendations,
+        })
+
+    async def exit_update_async(self, client_id: str, exit_timestamp: str, filters: List[str],
+                                final_recommendations: List[Dict[str, Any]]):
+        await asyncio.to_thread(self.exit_update, client_id, exit_timestamp, filters, final_recommendations)
+
+    def save_feedback(self, client_id: str, rating: int, improvements: list, opinions: str):
+        # The feedback timestamp is taken now, so a replayed write keeps it
+        self.queue.enqueue("feedback", {
+            "client_id": client_id,
+            "feedback_data": self.db._feedback_data(rating, improvements, opinions),
+        })
+
+    async def save_feedback_async(self, client_id: str, rating: int, improvements: list, opinions: str):
+        await asyncio.to_thread(self.save_feedback, client_id, rating, improvements, opinions)
+
+    # Reads (with the pending writes of the client applied)
+
+    def _overlay(self, pending: List[Dict[str, Any]], client: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        client = copy.deepcopy(client) if client is not None else None
+        for operation in pending:
+            kind, args = operation["kind"], operation["args"]
+            if kind == "save_new_client":
+                client, _ = self.db._client_documents(**args)
+            elif client is None:
+                continue
+            elif kind == "exit_update":
+                client.setdefault("user_flow", {})["exit_timestamp"] = args["exit_timestamp"]
+                client["recommendation_focus"] = {
+                    "filters": args["filters"],
+                    "final_recommendations": args["final_recommendations"],
+                }
+            elif kind == "feedback":
+                client["feedback"] = args["feedback_data"]
+        return client
+
+    @staticmethod
+    def _saved_locally(pending: List[Dict[str, Any]]) -> bool:
+        # A pending save holds the whole client document, no read needed
+        return bool(pending) and pending[0]["kind"] == "save_new_client"
+
+    def get_client(self, client_id: str) -> Dict[str, Any]:
+        pending = self.queue.pending_for(client_id)
+        if not pending:
+            return self.db.get_client(client_id)
+        return self._overlay(pending, None if self._saved_locally(pending) else self.db.get_client(client_id))
+
+    async def get_client_async(self, client_id: str) -> Dict[str, Any]:
+        pending = self.queue.pending_for(client_id)
+        if not pending:
+            return await self.db.get_client_async(client_id)
+        client = None if self._saved_locally(pending) else await self.db.get_client_async(client_id)
+        return self._overlay(pending, client)
+
+    def get_client_with_product_details(self, client_id: str, products_db: Any) -> Dict[str, Any]:
+        return _with_product_details(self.get_client(client_id), products_db)
+
+    def get_client_features(self, client_id: str) -> Dict[str, Any]:
+        pending = self.queue.pending_for(client_id)
+        if self._saved_locally(pending):
+            return self._overlay(pending, None)["features"]
+        return self.db.get_client_features(client_id)
+
+    async def get_client_features_async(self, client_id: str) -> Dict[str, Any]:
+        pending = self.queue.pending_for(client_id)
+        if self._saved_locally(pending):
+            return self._overlay(pending, None)["features"]
+        return await self.db.get_client_features_async(client_id)
+
+    def get_client_skin_tone(self, client_id: str) -> List[float]:
+        color_dic = self.get_client_features(client_id).get("color_avg_lab", {})
+        return [color_dic.get("L", 0), color_dic.get("a", 0), color_dic.get("b", 0)]
+
+    def get_client_all_skin_data(self, client_id: str) -> Dict[str, Any]:
+        return self.get_client_features(client_id).get("colors_lab", {})
+
+    async def get_client_all_skin_data_async(self, client_id: str) -> Dict[str, Any]:
+        features = await self.get_client_features_async(client_id)
+        return features.get("colors_lab", {})
+
+    def get_client_option_data(self, client_id: str) -> Dict[str, Any]:
+        return self.get_client_features(client_id).get("option_data", {})
+
+    def get_client_landmarks(self, client_id: str) -> Any:
+        pending = self.queue.pending_for(client_id)
+        if self._saved_locally(pending):
+            return pending[0]["args"].get("face_landmarks")
+        return self.db.get_client_landmarks(client_id)
+
+    def close(self, timeout: float = 10.0):
+        self.queue.close(timeout)
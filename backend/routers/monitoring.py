@@ -8,6 +8,8 @@ from pydantic import BaseModel
 import firebase_admin
 from firebase_admin import auth
 
+from lib.auth import verify_token
+
 class HeartbeatRequest(BaseModel):
   status: str = ""  # e.g., "online", "offline", "error"
 
@@ -64,8 +66,8 @@ async def verify_firebase_token(authorization: str = Header(None)) -> dict:
             print("ERROR: Firebase Admin SDK is not initialized!")
             raise HTTPException(status_code=500, detail="Firebase Admin SDK not initialized")
         
-        # Verify the token with Firebase Admin SDK
-        decoded_token = auth.verify_id_token(token)
+        # Verify the token with Firebase Admin SDK (cached per token, see lib/auth.py)
+        decoded_token = await verify_token(token)
         return decoded_token
         
     except ValueError as e:
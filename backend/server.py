@@ -2,7 +2,11 @@
 # Activate your Python virtual environment (e.g., conda activate makeup-match or source venv/bin/activate)
 # uvicorn server:app --reload --host 0.0.0.0 --port 8001
 
+import time
+IMPORT_STARTED = time.perf_counter()
+
 import random
+import asyncio
 from fastapi import FastAPI, HTTPException, Request, File, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
@@ -11,10 +15,18 @@ from typing import List, Dict, Any
 import io
 import csv
 from lib import color_tools
-from lib.foundation_matching import FoundationMatching
 from lib.foundation_matching_service import FoundationMatchingService
 from lib.firestore_product_service import FirestoreProductService
-from lib.clients_db import ClientsDB
+from lib.clients_db import ClientsDB, rehydrate_client
+from lib.import_jobs import ImportJobRegistry, summarize_import
+from lib.write_behind import WriteBehindClientsDB
+from lib.session_cache import CachedClientsDB, SessionCache
+from lib.executors import executors_status, install_default_executor, cpu_executor, io_executor, run_cpu, run_io
+from lib.auth import token_verifier, verify_token
+from lib.responses import encoded_response
+from lib.boot import BootPipeline
+from lib.metrics import (PROMETHEUS_CONTENT_TYPE, MetricsMiddleware, cache_collector, executors_collector,
+                         registry as metrics_registry, set_retailer, stage, write_behind_collector)
 # from lib.face_feature_extraction import FaceFeatureExtractor
 import base64
 import os
@@ -22,13 +34,14 @@ import uvicorn
 import shutil
 import uuid
 import json
+import tempfile
 from datetime import datetime
 from PIL import Image
 from io import BytesIO
 from routers.monitoring import register_device_monitoring_endpoints
 import firebase_admin
 from firebase_admin import credentials, auth as firebase_auth
-from functools import wraps
+from functools import partial, wraps
 
 # Authentication decorator for protected endpoints
 def require_auth(func):
@@ -87,17 +100,17 @@ def require_auth(func):
                     detail="Authentication service not available"
                 )
             
-            # Verify the token with Firebase Admin SDK
-            decoded_token = firebase_auth.verify_id_token(token)
+            # Verify the token with Firebase Admin SDK (cached per token, see lib/auth.py)
+            decoded_token = await verify_token(token)
             
             # Add user info to request state
             request.state.user = decoded_token
             
-            # Call the function (handle both sync and async)
+            # Call the function (handle both sync and async); sync handlers block, keep them off the event loop
             if asyncio.iscoroutinefunction(func):
                 return await func(*args, **kwargs)
             else:
-                return func(*args, **kwargs)
+                return await run_io(func, *args, **kwargs)
             
         except ValueError:
             raise HTTPException(
@@ -125,17 +138,41 @@ def require_auth(func):
     
     return wrapper
 
+# /readyz reports ready once the catalog warm-ups ran too, failed ones included (set to 0 to take traffic right after the critical steps)
+READY_AFTER_WARMUP = os.getenv("READY_AFTER_WARMUP", "1") != "0"
+
+
 class ServerConfig:
     def __init__(self, questions_path="questions.json"):
         self.questions_path = questions_path
         self.questions = None
+        self.firestore_service = None
+        self.fm_service = None
+        self._fm = None
         self.app = FastAPI()
         self.booting()
 
     def booting(self):
         print("Starting server...")
-        
-        # Initialize Firestore service
+        # Independent steps run concurrently; the import waits for the critical
+        # ones only, the catalogs and color conversions warm up in the background
+        self.boot = BootPipeline(imports_seconds=time.perf_counter() - IMPORT_STARTED)
+        self.boot.add("firestore", self.init_firestore)
+        self.boot.add("firebase_admin", self.init_firebase_admin)
+        self.boot.add("questions", self.load_questions)
+        self.boot.add("fm_service", self.init_fm_service, requires=["firestore"])
+        self.boot.add("warm_color_tools", color_tools.warm_up, critical=False)
+        for store_brand in FoundationMatchingService.STORE_BRANDS:
+            self.boot.add(f"warm_catalog_{store_brand}", partial(self.warm_catalog, store_brand),
+                          requires=["fm_service"], critical=False)
+        self.boot.start()
+        self.boot.wait()
+        # Fail the import with the step's error instead of an AttributeError further down
+        self.boot.raise_for_failures()
+        print(f"Critical boot steps finished in {time.perf_counter() - self.boot.started:.2f}s "
+              f"(server imports {self.boot.imports_seconds:.2f}s)")
+
+    def init_firestore(self):
         try:
             # Check if running on GCP or locally
             service_account_path = None
@@ -159,32 +196,37 @@ class ServerConfig:
                 database_id=os.getenv('FIRESTORE_DATABASE_ID', 'your-firestore-database-id')
             )
             print("Firestore service initialized successfully")
-            use_firestore = True
         except Exception as e:
             print(f"Firestore initialization failed: {e}")
             print("Falling back to local file system")
             self.firestore_service = None
-            use_firestore = False
-        
-        # Initialize foundation matching service
+
+    def init_fm_service(self):
         self.fm_service = FoundationMatchingService(
             firestore_service=self.firestore_service,
-            use_firestore=use_firestore
+            use_firestore=self.firestore_service is not None
         )
-        
-        # Keep backward compatibility
-        self.fm = FoundationMatching(store_brand="dm")
 
+    @property
+    def fm(self):
+        # Kept for backward compatibility; the legacy matcher loads its local JSON on first use
+        if self._fm is None:
+            from lib.foundation_matching import FoundationMatching
+            self._fm = FoundationMatching(store_brand="dm")
+        return self._fm
+
+    def load_questions(self):
         if os.path.exists(self.questions_path):
             with open(self.questions_path, "r", encoding="utf-8") as f:
                 self.questions = json.load(f)
                 print("Questions loaded successfully")
 
+    def init_firebase_admin(self):
         # Initialize Firebase Admin SDK for authentication
         if not firebase_admin._apps:
             try:
                 # Try to use service account key file
-                cred = credentials.Certificate(f'../{key_filename}')
+                cred = credentials.Certificate('../key_firebase.json')
                 firebase_admin.initialize_app(cred)
                 print("Firebase Admin SDK initialized with service account")
             except Exception as e:
@@ -197,19 +239,102 @@ class ServerConfig:
                     print(f"Failed to initialize Firebase Admin with default credentials: {e2}")
                     print("WARNING: Firebase authentication will not work!")
 
+    def warm_catalog(self, store_brand: str):
+        # Loads the catalog and builds its match index before the first request needs it
+        self.fm_service.get_products(store_brand)
+        self.fm_service.get_product_types(store_brand)
+
+    @property
+    def ready(self) -> bool:
+        return self.boot.finished(critical_only=not READY_AFTER_WARMUP)
+
 server = ServerConfig()
 clients_db = None
 if server.firestore_service:
     print("Using Firestore for client data storage")
-    clients_db = ClientsDB().create(type="firestore", client=server.firestore_service.db)
+    # The summary loads in the background; a local snapshot of it speeds up restarts
+    firestore_clients_db = ClientsDB().create(
+        type="firestore",
+        client=server.firestore_service.db,
+        async_client=server.firestore_service.async_db,
+        snapshot_path=os.getenv("CLIENTS_SUMMARY_SNAPSHOT",
+                                os.path.join(tempfile.gettempdir(), "clients_summary_snapshot.json.gz")),
+        skin_tone_classifier=server.fm_service.classify_skin_tone
+    )
+    # Session saves, exit updates and feedback go through a disk spool and are
+    # written to Firestore in the background (set the spool to a persistent volume)
+    clients_db = WriteBehindClientsDB(
+        firestore_clients_db,
+        spool_dir=os.getenv("CLIENTS_WRITE_BEHIND_DIR", os.path.join(tempfile.gettempdir(), "clients_write_behind"))
+    )
 else:
-    print("Using local file system for client data storage")
-    clients_db = ClientsDB().create(type="dummy")  # Placeholder, will be replaced below
+    print("Using SQLite for client data storage")
+    clients_db = ClientsDB().create(
+        type="sqlite",
+        db_path=os.getenv("CLIENTS_SQLITE_PATH", os.path.join("clients", "clients.db")),
+        skin_tone_classifier=server.fm_service.classify_skin_tone
+    )
+# Sessions saved here are read back by the phone results page and the bundle
+# endpoint shortly after; serve those reads from memory
+clients_db = CachedClientsDB(clients_db, SessionCache(
+    max_entries=int(os.getenv("CLIENTS_SESSION_CACHE_SIZE", "2000")),
+    ttl_seconds=float(os.getenv("CLIENTS_SESSION_CACHE_TTL", "600"))
+))
+
+metrics_registry.add_collector(cache_collector("client_sessions", clients_db.cache.stats))
+metrics_registry.add_collector(cache_collector("auth_tokens", token_verifier.stats))
+metrics_registry.add_collector(executors_collector(executors_status))
+if hasattr(clients_db, "queue"):
+    metrics_registry.add_collector(write_behind_collector(clients_db.queue.status))
+metrics_registry.add_collector(lambda: [
+    ("makeupmatch_ready", "gauge", "1 once the boot (and warm-up) finished.", [({}, int(server.ready))]),
+    ("makeupmatch_clients_summary_ready", "gauge", "1 once the clients summary is loaded.", [({}, int(clients_db.ready))]),
+])
+# Scrapers authenticate with this bearer token when it is set
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Product imports larger than this run as background jobs
+BATCH_IMPORT_SYNC_LIMIT = 500
+import_jobs = ImportJobRegistry()
 
 
 app = server.app
 
 
+@app.on_event("startup")
+async def use_io_executor():
+    # asyncio.to_thread (used by the libraries) runs on the sized I/O executor
+    install_default_executor()
+
+
+@app.on_event("startup")
+async def schedule_token_revocation_checks():
+    token_verifier.start()
+
+
+@app.on_event("shutdown")
+async def stop_token_revocation_checks():
+    await token_verifier.stop()
+
+
+@app.on_event("shutdown")
+def flush_clients_db():
+    # Unflushed writes stay spooled and are replayed on the next start
+    clients_db.close()
+    clients_db.save_snapshot()
+    cpu_executor.shutdown(wait=False)
+    io_executor.shutdown(wait=False)
+
+
+def summary_not_ready_response():
+    # 503 with the load progress while the clients summary is still loading
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Clients summary is still loading", "load_state": clients_db.load_state},
+        headers={"Retry-After": "5"}
+    )
+
+
 # Enable CORS
 origins = [
     "http://localhost",  # Allow access from localhost
@@ -231,6 +356,9 @@ app.add_middleware(
     expose_headers=["*"],  # Add this to expose custom headers
 )
 
+# Request latency and the labels of the stage metrics (see lib/metrics.py)
+app.add_middleware(MetricsMiddleware)
+
 register_device_monitoring_endpoints(app)
 
 @app.post("/get_results")
@@ -240,40 +368,44 @@ async def get_results(request: Request):
         # Generate a unique user ID
         user_id = str(uuid.uuid4())
 
-        body = await request.json()
-        print("Received JSON:", body)
+        with stage("request_parse"):
+            body = await request.json()
+            print("Received JSON:", body)
 
-        answers = body["answers"]
-        config = body["config"]
-        store_brand = config["store_name"]
-        store_location = config["store_location"]
-        browser_name = config.get("browser_name", "unknown")
+            answers = body["answers"]
+            config = body["config"]
+            store_brand = config["store_name"]
+            store_location = config["store_location"]
+            browser_name = config.get("browser_name", "unknown")
+            set_retailer(store_brand)
 
-        camera_block_index = next((i for i, x in enumerate(answers) if x["type"] == "camera"), None)
-        camera_block = answers[camera_block_index] if camera_block_index is not None else None
-        if not camera_block:
-            raise HTTPException(status_code=400, detail="Camera block not found")
+            camera_block_index = next((i for i, x in enumerate(answers) if x["type"] == "camera"), None)
+            camera_block = answers[camera_block_index] if camera_block_index is not None else None
+            if not camera_block:
+                raise HTTPException(status_code=400, detail="Camera block not found")
 
-        # Remove the image from the JSON
-        answers[camera_block_index]["image"] = ""
+            # Remove the image from the JSON
+            answers[camera_block_index]["image"] = ""
 
-        # Process the sensor data
-        scan_block_index = next((i for i, x in enumerate(answers) if x["type"] == "scan"), None)
-        scan_block = answers[scan_block_index] if scan_block_index is not None else None
-        if not scan_block:
-            raise HTTPException(status_code=400, detail="Scan block not found")
+            # Process the sensor data
+            scan_block_index = next((i for i, x in enumerate(answers) if x["type"] == "scan"), None)
+            scan_block = answers[scan_block_index] if scan_block_index is not None else None
+            if not scan_block:
+                raise HTTPException(status_code=400, detail="Scan block not found")
 
         colors = scan_block["scanResult"]
-        avarage_color = server.fm_service.compute_average_color(colors)
-        hex_colors = [color_tools.lab_to_hex(*color) for color in colors]
+        with stage("average_color"):
+            avarage_color = await run_cpu(server.fm_service.compute_average_color, colors)
+            hex_colors, avarage_color_hex = await run_cpu(
+                lambda: ([color_tools.lab_to_hex(*color) for color in colors], color_tools.lab_to_hex(*avarage_color)))
         print(avarage_color)
         client = {
-            "color": color_tools.lab_to_hex(*avarage_color),
+            "color": avarage_color_hex,
         }
         scan_block["scanResult_hex"] = hex_colors
 
         scan_block["avarage_color"] = avarage_color
-        scan_block["avarage_color_hex"] = color_tools.lab_to_hex(*avarage_color)
+        scan_block["avarage_color_hex"] = avarage_color_hex
 
         # Process the option data
         option_data = {}
@@ -286,74 +418,55 @@ async def get_results(request: Request):
 
         # Process the received JSON as needed
         # Return a JSON response
-        products = server.fm_service.match_foundation(
+        products = await server.fm_service.match_foundation_async(
             target_color=avarage_color,
             store_brand=store_brand,
             store_location=store_location,
             length=100
         )
+        # Catalog facets and product lookups (Firestore reads on a cold cache): I/O executor
+        product_types, recommendation_refs = await run_io(
+            lambda: (server.fm_service.get_product_types(store_brand),
+                     server.fm_service.recommendation_refs(store_brand, products)))
 
         
 
         # Add a timestamp
         timestamp = datetime.now().isoformat()
-        feedback_questionary = [
-            "Did you had a product on your mind before coming to the store?",
-            "Did you try the recommended products?",
-            "Was the recommended product in a store?",
-            "Did you change your mind after using the Makeup Match?",
-            "How many products did you try before buying?",
-            "Which product did you buy?", 
-            "What is the most important factor when buying a teint product?",
-            "Do you have preferences for a specific brand?",
-            "Would you switch to a different brand if the product has better color match?",
-            "Comments"
-            ]
-        feedback_dict = [{"question": question, "answer": ""} for question in feedback_questionary]
-        client_info = {
-            "client_id": user_id,
-            "timestamp_mm": timestamp,
-            "info_mm": answers,
-            "photo_path": "",
-            "timestamp_feedback": None,
-            "info_feedback": feedback_dict,
-        }
         # Save the return information
         return_info = {
             "user_id": user_id,
             "timestamp": timestamp,
             "client": client,
             "products": products,
-            "product_types": server.fm_service.get_product_types(store_brand)
+            "product_types": product_types
         }
-        if server.firestore_service:
-            print("Saving client info to Firestore")
-            try:
-                clients_db.save_new_client( 
+        # With Firestore this is only spooled; the write-behind queue writes it in the background
+        print("Saving client info")
+        try:
+            with stage("client_save"):
+                await clients_db.save_new_client_async(
                     client_id=user_id,
                     face_landmarks=camera_block,
                     colors_lab=colors,
                     colors_hex=hex_colors,
                     color_avg_lab=avarage_color,
-                    color_avg_hex=color_tools.lab_to_hex(*avarage_color),
+                    color_avg_hex=avarage_color_hex,
                     option_data=option_data,
                     retailer=store_brand,
                     store_location=store_location,
                     browser_name=browser_name,
                     clarity_id="", # TODO: save clarity id
                     result_page_timestamp=timestamp,
-                    recommendation_results=products,
+                    recommendation_refs=recommendation_refs,
                 )
-                print(f"Successfully saved client {user_id} to Firestore")
-            except Exception as firestore_error:
-                print(f"Firestore save error: {type(firestore_error).__name__}: {str(firestore_error)}")
-                print(f"Firestore error details: {repr(firestore_error)}")
-                # Continue execution but log the error
-        else:
-            print("Saving client info to local file system")
-            clients_db.save_new_client(client_info)
+            print(f"Saved client {user_id}")
+        except Exception as save_error:
+            print(f"Client save error: {type(save_error).__name__}: {str(save_error)}")
+            print(f"Client save error details: {repr(save_error)}")
+            # Continue execution but log the error
         # clients_db.save_result(user_id, return_info)
-        return return_info
+        return await run_cpu(encoded_response, request, return_info)
     except Exception as e:
         print(f"Error in get_results: {type(e).__name__}: {str(e)}")
         print(f"Error details: {repr(e)}")
@@ -370,15 +483,16 @@ async def get_results_without_saving(request: Request):
         store_brand = body.get("store_brand", "dm")
         store_location = body.get("store_location", "D522")
         length = body.get("length", 100)
+        set_retailer(store_brand)
 
-        products = server.fm_service.match_foundation(
+        products = await server.fm_service.match_foundation_async(
             target_color=avarage_color,
             store_brand=store_brand,
             store_location=store_location,
             length=length,
             include_scanning_history=True
         )
-        return {"products": products}
+        return await run_cpu(encoded_response, request, {"products": products})
     except Exception as e:
         print(f"Error in get_results_without_saving: {type(e).__name__}: {str(e)}")
         import traceback
@@ -394,8 +508,9 @@ async def get_products_without_saving(request: Request):
         store_brand = body.get("store_brand", "dm")
         store_location = body.get("store_location", "D522")
         length = body.get("length", 100)
+        set_retailer(store_brand)
 
-        products = server.fm_service.match_foundation(
+        products = await server.fm_service.match_foundation_async(
             target_color=avarage_color,
             store_brand=store_brand,
             store_location=store_location,
@@ -403,7 +518,7 @@ async def get_products_without_saving(request: Request):
             include_scanning_history=True,
             only_rescanned=False
         )
-        return {"products": products}
+        return await run_cpu(encoded_response, request, {"products": products})
     except Exception as e:
         print(f"Error in get_results_without_saving: {type(e).__name__}: {str(e)}")
         import traceback
@@ -412,14 +527,14 @@ async def get_products_without_saving(request: Request):
 
 
 @app.get("/get_results_by_user_id/{user_id}")
-async def get_results_by_user_id(user_id: str):
+async def get_results_by_user_id(user_id: str, request: Request):
     # dummy implementation
     try:
         try:
             # skin_tone = clients_db.get_client_skin_tone(user_id)
-            skin_data = clients_db.get_client_all_skin_data(user_id)
+            skin_data = await clients_db.get_client_all_skin_data_async(user_id)
             color_points = [[point["L"], point["a"], point["b"]] for key, point in skin_data.items()]
-            skin_tone = server.fm_service.compute_average_color(color_points)
+            skin_tone = await run_cpu(server.fm_service.compute_average_color, color_points)
         except Exception as skin_tone_error:
             print(f"Error retrieving skin tone for user {user_id}: {type(skin_tone_error).__name__}: {str(skin_tone_error)}")
             skin_tone = [0,0,0]
@@ -432,11 +547,12 @@ async def get_results_by_user_id(user_id: str):
         else:
             avarage_color = skin_tone
         client = {
-            "color": color_tools.lab_to_hex(*avarage_color),
+            "color": await run_cpu(color_tools.lab_to_hex, *avarage_color),
         }
         store_brand = "dm"
         store_location = "D522"
-        products = server.fm_service.match_foundation(
+        set_retailer(store_brand)
+        products = await server.fm_service.match_foundation_async(
             target_color=avarage_color,
             store_brand=store_brand,
             store_location=store_location,
@@ -449,9 +565,9 @@ async def get_results_by_user_id(user_id: str):
             "timestamp": timestamp,
             "client": client,
             "products": products,
-            "product_types": server.fm_service.get_product_types(store_brand)
+            "product_types": await run_io(server.fm_service.get_product_types, store_brand)
         }
-        return return_info
+        return await run_cpu(encoded_response, request, return_info)
     except Exception as e:
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -464,14 +580,13 @@ async def user_flow_exit(user_id: str, request: Request):
         body = await request.json()
         filters = body.get("filters", {})
         final_recommendations = body.get("final_recommendations", [])
-        if server.firestore_service:
-            print(f"Recording user flow exit for user {user_id} in Firestore")
-            clients_db.exit_update(
-                user_id, 
-                exit_timestamp=datetime.now().isoformat(), 
-                filters=filters, 
-                final_recommendations=final_recommendations
-            )
+        print(f"Recording user flow exit for user {user_id}")
+        await clients_db.exit_update_async(
+            user_id,
+            exit_timestamp=datetime.now().isoformat(), 
+            filters=filters, 
+            final_recommendations=final_recommendations
+        )
         return {"message": "User flow exit recorded"}
     except Exception as e:
         print(f"Error in user_flow_exit: {type(e).__name__}: {str(e)}")
@@ -491,17 +606,14 @@ async def submit_feedback(request: Request):
         if not user_id or not rating:
             raise HTTPException(status_code=400, detail="user_id and rating are required")
 
-        if server.firestore_service:
-            print(f"Submitting feedback for user {user_id} to Firestore")
-            clients_db.save_feedback(
-                user_id, 
-                rating=rating,
-                improvements=improvements,
-                opinions=opinions
-            )
-            return {"message": "Feedback submitted successfully"}
-        else:
-            raise HTTPException(status_code=503, detail="Firestore service not available")
+        print(f"Submitting feedback for user {user_id}")
+        await clients_db.save_feedback_async(
+            user_id,
+            rating=rating,
+            improvements=improvements,
+            opinions=opinions
+        )
+        return {"message": "Feedback submitted successfully"}
     except Exception as e:
         print(f"Error in submit_feedback: {type(e).__name__}: {str(e)}")
         import traceback
@@ -513,34 +625,119 @@ async def submit_feedback(request: Request):
 @require_auth
 async def get_clients_db(request: Request):
     try:
-        if server.firestore_service:
-            print("Fetching all clients from Firestore")
-            return clients_db.generate_summary_table()
-        else:
-            print("Clients DB not available")
+        if not clients_db.ready:
+            return summary_not_ready_response()
+        print("Fetching all clients")
+        return await run_cpu(clients_db.generate_summary_table)
     except Exception as e:
         print(f"Error in get_clients_db: {type(e).__name__}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
     
+@app.get("/clients_db/status")
+@require_auth
+async def get_clients_db_status(request: Request):
+    """Load progress of the clients summary (status: loading, ready or failed)."""
+    status = {"ready": clients_db.ready, **clients_db.load_state, "session_cache": clients_db.cache.stats()}
+    if hasattr(clients_db, "queue"):
+        status["write_behind"] = clients_db.queue.status()
+    return status
+
+@app.get("/clients_db/page")
+@require_auth
+async def get_clients_db_page(request: Request,
+                              date_from: str = None,
+                              date_to: str = None,
+                              retailer: str = None,
+                              store_location: str = None,
+                              has_feedback: bool = None,
+                              rating: int = None,
+                              order: str = "desc",
+                              limit: int = 50,
+                              cursor: str = None):
+    """
+    Filtered, paginated clients summary (newest first by default).
+    Pass next_cursor of a response as cursor to get the following page.
+    """
+    try:
+        if not 1 <= limit <= 1000:
+            raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+        
+        return await run_io(
+            clients_db.summary_page,
+            limit=limit,
+            cursor=cursor,
+            date_from=date_from,
+            date_to=date_to,
+            retailer=retailer,
+            store_location=store_location,
+            has_feedback=has_feedback,
+            rating=rating,
+            order=order
+        )
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        print(f"Error in get_clients_db_page: {type(e).__name__}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
+    
+@app.get("/analytics/aggregates")
+@require_auth
+async def get_analytics_aggregates(request: Request,
+                                   retailer: str = None,
+                                   store_location: str = None,
+                                   date_from: str = None,
+                                   date_to: str = None,
+                                   group_by: str = "day",
+                                   top: int = 10):
+    """
+    Session counts, completion rate, average rating, top final recommendations and
+    skin tone mix per retailer, store location and day (group_by: day, store, retailer or all).
+    """
+    try:
+        if not clients_db.ready:
+            return summary_not_ready_response()
+        if not 1 <= top <= 100:
+            raise HTTPException(status_code=400, detail="top must be between 1 and 100")
+        
+        return await run_cpu(
+            clients_db.analytics.query,
+            retailer=retailer,
+            store_location=store_location,
+            date_from=date_from,
+            date_to=date_to,
+            group_by=group_by,
+            top=top
+        )
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        print(f"Error in get_analytics_aggregates: {type(e).__name__}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
+
 @app.get("/download_clients_db")
 @require_auth
-async def download_clients_db(request: Request):
+async def download_clients_db(request: Request, compress: bool = False):
     try:
-        if server.firestore_service:
-            print("Downloading clients DB from Firestore")
-            
-            # Generate CSV content using the clients_db method
-            csv_content = clients_db.generate_csv_stream()
-            
-            # Create streaming response
-            return StreamingResponse(
-                io.BytesIO(csv_content.encode('utf-8')),
-                media_type="text/csv",
-                headers={"Content-Disposition": "attachment; filename=clients_summary.csv"}
-            )
-        else:
-            raise HTTPException(status_code=503, detail="Firestore service not available")
-            
+        if not clients_db.ready:
+            return summary_not_ready_response()
+        print("Downloading clients DB")
+        
+        # CSV rows are generated and sent chunk by chunk; compress=true
+        # downloads a gzip file instead
+        csv_chunks = await run_io(clients_db.generate_csv_stream, compress=compress)
+        filename = "clients_summary.csv.gz" if compress else "clients_summary.csv"
+        
+        # Create streaming response
+        return StreamingResponse(
+            csv_chunks,
+            media_type="application/gzip" if compress else "text/csv",
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+        
     except ValueError as ve:
         print(f"Data error in download_clients_db: {str(ve)}")
         raise HTTPException(status_code=404, detail=str(ve))
@@ -552,7 +749,7 @@ async def download_clients_db(request: Request):
 @require_auth
 async def get_history(request: Request, user_id: str):
     try:
-        return_info = clients_db.get_result(user_id)
+        return_info = await run_io(clients_db.get_result, user_id)
         return return_info
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="User ID not found")
@@ -565,7 +762,7 @@ async def get_history(request: Request, user_id: str):
 async def get_all_clients(request: Request):
     try:
         # Return the metadata of all clients
-        return JSONResponse(content=clients_db.get_all_clients())
+        return JSONResponse(content=await run_io(clients_db.get_all_clients))
     except Exception as e:
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -574,8 +771,21 @@ async def get_all_clients(request: Request):
 @require_auth
 async def get_client_endpoint(request: Request, client_id: str):
     try:
-        client = clients_db.get_client(client_id)
-        return client
+        client = await clients_db.get_client_async(client_id)
+        # Sessions store recommendation references; resolve them from the catalog
+        return await run_io(rehydrate_client, client, server.fm_service)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/get_client_landmarks/{client_id}")
+@require_auth
+async def get_client_landmarks(request: Request, client_id: str):
+    try:
+        return {"client_id": client_id,
+                "face_landmarks": await run_io(clients_db.get_client_landmarks, client_id)}
+    except ValueError as ve:
+        raise HTTPException(status_code=404, detail=str(ve))
     except Exception as e:
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -584,7 +794,7 @@ async def get_client_endpoint(request: Request, client_id: str):
 @require_auth
 async def get_client_with_product_details(request: Request, client_id: str):
     try:
-        client = clients_db.get_client_with_product_details(client_id, server.fm_service)
+        client = await run_io(clients_db.get_client_with_product_details, client_id, server.fm_service)
         if not client:
             raise HTTPException(status_code=404, detail="Client not found")
 
@@ -600,7 +810,7 @@ async def update_client_endpoint(request: Request):
     try:
         body = await request.json()
         client = body["client"]
-        clients_db.update_client(client)
+        await run_io(clients_db.update_client, client)
         return JSONResponse(content={"message": "Client updated successfully"})
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -638,7 +848,14 @@ async def bundle_products(request: Request):
         store_name = body.get("store_name", "D522")
         product_id = body.get("product_id", "")
 
-        product = server.fm_service.get_product_by_gtin(store_brand, product_id)
+        # The product lookup and the client read are independent; run them concurrently
+        product, features = await asyncio.gather(
+            run_io(server.fm_service.get_product_by_gtin, store_brand, product_id),
+            clients_db.get_client_features_async(user_id),
+            return_exceptions=True
+        )
+        if isinstance(product, Exception):
+            raise product
         
         if not product:
             raise HTTPException(status_code=404, detail="Main product not found")
@@ -692,13 +909,14 @@ async def bundle_products(request: Request):
         
         try: 
             # Get personalized bundle
-            features = clients_db.get_client_features(user_id)
+            if isinstance(features, Exception):
+                raise features
             option_data = features.get("option_data", {})
             hair_color = option_data.get("hair_color", "")
             skin_type = option_data.get("skin_type", "")
             skin_color = features.get("color_avg_lab", {})
             cie_lab = [skin_color.get("L", 0), skin_color.get("a", 0), skin_color.get("b", 0)]
-            personalized_bundle = server.fm_service.bundle_match(hair_color=hair_color, skin_type=skin_type, skin_color=cie_lab, retail=store_brand, store_id=store_name)
+            personalized_bundle = await run_io(server.fm_service.bundle_match, hair_color=hair_color, skin_type=skin_type, skin_color=cie_lab, retail=store_brand, store_id=store_name)
             response["bundle"] = personalized_bundle
         except Exception as e:
             print(f"Error fetching personalized bundle: {str(e)}")
@@ -715,10 +933,11 @@ async def bundle_products(request: Request):
 @require_auth
 def get_foundation_data(request: Request, store_brand: str):
     try:
+        set_retailer(store_brand)
         products = server.fm_service.get_products(store_brand)
         if not products:
             raise HTTPException(status_code=404, detail="Store brand not found or no data available")
-        return {"data": products}
+        return encoded_response(request, {"data": products.to_dicts()})
     except Exception as e:
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -747,8 +966,9 @@ async def search_products(request: Request):
         
         if not target_color or not store_brand:
             raise HTTPException(status_code=400, detail="color and store_brand are required")
+        set_retailer(store_brand)
         
-        products = server.fm_service.match_foundation(
+        products = await server.fm_service.match_foundation_async(
             target_color=target_color,
             store_brand=store_brand,
             store_location=store_location,
@@ -756,7 +976,7 @@ async def search_products(request: Request):
             product_type=product_type
         )
         
-        return {"products": products}
+        return await run_cpu(encoded_response, request, {"products": products})
         
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -782,6 +1002,16 @@ async def get_cache_info(request: Request):
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.get("/cache/memory")
+@require_auth
+async def get_cache_memory(request: Request):
+    """Memory footprint of the in-RAM product catalogs"""
+    try:
+        return {"catalogs": await run_cpu(server.fm_service.get_memory_report)}
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/questions")
 @require_auth
 def get_questions(request: Request):
@@ -811,7 +1041,7 @@ async def create_firestore_product(request: Request):
         if not product_id or not product_data:
             raise HTTPException(status_code=400, detail="product_id and product_data are required")
         
-        success = server.firestore_service.create_product(product_id, product_data, created_by)
+        success = await run_io(server.firestore_service.create_product, product_id, product_data, created_by)
         
         if success:
             return {"message": f"Product {product_id} created successfully"}
@@ -837,7 +1067,7 @@ async def update_firestore_product(request: Request, product_id: str):
         if not updates:
             raise HTTPException(status_code=400, detail="updates are required")
         
-        success = server.firestore_service.update_product(product_id, updates, updated_by)
+        success = await run_io(server.firestore_service.update_product, product_id, updates, updated_by)
         
         if success:
             return {"message": f"Product {product_id} updated successfully"}
@@ -848,6 +1078,38 @@ async def update_firestore_product(request: Request, product_id: str):
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/firestore/products/bulk-update")
+@require_auth
+async def bulk_update_firestore_products(request: Request):
+    """Update many products in Firestore (e.g. after a rescan session)"""
+    try:
+        if not server.firestore_service:
+            raise HTTPException(status_code=503, detail="Firestore service not available")
+
+        body = await request.json()
+        items = body.get("updates", [])
+        updated_by = body.get("updated_by", "api_user")
+
+        if not items:
+            raise HTTPException(status_code=400, detail="updates list is required")
+
+        results = await run_io(server.firestore_service.bulk_update_products, items, updated_by)
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+
+        return {
+            "message": "Bulk update completed",
+            "counts": counts,
+            "results": results
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/firestore/products/{product_id}")
 @require_auth
 async def get_firestore_product(request: Request, product_id: str):
@@ -856,7 +1118,7 @@ async def get_firestore_product(request: Request, product_id: str):
         if not server.firestore_service:
             raise HTTPException(status_code=503, detail="Firestore service not available")
         
-        product = server.firestore_service.get_product_current(product_id)
+        product = await server.firestore_service.get_product_current_async(product_id)
         
         if product:
             return {"product": product}
@@ -869,16 +1131,38 @@ async def get_firestore_product(request: Request, product_id: str):
 
 @app.get("/firestore/products/{product_id}/history")
 @require_auth
-async def get_firestore_product_history(request: Request, product_id: str):
-    """Get the full history of a product from Firestore"""
+async def get_firestore_product_history(request: Request, product_id: str,
+                                        page_size: int = 50, cursor: str = None):
+    """Get one page of a product's change history (newest first) from Firestore"""
+    try:
+        if not server.firestore_service:
+            raise HTTPException(status_code=503, detail="Firestore service not available")
+        
+        history = await run_io(server.firestore_service.get_product_history, product_id, page_size=page_size,
+                               cursor=cursor)
+        if history is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return history
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/firestore/products/history/migrate")
+@require_auth
+async def migrate_firestore_product_history(request: Request):
+    """Move legacy 'changes' maps of all products into history subcollections"""
     try:
         if not server.firestore_service:
             raise HTTPException(status_code=503, detail="Firestore service not available")
         
-        # This would require adding a get_product_history method to FirestoreProductService
-        # For now, return a placeholder
-        return {"message": "Product history endpoint - to be implemented"}
+        result = await run_io(server.firestore_service.migrate_all_history)
+        return {"message": "History migration completed", **result}
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -886,29 +1170,66 @@ async def get_firestore_product_history(request: Request, product_id: str):
 @app.post("/firestore/products/batch")
 @require_auth
 async def batch_create_firestore_products(request: Request):
-    """Create multiple products in Firestore"""
+    """
+    Create multiple products in Firestore.
+    
+    Imports of up to BATCH_IMPORT_SYNC_LIMIT products (unless "background" is
+    set) complete within the request; larger ones are queued as a background
+    job whose progress is served by /firestore/products/batch/jobs/{job_id}.
+    """
     try:
         if not server.firestore_service:
             raise HTTPException(status_code=503, detail="Firestore service not available")
         
         body = await request.json()
         products = body.get("products", [])
+        created_by = body.get("created_by", "batch_import")
         
         if not products:
             raise HTTPException(status_code=400, detail="products list is required")
         
-        successful, failed = server.firestore_service.batch_create_products(products)
+        if len(products) > BATCH_IMPORT_SYNC_LIMIT or body.get("background"):
+            job = import_jobs.submit(
+                lambda progress: server.firestore_service.import_products(
+                    products, created_by=created_by, progress_callback=progress),
+                total=len(products),
+                created_by=created_by
+            )
+            return JSONResponse(status_code=202, content={
+                "message": "Batch import started",
+                "job_id": job.job_id,
+                "status_url": f"/firestore/products/batch/jobs/{job.job_id}",
+                "job": job.to_dict()
+            })
+        
+        summary = await run_io(server.firestore_service.import_products, products, created_by)
         
         return {
             "message": f"Batch creation completed",
-            "successful": successful,
-            "failed": failed
+            **summarize_import(summary)
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/firestore/products/batch/jobs")
+@require_auth
+async def list_firestore_import_jobs(request: Request):
+    """List recent product import jobs, newest first"""
+    return {"jobs": [job.to_dict() for job in import_jobs.list()]}
+
+@app.get("/firestore/products/batch/jobs/{job_id}")
+@require_auth
+async def get_firestore_import_job(request: Request, job_id: str):
+    """Get status, progress and failures of a product import job"""
+    job = import_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job.to_dict()
+
 @app.get("/firestore/store-brands")
 @require_auth
 async def get_firestore_store_brands(request: Request):
@@ -917,7 +1238,7 @@ async def get_firestore_store_brands(request: Request):
         if not server.firestore_service:
             raise HTTPException(status_code=503, detail="Firestore service not available")
         
-        brands = server.firestore_service.get_store_brands()
+        brands = await run_io(server.firestore_service.get_store_brands)
         return {"store_brands": brands}
     
     except Exception as e:
@@ -932,9 +1253,42 @@ async def get_firestore_product_types(request: Request, store_brand: str = None)
         if not server.firestore_service:
             raise HTTPException(status_code=503, detail="Firestore service not available")
         
-        product_types = server.firestore_service.get_product_types(store_brand)
+        product_types = await run_io(server.firestore_service.get_product_types, store_brand)
         return {"product_types": product_types}
-    
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/firestore/facets")
+@require_auth
+async def get_firestore_facets(request: Request):
+    """Get catalog facets (brands, types per store, counts, price ranges)"""
+    try:
+        if not server.firestore_service:
+            raise HTTPException(status_code=503, detail="Firestore service not available")
+
+        return {"facets": await run_io(server.firestore_service.get_catalog_facets)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/firestore/facets/rebuild")
+@require_auth
+async def rebuild_firestore_facets(request: Request):
+    """Recompute the catalog facets document from the products collection"""
+    try:
+        if not server.firestore_service:
+            raise HTTPException(status_code=503, detail="Firestore service not available")
+
+        facets = await run_io(server.firestore_service.rebuild_facets)
+        return {"message": "Catalog facets rebuilt", "facets": facets}
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -942,7 +1296,7 @@ async def get_firestore_product_types(request: Request, store_brand: str = None)
 @app.post("/firestore/products/color-match")
 @require_auth
 async def firestore_color_match(request: Request):
-    """Match products by color using Firestore"""
+    """Match products by color using the cached catalog match index"""
     try:
         if not server.firestore_service:
             raise HTTPException(status_code=503, detail="Firestore service not available")
@@ -956,8 +1310,10 @@ async def firestore_color_match(request: Request):
         
         if not target_color or not store_brand:
             raise HTTPException(status_code=400, detail="color and store_brand are required")
+        set_retailer(store_brand)
         
-        products = server.firestore_service.match_products_by_color(
+        products = await run_cpu(
+            server.fm_service.match_products_by_color,
             target_color=target_color,
             store_brand=store_brand,
             product_type=product_type,
@@ -970,6 +1326,32 @@ async def firestore_color_match(request: Request):
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: boot steps completed (catalogs warm unless READY_AFTER_WARMUP=0); failed steps are listed,
+    failed warm-ups do not hold back readiness."""
+    content = {"ready": server.ready, "pending": server.boot.pending(), "failed": server.boot.failed(),
+               "clients_summary_ready": clients_db.ready}
+    return JSONResponse(status_code=200 if content["ready"] else 503, content=content)
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    """Prometheus text exposition of the request, stage and external call latencies, caches and queues."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/system/boot")
+@require_auth
+async def get_boot_report(request: Request):
+    """Import time of the server module and the timing of every boot step."""
+    return server.boot.report()
+
 @app.get("/system/status")
 @require_auth
 async def get_system_status(request: Request):
@@ -979,13 +1361,15 @@ async def get_system_status(request: Request):
             "firestore_available": server.firestore_service is not None,
             "foundation_matching_service": "active",
             "cache_info": server.fm_service.get_cache_info(),
-            "supported_stores": server.fm_service.brand_list
+            "supported_stores": server.fm_service.brand_list,
+            "executors": executors_status(),
+            "auth_token_cache": token_verifier.stats()
         }
         
         if server.firestore_service:
             # Test Firestore connection
             try:
-                brands = server.firestore_service.get_store_brands()
+                brands = await run_io(server.firestore_service.get_store_brands)
                 status["firestore_connection"] = "connected"
                 status["firestore_brands"] = brands
             except Exception as e:
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from lib import auth
+from lib.auth import TokenVerifier
+
+
+class FakeVerifyIdToken:
+    """Stands in for firebase_auth.verify_id_token; blocks until release() when gated."""
+
+    def __init__(self, gated=False, error=None):
+        self.calls = 0
+        self.error = error
+        self.gate = threading.Event()
+        if not gated:
+            self.gate.set()
+
+    def release(self):
+        self.gate.set()
+
+    def __call__(self, token):
+        self.calls += 1
+        assert self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return {"uid": f"uid-{token}", "iat": time.time() - 10, "exp": time.time() + 3600}
+
+
+@pytest.fixture
+def verify_id_token(monkeypatch):
+    def install(**options):
+        fake = FakeVerifyIdToken(**options)
+        monkeypatch.setattr(auth.firebase_auth, "verify_id_token", fake)
+        return fake
+    return install
+
+
+def test_verified_tokens_are_cached(verify_id_token):
+    fake = verify_id_token()
+    verifier = TokenVerifier(revocation_check_seconds=0)
+
+    async def scenario():
+        first = await verifier.verify("t1")
+        first["changed"] = True  # Callers get copies
+        return first, await verifier.verify("t1")
+
+    first, second = asyncio.run(scenario())
+    assert fake.calls == 1
+    assert second["uid"] == "uid-t1" and "changed" not in second
+    assert verifier.stats()["hits"] == 1
+
+
+def test_concurrent_requests_share_one_verification(verify_id_token):
+    fake = verify_id_token(gated=True)
+    verifier = TokenVerifier(revocation_check_seconds=0)
+
+    async def scenario():
+        requests = [asyncio.ensure_future(verifier.verify("t1")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        fake.release()
+        return await asyncio.gather(*requests)
+
+    results = asyncio.run(scenario())
+    assert fake.calls == 1
+    assert [result["uid"] for result in results] == ["uid-t1"] * 3
+    assert verifier._pending == {}
+
+
+def test_cancelled_first_request_does_not_cancel_the_shared_verification(verify_id_token):
+    fake = verify_id_token(gated=True)
+    verifier = TokenVerifier(revocation_check_seconds=0)
+
+    async def scenario():
+        first = asyncio.ensure_future(verifier.verify("t1"))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(verifier.verify("t1"))
+        await asyncio.sleep(0.05)
+        first.cancel()  # E.g. the client disconnected
+        await asyncio.sleep(0.05)
+        fake.release()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario())["uid"] == "uid-t1"
+    assert fake.calls == 1
+    assert verifier._pending == {}
+    # The result was cached although its first caller was gone
+    assert asyncio.run(verifier.verify("t1"))["uid"] == "uid-t1"
+    assert fake.calls == 1
+
+
+def test_cancelled_only_request_still_caches_the_result(verify_id_token):
+    fake = verify_id_token(gated=True)
+    verifier = TokenVerifier(revocation_check_seconds=0)
+
+    async def scenario():
+        request = asyncio.ensure_future(verifier.verify("t1"))
+        await asyncio.sleep(0.05)
+        request.cancel()
+        fake.release()
+        # Let the verification finish on the I/O executor
+        for _ in range(100):
+            if not verifier._pending:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    assert verifier._pending == {}
+    assert verifier.stats()["entries"] == 1
+
+
+def test_failed_verification_is_raised_to_every_caller_and_not_cached(verify_id_token):
+    fake = verify_id_token(gated=True, error=ValueError("invalid token"))
+    verifier = TokenVerifier(revocation_check_seconds=0)
+
+    async def scenario():
+        requests = [asyncio.ensure_future(verifier.verify("t1")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        fake.release()
+        return await asyncio.gather(*requests, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [str(result) for result in results] == ["invalid token"] * 2
+    assert verifier._pending == {}
+    assert verifier.stats()["entries"] == 0
@@ -0,0 +1,37 @@
+import pytest
+
+from lib.boot import BootPipeline
+
+
+def fail():
+    raise RuntimeError("no catalog")
+
+
+def run(boot):
+    boot.start()
+    assert boot.wait(critical_only=False, timeout=5)
+    return boot
+
+
+def test_failed_warm_up_counts_as_finished_and_is_listed():
+    boot = BootPipeline()
+    boot.add("firestore", lambda: None)
+    boot.add("warm_catalog_dm", fail, requires=["firestore"], critical=False)
+    run(boot)
+
+    assert boot.finished(critical_only=True)
+    assert boot.finished(critical_only=False)
+    assert boot.failed() == {"warm_catalog_dm": "RuntimeError: no catalog"}
+    boot.raise_for_failures()
+
+
+def test_failed_critical_step_is_not_finished():
+    boot = BootPipeline()
+    boot.add("firestore", fail)
+    boot.add("warm_catalog_dm", lambda: None, requires=["firestore"], critical=False)
+    run(boot)
+
+    assert not boot.finished(critical_only=True)
+    assert not boot.finished(critical_only=False)
+    with pytest.raises(RuntimeError, match="Boot step firestore failed"):
+        boot.raise_for_failures()
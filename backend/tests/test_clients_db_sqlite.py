@@ -0,0 +1,163 @@
+import threading
+
+import pytest
+
+from lib import clients_db as clients_db_module
+from lib.clients_db import ClientsDBSQLite
+from lib.clients_summary_index import decode_cursor
+
+
+def client_fields(client_id, timestamp, retailer="dm", store_location="berlin-01"):
+    return {
+        "client_id": client_id,
+        "face_landmarks": [[0.12, 0.34], [0.56, 0.78]],
+        "colors_lab": [[61.0, 11.0, 16.0], [60.0, 10.0, 15.0], [59.0, 9.0, 14.0]],
+        "colors_hex": ["#c6aa96", "#c4a995", "#c2a794"],
+        "color_avg_lab": [60.0, 10.0, 15.0],
+        "color_avg_hex": "#c4a995",
+        "option_data": {"coverage": "medium"},
+        "retailer": retailer,
+        "store_location": store_location,
+        "browser_name": "kiosk",
+        "clarity_id": None,
+        "result_page_timestamp": timestamp,
+        "recommendation_refs": {"catalog_version": "2025-06-01T00:00:00.000+00:00", "products": []},
+    }
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = ClientsDBSQLite(str(tmp_path / "clients.db"))
+    yield database
+    database.close()
+
+
+def table_rows(db):
+    connection = db._connection()
+    return (connection.execute("SELECT * FROM clients ORDER BY client_id").fetchall(),
+            connection.execute("SELECT * FROM landmarks ORDER BY client_id").fetchall())
+
+
+def test_commit_writes_twice_leaves_the_same_rows(db):
+    operations = [
+        {"kind": "save_new_client", "args": client_fields("a", "2025-06-01T12:00:00")},
+        {"kind": "save_new_client", "args": client_fields("b", "2025-06-01T12:01:00")},
+        {"kind": "exit_update", "args": {"client_id": "a", "exit_timestamp": "2025-06-01T12:05:00",
+                                         "filters": ["matte"], "final_recommendations": [{"product_id": "p1"}]}},
+        {"kind": "feedback", "args": {"client_id": "b", "feedback_data": db._feedback_data(4, ["shade"], "ok")}},
+    ]
+    db.commit_writes(operations)
+    rows = table_rows(db)
+    aggregates = db.analytics.query()
+
+    # Replayed after a crash between the commit and the removal of the spool files
+    db.commit_writes(operations)
+    assert table_rows(db) == rows
+    assert db.analytics.query() == aggregates
+    assert db.get_client("a")["user_flow"]["exit_timestamp"] == "2025-06-01T12:05:00"
+    assert db.get_client("b")["feedback"]["rating"] == 4
+    assert db.get_client_landmarks("a") == [[0.12, 0.34], [0.56, 0.78]]
+
+
+def test_commit_writes_rolls_back_the_whole_batch(db):
+    with pytest.raises(ValueError):
+        db.commit_writes([
+            {"kind": "save_new_client", "args": client_fields("a", "2025-06-01T12:00:00")},
+            {"kind": "exit_update", "args": {"client_id": "missing", "exit_timestamp": "2025-06-01T12:05:00",
+                                             "filters": [], "final_recommendations": []}},
+        ])
+    assert table_rows(db) == ([], [])
+
+
+@pytest.fixture
+def paged_db(db):
+    # Several clients per timestamp, so page boundaries fall inside a group of equal timestamps
+    db.commit_writes([
+        {"kind": "save_new_client",
+         "args": client_fields(f"c{i:02d}", f"2025-06-0{1 + i // 3}T12:00:00", retailer="dm" if i % 2 else "douglas")}
+        for i in range(14)
+    ])
+    return db
+
+
+def all_pages(db, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        page = db.summary_page(limit=limit, cursor=cursor, **filters)
+        assert not any("error" in row for row in page["rows"])
+        pages.append([row["client_id"] for row in page["rows"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def expected_order(db, order="desc", **filters):
+    return [client_id for _, client_id, _ in db._summary_query(limit=1000, order=order, **filters)]
+
+
+@pytest.mark.parametrize("order", ["desc", "asc"])
+@pytest.mark.parametrize("limit", [1, 2, 4, 5, 14, 20])
+def test_summary_pages_follow_the_keyset_across_cursors(paged_db, order, limit):
+    pages = all_pages(paged_db, limit, order=order)
+    flattened = [client_id for page in pages for client_id in page]
+    assert flattened == expected_order(paged_db, order)
+    assert len(flattened) == len(set(flattened)) == 14
+    assert all(len(page) == limit for page in pages[:-1])
+    # Ordered by (timestamp, client_id), both in the requested direction
+    keys = [paged_db.get_client(client_id)["user_flow"]["result_page_timestamp"] + client_id
+            for client_id in flattened]
+    assert keys == sorted(keys, reverse=order == "desc")
+
+
+def test_summary_page_cursor_is_the_last_row_key(paged_db):
+    page = paged_db.summary_page(limit=4)
+    last = page["rows"][-1]["client_id"]
+    assert decode_cursor(page["next_cursor"]) == (
+        paged_db.get_client(last)["user_flow"]["result_page_timestamp"], last)
+    assert page["total_clients"] == 14
+
+
+def test_summary_pages_apply_filters_across_cursors(paged_db):
+    pages = all_pages(paged_db, 3, retailer="dm", date_from="2025-06-02", date_to="2025-06-04")
+    flattened = [client_id for page in pages for client_id in page]
+    assert flattened == expected_order(paged_db, retailer="dm", date_from="2025-06-02", date_to="2025-06-04")
+    assert flattened == ["c11", "c09", "c07", "c05", "c03"]
+
+
+def test_iter_summary_rows_reads_across_fetch_boundaries(paged_db, monkeypatch):
+    monkeypatch.setattr(clients_db_module, "SQLITE_SUMMARY_FETCH_ROWS", 4)
+    assert [row["client_id"] for row in paged_db.iter_summary_rows()] == expected_order(paged_db)
+
+
+def test_concurrent_writers_are_serialized_by_transactions(tmp_path):
+    path = str(tmp_path / "clients.db")
+    # Two database objects on one file: only BEGIN IMMEDIATE orders their transactions
+    writers = [ClientsDBSQLite(path), ClientsDBSQLite(path)]
+    writers[0].save_new_client(**client_fields("shared", "2025-06-01T12:00:00"))
+    errors = []
+
+    def write(db, worker):
+        try:
+            for n in range(20):
+                db.save_new_client(**client_fields(f"w{worker}-{n}", f"2025-06-01T12:{n:02d}:00"))
+                # Every thread updates the shared row; each transaction re-reads it, so no update is lost
+                db.update_client({"client_id": "shared",
+                                  f"worker_{worker}": db.get_client("shared").get(f"worker_{worker}", 0) + 1})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(writers[worker % 2], worker)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    reader = ClientsDBSQLite(path)
+    try:
+        assert reader.summary_page(limit=1)["total_clients"] == 81
+        shared = reader.get_client("shared")
+        assert [shared[f"worker_{worker}"] for worker in range(4)] == [20] * 4
+    finally:
+        for db in writers + [reader]:
+            db.close()
@@ -0,0 +1,108 @@
+import pytest
+
+from lib.product_catalog import INDEXED_FIELDS, ProductCatalog, _build_index
+
+
+def product(product_id, gtin, dan=None, code=None, **fields):
+    return {"product_id": product_id, "gtin": gtin, "dan": dan, "code": code, **fields}
+
+
+@pytest.fixture
+def catalog():
+    return ProductCatalog("dm", [
+        product("p0", "400", dan=10, code="A", brand="Lumi", type="foundation", price=9.95,
+                color_lab=[60.0, 10.0, 15.0], version_count=2, rescanned=True),
+        product("p1", "401", dan=11, code="A"),
+        product("p2", "402", dan=12, code="B"),
+        product("p3", 403, dan=13, code="A"),
+    ])
+
+
+def assert_indexes_match(catalog):
+    """Positions and id indexes equal the ones built from scratch over the rows."""
+    assert catalog._positions == {record.product_id: row for row, record in enumerate(catalog.records)}
+    assert catalog._indexes == {field: _build_index(field, catalog.records) for field in INDEXED_FIELDS}
+
+
+def test_replace_patches_only_the_changed_indexes(catalog):
+    updated = catalog.with_changes([("p2", product("p2", "402", dan=12, code="B", price=4.5))])
+
+    assert_indexes_match(updated)
+    assert updated._positions is catalog._positions
+    assert all(updated._indexes[field] is catalog._indexes[field] for field in INDEXED_FIELDS)
+    assert updated.find("p2")["price"] == 4.5
+    assert "price" not in catalog.find("p2")
+
+
+def test_replace_moves_first_occurrences(catalog):
+    updated = catalog.with_changes([
+        # First occurrence of code A moves away: p1 now holds the first A
+        ("p0", product("p0", "400", dan=10, code="C")),
+        # p2 takes the gtin of the later row p3, which moves to a new one
+        ("p2", product("p2", "403", dan=12, code="B")),
+        ("p3", product("p3", "499", dan=13, code="A")),
+    ])
+
+    assert_indexes_match(updated)
+    assert updated.lookup("A", fields=("code",))["product_id"] == "p1"
+    assert updated.lookup("403")["product_id"] == "p2"
+    assert updated.lookup("402") is None
+    assert catalog.lookup("A", fields=("code",))["product_id"] == "p0"
+
+
+def test_replace_with_an_earlier_row_takes_over_the_first_occurrence(catalog):
+    updated = catalog.with_changes([("p1", product("p1", "401", dan=11, code="B"))])
+
+    assert_indexes_match(updated)
+    assert updated.lookup("B", fields=("code",))["product_id"] == "p1"
+
+
+def test_removal_masks_rows_and_rebuilds_indexes(catalog):
+    updated = catalog.with_changes([("p0", None), ("p2", None)])
+
+    assert_indexes_match(updated)
+    assert [view["product_id"] for view in updated] == ["p1", "p3"]
+    assert updated.find("p0") is None
+    assert updated.lookup("A", fields=("code",))["product_id"] == "p1"
+    assert len(updated.lab) == len(updated.records) == 2
+    assert len(catalog) == 4
+
+
+def test_append_replace_and_remove_together(catalog):
+    updated = catalog.with_changes([
+        ("p5", product("p5", "405", code="A")),
+        ("p1", product("p1", "401", dan=11, code="D")),
+        ("p0", None),
+        ("p6", product("p6", "406")),
+        ("p6", None),
+    ])
+
+    assert_indexes_match(updated)
+    assert [view["product_id"] for view in updated] == ["p1", "p2", "p3", "p5"]
+    assert updated.lookup("A", fields=("code",))["product_id"] == "p3"
+    assert updated.find("p6") is None
+
+
+def test_lookup_many_matches_identifiers_as_strings(catalog):
+    found = catalog.lookup_many([403, "401", "11", "", None, "missing"])
+
+    assert {value: view["product_id"] for value, view in found.items()} == {
+        "403": "p3", "401": "p1", "11": "p1"}
+    assert catalog.lookup_many(["11"], fields=("gtin", "code")) == {}
+    assert catalog.lookup_many(["A"], fields=("gtin", "code"))["A"]["product_id"] == "p0"
+
+
+def test_product_view_serves_column_keys(catalog):
+    view = catalog[0]
+
+    assert view["color_lab"] == [60.0, 10.0, 15.0]
+    assert view["price"] == 9.95
+    assert view["version_count"] == 2
+    assert view["rescanned"] is True
+    assert view["brand"] == "Lumi"
+    assert view["type"] == "foundation"
+    assert dict(view) == view.copy()
+    for key in ("price", "brand", "color_lab", "version_count", "rescanned", "store_brand", "unknown"):
+        assert key not in catalog[1]
+    with pytest.raises(KeyError):
+        catalog[1]["price"]
@@ -0,0 +1,226 @@
+import copy
+import os
+
+import pytest
+
+from lib.write_behind import WriteBehindClientsDB, WriteBehindQueue
+
+
+class FakeWriter:
+    """Commits operations in memory; a batch with an operation of a client in fail_clients fails as a whole."""
+
+    def __init__(self, fail_clients=()):
+        self.fail_clients = set(fail_clients)
+        self.calls = []
+        self.committed = []
+
+    def __call__(self, operations):
+        self.calls.append([(op["args"]["client_id"], op["args"].get("n")) for op in operations])
+        if any(op["args"]["client_id"] in self.fail_clients for op in operations):
+            raise RuntimeError("commit failed")
+        self.committed.extend((op["args"]["client_id"], op["args"].get("n"), op["replayed"]) for op in operations)
+
+
+@pytest.fixture
+def make_queue(tmp_path, monkeypatch):
+    # No flusher thread: the tests run _take_batch and _flush themselves
+    monkeypatch.setattr(WriteBehindQueue, "_run", lambda self: None)
+    spool_dir = str(tmp_path / "spool")
+
+    def make(writer, **options):
+        return WriteBehindQueue(writer, spool_dir, **options)
+
+    return make
+
+
+def flush(queue):
+    queue._flush(queue._take_batch())
+
+
+def spooled(queue, directory="pending"):
+    return sorted(os.listdir(queue.pending_dir if directory == "pending" else queue.failed_dir))
+
+
+def test_pending_operations_are_replayed_after_restart(make_queue):
+    queue = make_queue(FakeWriter())
+    for n in range(3):
+        queue.enqueue("exit_update", {"client_id": "a", "n": n})
+    assert len(spooled(queue)) == 3
+    queue.close()
+
+    with open(os.path.join(queue.pending_dir, "0000000000000099.json"), "w") as f:
+        f.write("{not json")
+    writer = FakeWriter()
+    restarted = make_queue(writer)
+    assert restarted.stats["replayed"] == 3
+    assert spooled(restarted, "failed") == ["0000000000000099.json"]
+    assert restarted.pending_for("a") == [{"kind": "exit_update", "args": {"client_id": "a", "n": n}}
+                                          for n in range(3)]
+
+    # New operations are numbered after the replayed ones
+    assert restarted.enqueue("exit_update", {"client_id": "a", "n": 3}).seq == 4
+    flush(restarted)
+    assert writer.committed == [("a", 0, True), ("a", 1, True), ("a", 2, True), ("a", 3, False)]
+    assert spooled(restarted) == []
+    assert len(restarted) == 0
+
+
+def test_retry_holds_back_later_operations_of_the_client(make_queue):
+    writer = FakeWriter(fail_clients={"a"})
+    queue = make_queue(writer)
+    a1 = queue.enqueue("exit_update", {"client_id": "a", "n": 1})
+    a2 = queue.enqueue("exit_update", {"client_id": "a", "n": 2})
+    queue.enqueue("exit_update", {"client_id": "b", "n": 1})
+
+    flush(queue)
+    assert writer.committed == [("b", 1, False)]
+    assert (a1.attempts, a2.attempts) == (1, 0)
+    assert queue.stats["retries"] == 1
+
+    # While a1 waits for its retry, a2 must not overtake it; other clients go on
+    c1 = queue.enqueue("exit_update", {"client_id": "c", "n": 1})
+    assert queue._take_batch() == [c1]
+    flush(queue)
+
+    writer.fail_clients.clear()
+    a1.next_attempt_at = 0.0
+    assert queue._take_batch() == [a1, a2]
+    flush(queue)
+    assert writer.committed == [("b", 1, False), ("c", 1, False), ("a", 1, False), ("a", 2, False)]
+    assert spooled(queue) == []
+
+
+def test_failed_batch_is_split_to_isolate_the_failing_operation(make_queue):
+    writer = FakeWriter(fail_clients={"bad"})
+    queue = make_queue(writer)
+    for n in range(8):
+        queue.enqueue("exit_update", {"client_id": "bad" if n == 5 else f"c{n}", "n": n})
+
+    flush(queue)
+    assert [n for _, n, _ in writer.committed] == [0, 1, 2, 3, 4, 6, 7]
+    # 8 -> [0-3] ok, [4-7] -> [4, 5] -> [4] ok, [5] fails; [6, 7] ok
+    assert [[n for _, n in call] for call in writer.calls] == [
+        list(range(8)), [0, 1, 2, 3], [4, 5, 6, 7], [4, 5], [4], [5], [6, 7]]
+    assert len(queue) == 1
+    assert queue.stats["retries"] == 1
+    assert queue.stats["flushed"] == 7
+
+
+def test_operation_moves_to_failed_after_max_attempts(make_queue):
+    writer = FakeWriter(fail_clients={"a"})
+    queue = make_queue(writer, max_attempts=2)
+    a1 = queue.enqueue("feedback", {"client_id": "a", "n": 1})
+    a2 = queue.enqueue("feedback", {"client_id": "a", "n": 2})
+
+    queue._flush([a1])
+    assert a1.attempts == 1
+    assert spooled(queue, "failed") == []
+
+    a1.next_attempt_at = 0.0
+    queue._flush([a1])
+    assert spooled(queue, "failed") == [os.path.basename(a1.path)]
+    assert spooled(queue) == [os.path.basename(a2.path)]
+    assert queue.stats["failed"] == 1
+    assert queue.stats["last_error"] == "RuntimeError: commit failed"
+
+    # Giving up releases the client's later operations
+    writer.fail_clients.clear()
+    assert queue._take_batch() == [a2]
+    flush(queue)
+    assert writer.committed == [("a", 2, False)]
+
+
+class FakeClientsDB:
+    """Stores client documents in memory; commit_writes applies the queued operations."""
+
+    def __init__(self):
+        self.clients = {}
+        self.reads = 0
+
+    @staticmethod
+    def _client_documents(client_id, color_avg_lab, **fields):
+        data = {
+            "client_id": client_id,
+            "features": {"color_avg_lab": dict(zip("Lab", color_avg_lab))},
+            "user_flow": {},
+            "recommendation_focus": {},
+            "recommendations": fields.get("recommendations", []),
+        }
+        return data, {}
+
+    @staticmethod
+    def _feedback_data(rating, improvements, opinions):
+        return {"rating": rating, "improvements": improvements, "opinions": opinions}
+
+    def commit_writes(self, operations):
+        for operation in operations:
+            kind, args = operation["kind"], operation["args"]
+            if kind == "save_new_client":
+                self.clients[args["client_id"]], _ = self._client_documents(**args)
+            elif kind == "exit_update":
+                client = self.clients[args["client_id"]]
+                client["user_flow"]["exit_timestamp"] = args["exit_timestamp"]
+                client["recommendation_focus"] = {"filters": args["filters"],
+                                                  "final_recommendations": args["final_recommendations"]}
+            elif kind == "feedback":
+                self.clients[args["client_id"]]["feedback"] = args["feedback_data"]
+
+    def get_client(self, client_id):
+        self.reads += 1
+        return copy.deepcopy(self.clients[client_id])
+
+    def get_client_features(self, client_id):
+        return self.get_client(client_id)["features"]
+
+
+@pytest.fixture
+def write_behind_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(WriteBehindQueue, "_run", lambda self: None)
+    return WriteBehindClientsDB(FakeClientsDB(), str(tmp_path / "spool"))
+
+
+def test_reads_overlay_pending_writes_of_a_new_client(write_behind_db):
+    db = write_behind_db.db
+    write_behind_db.save_new_client(client_id="a", color_avg_lab=[60.0, 10.0, 15.0])
+    write_behind_db.exit_update("a", "2025-06-01T12:05:00", ["matte"], [{"product_id": "p1"}])
+
+    # The pending save holds the whole document: no read of the database
+    client = write_behind_db.get_client("a")
+    assert db.reads == 0
+    assert client["user_flow"]["exit_timestamp"] == "2025-06-01T12:05:00"
+    assert client["recommendation_focus"]["filters"] == ["matte"]
+    assert write_behind_db.get_client_skin_tone("a") == [60.0, 10.0, 15.0]
+
+    flush(write_behind_db.queue)
+    assert write_behind_db.queue.pending_for("a") == []
+    assert write_behind_db.get_client("a") == client
+    assert db.reads == 1
+
+
+def test_reads_overlay_pending_writes_on_the_stored_client(write_behind_db):
+    db = write_behind_db.db
+    db.commit_writes([{"kind": "save_new_client", "args": {"client_id": "a", "color_avg_lab": [50, 0, 0]}}])
+    write_behind_db.save_feedback("a", 5, ["shade"], "great")
+
+    client = write_behind_db.get_client("a")
+    assert db.reads == 1
+    assert client["feedback"] == {"rating": 5, "improvements": ["shade"], "opinions": "great"}
+    assert "feedback" not in db.clients["a"]
+
+    flush(write_behind_db.queue)
+    assert db.clients["a"]["feedback"] == client["feedback"]
+
+
+class FakeProductsDB:
+    def get_products_by_gtins(self, store_brand, gtins, enrich=True):
+        return {str(gtin): {"color_hex": f"#{gtin}", "rescanned": True} for gtin in gtins}
+
+
+def test_product_details_are_added_to_the_pending_client(write_behind_db):
+    write_behind_db.save_new_client(client_id="a", color_avg_lab=[60.0, 10.0, 15.0],
+                                    recommendations=[{"product_id": "401"}])
+
+    client = write_behind_db.get_client_with_product_details("a", FakeProductsDB())
+    assert write_behind_db.db.reads == 0
+    assert client["recommendations"][0]["color_hex"] == "#401"
+    assert client["recommendations"][0]["rescanned"] is True